@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,12 +49,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.replicas.PrimaryPinMiddleware',
+    'core.sharding.ShardMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.slowquery.SlowQueryMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -89,6 +94,55 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite runs everything on local sqlite files, handy to try
+# the replica setup without postgres
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+
+# Read replicas, DB_REPLICA_HOSTS is a comma separated list of hosts
+# (or of sqlite file names with DB_ENGINE=sqlite). Reads go to a random
+# replica unless the client wrote in the last REPLICA_STALENESS_SECONDS
+REPLICA_DATABASES = []
+for index, replica in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias] = dict(DATABASES['default'], NAME=BASE_DIR / replica)
+    else:
+        DATABASES[alias] = dict(DATABASES['default'], HOST=replica)
+    # Tests read the replicas through the default test database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    REPLICA_DATABASES.append(alias)
+
+# Shards for the recipe data, DB_SHARD_HOSTS is a comma separated list
+# of hosts (or of sqlite file names with DB_ENGINE=sqlite). New users are
+# placed on one by a hash of their id, see core.sharding. The test suite
+# runs without it, core/tests/test_sharding.py adds shards of its own
+SHARD_DATABASES = []
+for index, shard in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(','))):
+    alias = f'shard_{index}'
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias] = dict(DATABASES['default'], NAME=BASE_DIR / shard)
+    else:
+        DATABASES[alias] = dict(DATABASES['default'], HOST=shard)
+    SHARD_DATABASES.append(alias)
+
+# How long workers cache which shard a user is on, a move waits this long
+# for them to notice it. The default database hands out ids up to
+# SHARD_ID_SPAN, shard n from (n + 1) * SHARD_ID_SPAN + 1 to
+# (n + 2) * SHARD_ID_SPAN. With 32-bit ids that is at most 20 shards
+SHARD_MAP_CACHE_SECONDS = int(os.environ.get('SHARD_MAP_CACHE_SECONDS', 60))
+SHARD_ID_SPAN = 10 ** 8
+
+DATABASE_ROUTERS = ['core.sharding.ShardRouter', 'core.replicas.ReplicaRouter']
+
+REPLICA_STALENESS_SECONDS = int(
+    os.environ.get('REPLICA_STALENESS_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -132,4 +186,129 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Media files are checked by Django then sent by the web server. With
+# nginx set MEDIA_ACCEL_REDIRECT to an internal location aliased to
+# MEDIA_ROOT, e.g. location /protected-media/ { internal; alias ...; }
+# With Apache/lighttpd set MEDIA_SENDFILE. Without either Django streams
+# the file itself.
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') == '1'
+# Only let the owner of a recipe download its image
+MEDIA_PRIVATE = os.environ.get('MEDIA_PRIVATE') == '1'
+
+# Uploads over this size are streamed to a temporary file instead of
+# being kept in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+# Image upload limits, checked from the file headers before decoding
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 40 * 1000 * 1000
+IMAGE_UPLOAD_MAX_DIMENSION = 10000
+IMAGE_UPLOAD_FORMATS = ('JPEG', 'PNG', 'WEBP')
+# Bigger uploads are shrunk to this size before being stored
+IMAGE_STORE_MAX_DIMENSION = 2048
+
+# Sizes recipe images can be resized to, anything else is a 404 so the
+# variant cache can't be filled with arbitrary sizes
+RECIPE_IMAGE_SIZES = ('64x64', '150x150', '300x300', '600x400', '1200x800')
+# Resized images are kept in this MEDIA_ROOT sub directory
+RECIPE_IMAGE_CACHE_DIR = 'variants'
+RECIPE_IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
 AUTH_USER_MODEL = 'core.User'
+
+REST_FRAMEWORK = {
+    # Token bucket rates: the number is the burst size, and the bucket
+    # refills over the period
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.environ.get('THROTTLE_LOGIN', '10/min'),
+        'read': os.environ.get('THROTTLE_READ', '600/min'),
+        'write': os.environ.get('THROTTLE_WRITE', '120/min'),
+        'upload': os.environ.get('THROTTLE_UPLOAD', '20/min'),
+    },
+    # Proxies in front of the app, throttles key anonymous requests on
+    # the address the last of them saw. With 0 X-Forwarded-For is
+    # ignored, as clients can put anything in it
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+# Throttle buckets live in this memory mapped file so every worker of
+# the host shares them, /dev/shm keeps it in memory on linux
+THROTTLE_STORE_PATH = os.environ.get(
+    'THROTTLE_STORE_PATH',
+    '/dev/shm/recipe-throttle' if os.path.isdir('/dev/shm')
+    else os.path.join(tempfile.gettempdir(), 'recipe-throttle')
+)
+THROTTLE_STORE_SLOTS = 65536
+
+
+# Slow query log
+# Queries slower than the threshold are logged and stored, see the
+# slow_queries management command. EXPLAIN plans are sampled on postgres.
+
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(
+    os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(
+    os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1))
+
+
+# Background tasks
+# Tasks are stored in the database and run by the run_worker command.
+# Failed tasks are retried after TASK_RETRY_BACKOFF * 2 ** (attempts - 1)
+# seconds, so 10, 20, 40 then 80 seconds after the failures
+
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BACKOFF = 10
+# Running tasks locked for longer than this are assumed lost and requeued
+TASK_LOCK_TIMEOUT = 60 * 60
+
+# Rows deleted per transaction when removing accounts or many recipes
+DELETION_BATCH_SIZE = 500
+
+# Most recipes copied by one bulk duplicate request
+RECIPE_DUPLICATE_MAX = 1000
+
+# Recipe statistics are cached per user data version, the timeout only
+# bounds how long unused entries stay around
+RECIPE_STATS_CACHE_SECONDS = 60 * 60
+
+# Recipe to tag or ingredient links of the similarity indexes each
+# worker keeps in memory, least recently used users go first. A link
+# costs about 150 bytes, so this is about 150 MB per process, and one
+# user with 100,000 recipes of 10 tags and ingredients fills it
+SIMILARITY_INDEX_MAX_LINKS = 1000000
+# The most similar recipes a client can ask for
+SIMILAR_RECIPES_MAX = 50
+
+# Most recipes returned by the "what can I cook" query
+COOKABLE_RECIPES_MAX = 100
+
+# Most tags or ingredients returned when autocompleting a name
+AUTOCOMPLETE_LIMIT = 10
+
+# Paginated lists, in the API and the admin, count rows exactly up to
+# this many, and report the planner's estimate past it
+LIST_EXACT_COUNT_LIMIT = 1000
+
+# Batch endpoint: most calls per batch, and the paths they may target
+BATCH_MAX_REQUESTS = 20
+BATCH_PATH_PREFIXES = ("/user/", "/recipe/")
+
+# Delta sync: most changes per page, and how long deletions are kept
+SYNC_PAGE_SIZE = 500
+SYNC_TOMBSTONE_DAYS = 30
+
+# API tokens expire after this long without use, and are renewed at
+# most once per interval
+AUTH_TOKEN_LIFETIME = timedelta(days=30)
+AUTH_TOKEN_RENEW_INTERVAL = timedelta(hours=1)
+
+# Responses to writes sent with an Idempotency-Key are replayed to
+# retries for this long, and a retry waits this many seconds for the
+# first attempt to finish. An attempt still unfinished after
+# IDEMPOTENCY_CLAIM_TIMEOUT is taken for dead and the next retry runs
+# again, so it has to be longer than any write takes
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_WAIT_SECONDS = 10
+IDEMPOTENCY_CLAIM_TIMEOUT = timedelta(seconds=60)
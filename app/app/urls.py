@@ -14,13 +14,27 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.urls.conf import include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from core.batch import BatchView
+from core.media import recipe_image_variant, serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('user.urls')),
     path("recipe/", include("recipe.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("batch/", BatchView.as_view(), name="batch"),
+    path(
+        f"{settings.MEDIA_URL.lstrip('/')}recipe/<int:recipe_id>/"
+        "<int:width>x<int:height>.<str:fmt>",
+        recipe_image_variant,
+        name="recipe-image-variant"
+    ),
+    re_path(
+        rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.+)$",
+        serve_media,
+        name="media"
+    ),
+]
@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.translation import gettext as _
 
 from core import models
+from core.pagination import EstimatedCountPaginator
 
 
 class UserAdmin(BaseUserAdmin):
@@ -10,6 +12,8 @@ class UserAdmin(BaseUserAdmin):
 
     ordering = ['id']
     list_display = ['email', 'name']
+    # Prefix search so the email index can be used
+    search_fields = ['^email']
     fieldsets = (
         # Here None is for the title section
         (None, {
@@ -40,7 +44,62 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class KeysetChangeList(ChangeList):
+    """Changelist offering an id based link to the next page"""
+
+    def get_results(self, request):
+        """Add the url of the page following the last displayed row"""
+
+        super().get_results(request)
+
+        # Filtering on id__lt walks the primary key index instead of
+        # making the database skip over an ever growing OFFSET
+        self.keyset_next_url = None
+        results = list(self.result_list)
+        if ORDER_VAR not in self.params and \
+                len(results) >= self.list_per_page:
+            self.keyset_next_url = self.get_query_string(
+                {"id__lt": results[-1].pk}, [PAGE_VAR]
+            )
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin for tables too big for exact counts and offset paging"""
+
+    ordering = ("-id",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    change_list_template = "admin/core/keyset_change_list.html"
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class TagAdmin(LargeTableAdmin):
+    """Admin for tags"""
+
+    list_display = ("name", "user")
+    search_fields = ("^name",)
+
+
+class IngredientAdmin(LargeTableAdmin):
+    """Admin for ingredients"""
+
+    list_display = ("name", "user")
+    search_fields = ("^name",)
+
+
+class RecipeAdmin(LargeTableAdmin):
+    """Admin for recipes"""
+
+    list_display = ("title", "user", "time_minutes", "price")
+    search_fields = ("^title",)
+    autocomplete_fields = ("tags", "ingredients")
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def reserve_shard_ids(sender, using, **kwargs):
+    from core.sharding import reserve_ids
+
+    reserve_ids(using)
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Connect the signal handlers keeping derived data up to date
+        from core import signals  # noqa: F401
+
+        # Each shard hands out ids from its own range
+        post_migrate.connect(reserve_shard_ids, sender=self)
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.models import AuthToken
+from core.sharding import activate_user
+
+
+BATCH_SIZE = 1000
+
+
+def issue_token(user, device=""):
+    """Create a new token for one of the user's devices"""
+
+    now = timezone.now()
+
+    return AuthToken.objects.create(
+        user=user, device=device[:255], created=now, last_used=now,
+        expires=now + settings.AUTH_TOKEN_LIFETIME
+    )
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """Token authentication with sliding expiry
+
+    Each use of a token moves its expiry to AUTH_TOKEN_LIFETIME from
+    now, but the row is only written once per AUTH_TOKEN_RENEW_INTERVAL
+    so busy clients don't turn every read into a write.
+    """
+
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        tokens = AuthToken.objects.select_related("user").filter(key=key)
+        token = tokens.first()
+        # A token issued moments ago may not have reached the replica yet
+        if token is None and settings.REPLICA_DATABASES:
+            token = tokens.using(DEFAULT_DB_ALIAS).first()
+        if token is None:
+            raise AuthenticationFailed(_("Invalid token."))
+
+        if not token.user.is_active:
+            raise AuthenticationFailed(_("User inactive or deleted."))
+
+        now = timezone.now()
+        if token.expires <= now:
+            raise AuthenticationFailed(_("Token has expired."))
+
+        renew_before = now - settings.AUTH_TOKEN_RENEW_INTERVAL
+        if token.last_used <= renew_before:
+            token.last_used = now
+            token.expires = now + settings.AUTH_TOKEN_LIFETIME
+            # Conditional so concurrent requests renew the token once
+            AuthToken.objects.filter(
+                key=key, last_used__lte=renew_before
+            ).update(last_used=now, expires=token.expires)
+
+        activate_user(token.user.pk)
+
+        return token.user, token
+
+
+def purge_expired_tokens(batch_size=None):
+    """Delete expired tokens in small batches, returns how many
+
+    Each batch is a short transaction over keys found by the expires
+    index, so logins and renewals are never blocked for long.
+    """
+
+    batch_size = batch_size or BATCH_SIZE
+    purged = 0
+
+    while True:
+        keys = list(
+            AuthToken.objects.filter(expires__lte=timezone.now())
+            .order_by("expires").values_list("key", flat=True)[:batch_size]
+        )
+        if not keys:
+            break
+
+        with transaction.atomic():
+            purged += AuthToken.objects.filter(
+                key__in=keys, expires__lte=timezone.now()
+            ).delete()[0]
+
+    return purged
@@ -0,0 +1,190 @@
+import json
+from contextlib import ExitStack
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.urls import Resolver404, resolve
+
+from rest_framework import serializers, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.authentication import ExpiringTokenAuthentication
+from core.models import Recipe
+from core.replicas import read_from
+from core.throttling import ReadRateThrottle, WriteRateThrottle
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Headers about the batch request itself, calls don't inherit them. Two
+# calls sharing an Idempotency-Key would replay each other's response
+PER_REQUEST_HEADERS = (
+    "HTTP_IDEMPOTENCY_KEY",
+    "HTTP_IF_MATCH",
+    "HTTP_IF_NONE_MATCH",
+    "HTTP_IF_MODIFIED_SINCE",
+    "HTTP_IF_UNMODIFIED_SINCE",
+    "HTTP_IF_RANGE",
+    "HTTP_RANGE",
+    "HTTP_CONTENT_LENGTH",
+)
+
+# Set from the batch and the call's body, a call can't change them
+FIXED_HEADERS = ("authorization", "content-length", "content-type", "host")
+
+
+class SubRequestSerializer(serializers.Serializer):
+    """One request of a batch"""
+
+    method = serializers.ChoiceField(
+        choices=("GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"),
+        default="GET"
+    )
+    path = serializers.CharField(max_length=2048)
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(
+        child=serializers.CharField(max_length=1024), required=False
+    )
+
+    def validate_path(self, path):
+        if not path.startswith(settings.BATCH_PATH_PREFIXES):
+            raise serializers.ValidationError(
+                "Only API paths can be batched"
+            )
+
+        return path
+
+    def validate_headers(self, headers):
+        fixed = [name for name in headers if name.lower() in FIXED_HEADERS]
+        if fixed:
+            raise serializers.ValidationError(
+                f"These headers can't be set per request: {', '.join(fixed)}"
+            )
+
+        return headers
+
+
+class BatchSerializer(serializers.Serializer):
+    """A list of requests to run in one round trip"""
+
+    requests = SubRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, requests):
+        if len(requests) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f"At most {settings.BATCH_MAX_REQUESTS} requests per batch"
+            )
+
+        return requests
+
+
+def _sub_request(request, method, path, body, headers):
+    """Build a request for a batched call from the batch request
+
+    The call keeps the batch's headers except the per request ones,
+    then gets its own headers on top.
+    """
+
+    url = urlsplit(path)
+    content = b"" if body is None else json.dumps(body).encode()
+
+    environ = request.META.copy()
+    for name in PER_REQUEST_HEADERS:
+        environ.pop(name, None)
+    for name, value in headers.items():
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    environ.update({
+        "REQUEST_METHOD": method,
+        "PATH_INFO": url.path,
+        "QUERY_STRING": url.query,
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(content)),
+        "wsgi.input": BytesIO(content),
+    })
+    sub_request = WSGIRequest(environ)
+
+    # The batch is already authenticated, DRF skips its authenticators
+    # when these are set
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+
+    return sub_request
+
+
+def _dispatch(request, method, path, body, headers):
+    """Run one batched call and return its status and body"""
+
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {"status": status.HTTP_404_NOT_FOUND, "body": None}
+
+    response = match.func(
+        _sub_request(request, method, path, body, headers),
+        *match.args,
+        **match.kwargs
+    )
+
+    if hasattr(response, "data"):
+        data = response.data
+    else:
+        content = response.render().content if hasattr(response, "render") \
+            else response.content
+        data = content.decode() if content else None
+
+    result = {"status": response.status_code, "body": data}
+    if response.has_header("Location"):
+        result["location"] = response["Location"]
+
+    return result
+
+
+class BatchView(APIView):
+    """Run many API requests in one round trip
+
+    Calls are dispatched in order through the URLconf, in process and
+    with the batch's authentication. When every call is a read they run
+    in one read only transaction on one database, so they see the same
+    snapshot of the data.
+    """
+
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    throttle_classes = (ReadRateThrottle, WriteRateThrottle)
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        calls = serializer.validated_data["requests"]
+
+        with ExitStack() as stack:
+            if all(call["method"] in SAFE_METHODS for call in calls):
+                alias = router.db_for_read(Recipe)
+                # Only the primary and its replicas hold every model, on
+                # a shard the shard router sends the recipe data there
+                # and the rest is read as usual
+                if alias == DEFAULT_DB_ALIAS or \
+                        alias in settings.REPLICA_DATABASES:
+                    stack.enter_context(read_from(alias))
+                stack.enter_context(transaction.atomic(using=alias))
+                if connections[alias].vendor == "postgresql":
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute(
+                            "SET TRANSACTION ISOLATION LEVEL "
+                            "REPEATABLE READ READ ONLY"
+                        )
+
+            responses = [
+                _dispatch(
+                    request, call["method"], call["path"], call.get("body"),
+                    call.get("headers", {})
+                )
+                for call in calls
+            ]
+
+        return Response({"responses": responses}, status=status.HTTP_200_OK)
@@ -0,0 +1,198 @@
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+from core.models import Tag, Ingredient, Recipe, Tombstone
+from core.sharding import data_databases, shard_for
+from core.signals import linked_ids, recipe_links, update_recipe_counts
+from core.sync import record_deletions
+from core.tasks import task
+
+
+logger = logging.getLogger("core.deletion")
+
+
+def _raw_delete(model, column, ids, using=DEFAULT_DB_ALIAS):
+    """Delete rows by id with one statement, skipping Django's collector"""
+
+    if not ids:
+        return 0
+
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(column)
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE {column} IN ({placeholders})",
+            list(ids)
+        )
+        return cursor.rowcount
+
+
+def _delete_images(names):
+    """Remove image files no recipe points at anymore"""
+
+    names = {name for name in names if name}
+    if not names:
+        return 0
+
+    # Duplicated recipes share the image file of the original
+    still_used = set()
+    for using in data_databases():
+        still_used.update(
+            Recipe.objects.using(using).filter(image__in=names)
+            .values_list("image", flat=True)
+        )
+    storage = Recipe._meta.get_field("image").storage
+    deleted = 0
+    for name in names - still_used:
+        storage.delete(name)
+        deleted += 1
+
+    return deleted
+
+
+def delete_recipes_in_batches(queryset, batch_size=None, report=None):
+    """Delete the recipes of a queryset in bounded transactions
+
+    Each batch removes the tag and ingredient links and the recipes with
+    raw deletes, image files are removed once their rows are gone.
+    Returns the number of recipes and images deleted.
+    """
+
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    report = report or logger.info
+    recipes = images = 0
+    # Never a replica, the queryset is read to delete what it finds
+    using = queryset._db or router.db_for_write(queryset.model)
+    queryset = queryset.using(using)
+
+    while True:
+        batch = list(
+            queryset.order_by("pk")
+            .values_list("pk", "image", "user_id")[:batch_size]
+        )
+        if not batch:
+            break
+
+        ids = [pk for pk, _, _ in batch]
+        by_user = defaultdict(list)
+        for pk, _, user_id in batch:
+            by_user[user_id].append(pk)
+
+        with transaction.atomic(using=using):
+            linked = linked_ids(ids, using)
+            _raw_delete(Recipe.tags.through, "recipe_id", ids, using)
+            _raw_delete(Recipe.ingredients.through, "recipe_id", ids, using)
+            recipes += _raw_delete(Recipe, "id", ids, using)
+            for model, attr_ids in linked.items():
+                update_recipe_counts(model, attr_ids, using)
+            # Raw deletes don't send the signals leaving tombstones
+            for user_id, user_recipe_ids in by_user.items():
+                record_deletions(user_id, Tombstone.KIND_RECIPE,
+                                 user_recipe_ids)
+
+        images += _delete_images(image for _, image, _ in batch)
+        report(f"Deleted {recipes} recipes")
+
+    return recipes, images
+
+
+def _delete_attrs_in_batches(model, user_id, batch_size, report):
+    """Delete the tags or ingredients of a user in bounded transactions"""
+
+    through, link_column = recipe_links(model)
+    using = shard_for(user_id)
+    deleted = 0
+
+    while True:
+        ids = list(
+            model.objects.using(using).filter(user_id=user_id)
+            .order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+
+        with transaction.atomic(using=using):
+            _raw_delete(through, link_column, ids, using)
+            deleted += _raw_delete(model, "id", ids, using)
+
+        report(f"Deleted {deleted} {model._meta.verbose_name_plural}")
+
+    return deleted
+
+
+def delete_user_data(user_id, batch_size=None, report=None):
+    """Delete a user and everything they own in bounded batches"""
+
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    report = report or logger.info
+    start = time.monotonic()
+
+    using = shard_for(user_id)
+    recipes, images = delete_recipes_in_batches(
+        Recipe.objects.using(using).filter(user_id=user_id), batch_size,
+        report
+    )
+    tags = _delete_attrs_in_batches(Tag, user_id, batch_size, report)
+    ingredients = _delete_attrs_in_batches(
+        Ingredient, user_id, batch_size, report
+    )
+
+    # Only small rows are left for the regular cascade
+    Tombstone.objects.using(using).filter(user_id=user_id).delete()
+    if using != DEFAULT_DB_ALIAS:
+        get_user_model().objects.using(using).filter(pk=user_id).delete()
+    get_user_model().objects.filter(pk=user_id).delete()
+
+    stats = {
+        "recipes": recipes,
+        "tags": tags,
+        "ingredients": ingredients,
+        "images": images,
+        "seconds": round(time.monotonic() - start, 3),
+    }
+    report(f"Deleted user {user_id}: {stats}")
+
+    return stats
+
+
+def deactivate_user(user):
+    """Lock a user out straight away and queue the deletion of their data"""
+
+    user.is_active = False
+    user.save(update_fields=["is_active"])
+
+    return delete_user.delay(user.pk)
+
+
+@task
+def delete_user(user_id):
+    """Background task deleting a deactivated user"""
+
+    user = get_user_model().objects.filter(pk=user_id).first()
+    if user is None or user.is_active:
+        # Already deleted, or the account was restored in the meantime
+        return
+
+    delete_user_data(user_id)
+
+
+@task
+def delete_recipes(user_id, recipe_ids):
+    """Background task deleting many recipes of a user"""
+
+    start = time.monotonic()
+    recipes, images = delete_recipes_in_batches(
+        Recipe.objects.using(shard_for(user_id))
+        .filter(user_id=user_id, pk__in=recipe_ids)
+    )
+    logger.info(
+        "Deleted %s recipes and %s images of user %s in %.3fs",
+        recipes, images, user_id, time.monotonic() - start
+    )
@@ -0,0 +1,97 @@
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe
+from core.sharding import shard_for
+from core.signals import linked_ids, recipe_links, update_recipe_counts
+from core.sync import allocate_seq, data_changed
+
+
+BATCH_SIZE = 500
+
+# Fields a copy gets from its own save, not from the original
+FRESH_FIELDS = ("id", "seq", "created", "updated")
+
+
+def _copy_links(model, copies, using):
+    """Link the copies like their originals with one INSERT ... SELECT
+
+    copies maps original recipe ids to the ids of their copies.
+    """
+
+    connection = connections[using]
+    through, column = recipe_links(model)
+    table = connection.ops.quote_name(through._meta.db_table)
+    recipe_id = connection.ops.quote_name("recipe_id")
+    column = connection.ops.quote_name(column)
+    cases = " ".join(["WHEN %s THEN %s"] * len(copies))
+    placeholders = ", ".join(["%s"] * len(copies))
+    params = [value for pair in copies.items() for value in pair]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({recipe_id}, {column}) "
+            f"SELECT CASE {recipe_id} {cases} END, {column} FROM {table} "
+            f"WHERE {recipe_id} IN ({placeholders})",
+            params + list(copies)
+        )
+
+
+def duplicate_recipes(user_id, recipe_ids):
+    """Copy recipes of a user, returns {original id: copy id}
+
+    Each batch inserts the copies with one statement and their tag and
+    ingredient links with one INSERT ... SELECT per link table, nothing
+    is validated again. Copies point at the image file of the original,
+    deletion only removes files no recipe uses anymore.
+    """
+
+    fields = [
+        field.attname for field in Recipe._meta.concrete_fields
+        if field.name not in FRESH_FIELDS
+    ]
+    using = shard_for(user_id, writing=True)
+    recipes = Recipe.objects.using(using)
+    originals = list(
+        recipes.filter(user_id=user_id, pk__in=recipe_ids)
+        .order_by("pk").values("pk", *fields)
+    )
+    copies = {}
+
+    for start in range(0, len(originals), BATCH_SIZE):
+        batch = originals[start:start + BATCH_SIZE]
+        with transaction.atomic(using=using):
+            first = allocate_seq(user_id, len(batch))
+            now = timezone.now()
+            # bulk_create skips save(), so the change numbers are given
+            # here, and they tell which copy is which
+            recipes.bulk_create([
+                Recipe(
+                    seq=first + offset, created=now, updated=now,
+                    **{name: original[name] for name in fields}
+                )
+                for offset, original in enumerate(batch)
+            ])
+            seqs = dict(
+                recipes.filter(
+                    user_id=user_id, seq__gte=first, seq__lt=first + len(batch)
+                ).values_list("seq", "pk")
+            )
+            batch_copies = {
+                original["pk"]: seqs[first + offset]
+                for offset, original in enumerate(batch)
+            }
+
+            for model in (Tag, Ingredient):
+                _copy_links(model, batch_copies, using)
+            linked = linked_ids(list(batch_copies), using)
+            for model, ids in linked.items():
+                update_recipe_counts(model, ids, using)
+
+        data_changed.send(
+            sender=Recipe, user_id=user_id, count=len(batch),
+            recipe_ids=list(batch_copies.values())
+        )
+        copies.update(batch_copies)
+
+    return copies
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.models import IdempotencyKey
+from core.tasks import task
+
+
+HEADER = "Idempotency-Key"
+POLL_INTERVAL = 0.1
+PURGE_INTERVAL = 60 * 60
+BATCH_SIZE = 1000
+
+
+def _keys():
+    # Claims are read back from the primary, a replica may not have
+    # seen them yet
+    return IdempotencyKey.objects.using(
+        router.db_for_write(IdempotencyKey)
+    )
+
+
+def _value(value):
+    if not isinstance(value, UploadedFile):
+        return value
+
+    content = hashlib.sha256()
+    for chunk in value.chunks():
+        content.update(chunk)
+    value.seek(0)
+
+    return [value.name, value.size, content.hexdigest()]
+
+
+def fingerprint(request):
+    """Hash a request, so a key can't be reused for a different one"""
+
+    data = request.data
+    if hasattr(data, "lists"):
+        data = {
+            key: [_value(value) for value in values]
+            for key, values in data.lists()
+        }
+
+    digest = hashlib.sha256(f"{request.method} {request.path} ".encode())
+    digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+
+    return digest.hexdigest()
+
+
+def _claim(user, key, digest):
+    """Return the key's record and whether this request created it"""
+
+    while True:
+        try:
+            with transaction.atomic(using=_keys().db):
+                record = _keys().create(
+                    user=user, key=key, fingerprint=digest
+                )
+            return record, True
+        except IntegrityError:
+            pass
+
+        record = _keys().filter(user=user, key=key).first()
+        if record is None:
+            # The first attempt failed and gave the key up
+            continue
+
+        now = timezone.now()
+        if record.created <= now - settings.IDEMPOTENCY_KEY_TTL:
+            _keys().filter(pk=record.pk).delete()
+            continue
+
+        # The worker running it died before finishing or giving it up
+        if record.status is None and \
+                record.created <= now - settings.IDEMPOTENCY_CLAIM_TIMEOUT:
+            _keys().filter(pk=record.pk, status__isnull=True).delete()
+            continue
+
+        return record, False
+
+
+def _replay(record):
+    headers = {"Idempotent-Replayed": "true"}
+    if record.location:
+        headers["Location"] = record.location
+
+    return Response(record.response, status=record.status, headers=headers)
+
+
+def _wait(record):
+    """Wait for another request running the key, None if it gave up"""
+
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while record is not None and record.status is None:
+        if time.monotonic() >= deadline:
+            return record
+        time.sleep(POLL_INTERVAL)
+        record = _keys().filter(pk=record.pk).first()
+
+    return record
+
+
+def idempotent(view):
+    """Run a view method once per Idempotency-Key header
+
+    The first request with a key runs the view and stores its response,
+    retries with the same key and request get that response replayed.
+    A retry arriving while the first is still running waits for it.
+    Server errors and exceptions give the key up so it can be retried,
+    as do attempts unfinished after IDEMPOTENCY_CLAIM_TIMEOUT.
+    """
+
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(self, request, *args, **kwargs)
+
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return Response(
+                {"detail": f"{HEADER} is too long"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        digest = fingerprint(request)
+        while True:
+            record, created = _claim(request.user, key, digest)
+            if created:
+                break
+
+            if record.fingerprint != digest:
+                return Response(
+                    {"detail": f"{HEADER} was used for another request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+
+            record = _wait(record)
+            if record is None:
+                continue
+            if record.status is None:
+                return Response(
+                    {"detail": "A request with this key is in progress"},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            return _replay(record)
+
+        if cache.add("idempotency-keys-purge", True, PURGE_INTERVAL):
+            purge_idempotency_keys.delay()
+
+        try:
+            response = view(self, request, *args, **kwargs)
+        except Exception:
+            _keys().filter(pk=record.pk).delete()
+            raise
+
+        if response.status_code >= 500:
+            _keys().filter(pk=record.pk).delete()
+        else:
+            _keys().filter(pk=record.pk).update(
+                status=response.status_code,
+                response=getattr(response, "data", None),
+                location=response.get("Location", "")
+            )
+
+        return response
+
+    return wrapper
+
+
+@task
+def purge_idempotency_keys(batch_size=None):
+    """Background task deleting expired idempotency keys, in batches"""
+
+    batch_size = batch_size or BATCH_SIZE
+    purged = 0
+
+    while True:
+        cutoff = timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+        ids = list(
+            _keys().filter(created__lte=cutoff).order_by("created")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+
+        purged += _keys().filter(pk__in=ids).delete()[0]
+
+    return purged
@@ -0,0 +1,158 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+
+# Concurrent renders are serialized on one of this many lock files
+LOCK_STRIPES = 64
+
+
+def variant_key(name, width, height, fmt):
+    """Return the cache file name of a resized image
+
+    The name of the original is part of the key, so uploading a new
+    image never serves a stale variant.
+    """
+
+    digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+
+    return f"{digest}-{width}x{height}.{fmt}"
+
+
+class VariantCache:
+    """Disk cache of rendered images with a size limit and LRU eviction
+
+    The access time of a file is bumped on every hit, eviction removes
+    the least recently used files until the cache is under its limit.
+    A running total of the cached bytes is kept in a file, so the cache
+    is only walked once a render takes it over the limit.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock_dir = os.path.join(root, ".locks")
+        self.size_path = os.path.join(self.lock_dir, "size")
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _touch(self, path):
+        """Mark a file as used without changing its modification time"""
+
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+
+    def _hit(self, path):
+        """Return True and mark the file used if it is cached"""
+
+        try:
+            self._touch(path)
+        except FileNotFoundError:
+            # Never cached, or evicted meanwhile
+            return False
+
+        return True
+
+    def get_or_render(self, key, render):
+        """Return the path of a cached file, rendering it on a miss
+
+        Requests for the same key wait for the first one to render it,
+        across threads and processes, instead of rendering it again.
+        The file can still be evicted before the caller opens it.
+        """
+
+        path = self.path_for(key)
+        if self._hit(path):
+            return path
+
+        stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) \
+            % LOCK_STRIPES
+        lock_path = os.path.join(self.lock_dir, f"{stripe}.lock")
+        with open(lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self._hit(path):
+                    return path
+
+                data = render()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(data)
+                # Readers only ever see complete files
+                os.replace(tmp_path, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self._add(len(data), keep=path)
+
+        return path
+
+    def _add(self, size, keep=None):
+        """Count a new file in the running total, evicting when over"""
+
+        fd = os.open(self.size_path, os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, "r+") as file:
+            # Held until the file closes, so evictions don't overlap
+            fcntl.flock(file, fcntl.LOCK_EX)
+            total = int(file.read() or 0) + size
+            if total > self.max_bytes:
+                # Also corrects the total when files went some other way
+                total = self.evict(keep)
+            file.seek(0)
+            file.truncate()
+            file.write(str(total))
+
+    def evict(self, keep=None):
+        """Remove the least recently used files over the size limit
+
+        Returns the size of the files left.
+        """
+
+        entries = []
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            if directory == self.lock_dir:
+                continue
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.startswith("tmp"):
+                    # Still being written
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                if path != keep:
+                    entries.append((stat.st_atime, stat.st_size, path))
+
+        if total <= self.max_bytes:
+            return total
+
+        # Going a bit under the limit avoids evicting on every render
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return total
+
+
+def get_variant_cache():
+    """Return the cache of resized recipe images"""
+
+    return VariantCache(
+        os.path.join(settings.MEDIA_ROOT, settings.RECIPE_IMAGE_CACHE_DIR),
+        settings.RECIPE_IMAGE_CACHE_MAX_BYTES
+    )
@@ -0,0 +1,185 @@
+import base64
+import logging
+from io import BytesIO
+
+from PIL import Image
+
+
+logger = logging.getLogger("core.images")
+
+# url extension -> Pillow format
+FORMATS = {
+    "jpg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+}
+
+
+class ImageRejected(ValueError):
+    """The image breaks one of the upload limits"""
+
+
+def read_header(file):
+    """Return the format and size of an image without decoding it
+
+    Pillow only parses the headers when opening a file, the pixels are
+    decoded on first access. Files too big for Pillow's own bomb check
+    are reported as rejected.
+    """
+
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            return image.format, image.width, image.height
+    except Image.DecompressionBombError:
+        raise ImageRejected("Image has too many pixels")
+    finally:
+        file.seek(position)
+
+
+def check_limits(file, max_bytes, max_pixels, max_dimension, formats):
+    """Raise ImageRejected if the upload breaks one of the limits
+
+    Only the file size and the image headers are looked at, so a
+    decompression bomb is refused before any pixel is decoded.
+    """
+
+    size = getattr(file, "size", None)
+    if size is not None and size > max_bytes:
+        raise ImageRejected(f"Image files can't be over {max_bytes} bytes")
+
+    image_format, width, height = read_header(file)
+    if image_format not in formats:
+        raise ImageRejected(f"{image_format} images are not supported")
+    if width > max_dimension or height > max_dimension:
+        raise ImageRejected(
+            f"Images can't be over {max_dimension} pixels wide or high")
+    if width * height > max_pixels:
+        raise ImageRejected(f"Images can't have over {max_pixels} pixels")
+
+    return image_format, width, height
+
+
+# Modes reduce() and resize() work on and every output format takes
+SCALABLE_MODES = ("L", "LA", "RGB", "RGBA")
+
+
+def scalable(image):
+    """Convert palette, 1-bit, 16-bit and other modes to L, RGB or RGBA"""
+
+    if image.mode in SCALABLE_MODES:
+        return image
+    if image.mode == "1":
+        return image.convert("L")
+
+    transparent = "A" in image.getbands() or "transparency" in image.info
+    return image.convert("RGBA" if transparent else "RGB")
+
+
+def open_scaled(source, width, height):
+    """Open an image decoded at about the smallest size fitting the box
+
+    JPEGs are decoded straight at a reduced scale with draft(), other
+    formats are shrunk by an integer factor with reduce() before the
+    final resampling, which is much cheaper than resampling the full
+    image.
+    """
+
+    image = Image.open(source)
+    image.draft("RGB", (width, height))
+    image = scalable(image)
+
+    factor = min(image.width // width, image.height // height)
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    image.thumbnail((width, height))
+
+    return image
+
+
+def save_image(image, image_format, **options):
+    """Return the bytes of an image saved in the given format"""
+
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+
+    return buffer.getvalue()
+
+
+def render_variant(source, width, height, fmt):
+    """Return the bytes of an image shrunk to fit in width x height"""
+
+    with open_scaled(source, width, height) as image:
+        return save_image(image, FORMATS[fmt], quality=85)
+
+
+def downscale(file, max_dimension, image_format):
+    """Return the bytes of the image shrunk to max_dimension"""
+
+    with open_scaled(file, max_dimension, max_dimension) as image:
+        return save_image(image, image_format, quality=90)
+
+
+def _preview(file):
+    """Return the dominant color and a placeholder data URI of an image"""
+
+    with open_scaled(file, 64, 64) as image:
+        small = image.convert("RGB")
+
+    # The most common color of a 5 color palette
+    palette_image = small.quantize(colors=5)
+    _, index = max(palette_image.getcolors())
+    red, green, blue = palette_image.getpalette()[index * 3:index * 3 + 3]
+
+    small.thumbnail((16, 16))
+    placeholder = base64.b64encode(save_image(small, "JPEG", quality=50))
+
+    return {
+        "image_color": f"#{red:02x}{green:02x}{blue:02x}",
+        "image_placeholder": "data:image/jpeg;base64," + placeholder.decode(),
+    }
+
+
+def image_metadata(file):
+    """Return the size, dominant color and a placeholder of an image
+
+    The placeholder is a tiny JPEG as a data URI, a few hundred bytes
+    that clients can stretch and blur while the image loads. An image
+    that can't be decoded for it is still stored, without the color
+    and placeholder.
+    """
+
+    _, width, height = read_header(file)
+    metadata = {
+        "image_width": width,
+        "image_height": height,
+        "image_bytes": getattr(file, "size", None),
+        "image_color": "",
+        "image_placeholder": "",
+    }
+
+    position = file.tell()
+    try:
+        metadata.update(_preview(file))
+    except Exception:
+        logger.warning(
+            "No preview for image %s", getattr(file, "name", ""),
+            exc_info=True
+        )
+    finally:
+        file.seek(position)
+
+    return metadata
+
+
+EMPTY_METADATA = {
+    "image_width": None,
+    "image_height": None,
+    "image_bytes": None,
+    "image_color": "",
+    "image_placeholder": "",
+}
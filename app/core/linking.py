@@ -0,0 +1,107 @@
+from django.db import connections, transaction
+
+from core.models import Tag, Ingredient, Recipe
+from core.sharding import shard_for
+from core.signals import recipe_links, update_ingredient_counts, \
+    update_recipe_counts
+from core.sync import touch_recipes
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _add_links(model, recipe_ids, ids, using):
+    """Link recipes to rows of model with one INSERT ... SELECT
+
+    Pairs already linked are skipped, also when a concurrent request
+    links them first, returns how many links were made.
+    """
+
+    connection = connections[using]
+    through, column = recipe_links(model)
+    ops = connection.ops
+    qn = ops.quote_name
+    table = qn(through._meta.db_table)
+    recipes = qn(Recipe._meta.db_table)
+    targets = qn(model._meta.db_table)
+    recipe_id = qn("recipe_id")
+    column = qn(column)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"{ops.insert_statement(ignore_conflicts=True)} "
+            f"{table} ({recipe_id}, {column}) "
+            f"SELECT r.id, t.id FROM {recipes} r, {targets} t "
+            f"WHERE r.id IN ({_placeholders(recipe_ids)}) "
+            f"AND t.id IN ({_placeholders(ids)}) "
+            f"AND t.user_id = r.user_id "
+            f"AND NOT EXISTS (SELECT 1 FROM {table} l "
+            f"WHERE l.{recipe_id} = r.id AND l.{column} = t.id) "
+            f"{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}",
+            list(recipe_ids) + list(ids)
+        )
+        return cursor.rowcount
+
+
+def _remove_links(model, recipe_ids, ids, using):
+    """Unlink recipes from rows of model with one DELETE"""
+
+    connection = connections[using]
+    through, column = recipe_links(model)
+    qn = connection.ops.quote_name
+    table = qn(through._meta.db_table)
+    recipe_id = qn("recipe_id")
+    column = qn(column)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} "
+            f"WHERE {recipe_id} IN ({_placeholders(recipe_ids)}) "
+            f"AND {column} IN ({_placeholders(ids)})",
+            list(recipe_ids) + list(ids)
+        )
+        return cursor.rowcount
+
+
+def change_links(user_id, recipe_ids, tags_add=(), tags_remove=(),
+                 ingredients_add=(), ingredients_remove=()):
+    """Add and remove tags and ingredients of some recipes of a user
+
+    Only the given links are touched, one statement per operation, and
+    the counts and change numbers the m2m signals would keep are updated
+    here. Returns the number of links made and removed.
+    """
+
+    recipe_ids = sorted(set(recipe_ids))
+    changed = 0
+    if not recipe_ids:
+        return changed
+
+    using = shard_for(user_id, writing=True)
+    with transaction.atomic(using=using):
+        for model, add, remove in (
+                (Tag, tags_add, tags_remove),
+                (Ingredient, ingredients_add, ingredients_remove)):
+            if not add and not remove:
+                continue
+
+            model_changed = 0
+            if remove:
+                model_changed += _remove_links(
+                    model, recipe_ids, remove, using
+                )
+            if add:
+                model_changed += _add_links(model, recipe_ids, add, using)
+            if not model_changed:
+                continue
+
+            update_recipe_counts(model, set(add) | set(remove), using)
+            if model is Ingredient:
+                update_ingredient_counts(recipe_ids, using)
+            changed += model_changed
+
+        if changed:
+            touch_recipes(user_id, recipe_ids)
+
+    return changed
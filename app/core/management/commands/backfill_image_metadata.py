@@ -0,0 +1,61 @@
+from collections import defaultdict
+from typing import Any
+
+from django.core.management import BaseCommand
+
+from core.images import image_metadata
+from core.models import Recipe
+from core.sharding import data_databases
+from core.sync import touch_recipes
+
+
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    """Django command to measure the images uploaded before metadata"""
+
+    help = "Store the size, color and placeholder of images missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        updated = 0
+        for alias in data_databases():
+            recipes = Recipe.objects.using(alias) \
+                .filter(image_width__isnull=True).exclude(image="") \
+                .order_by("pk").only("pk", "user_id", "image")
+            last = 0
+            while True:
+                batch = list(
+                    recipes.filter(pk__gt=last)[:options["batch_size"]]
+                )
+                if not batch:
+                    break
+                last = batch[-1].pk
+
+                touched = defaultdict(list)
+                for recipe in batch:
+                    try:
+                        with recipe.image.open("rb") as image:
+                            metadata = image_metadata(image)
+                    except Exception as error:
+                        self.stderr.write(
+                            f"Skipped recipe {recipe.pk}: {error}"
+                        )
+                        continue
+
+                    Recipe.objects.using(alias).filter(pk=recipe.pk) \
+                        .update(**metadata)
+                    touched[recipe.user_id].append(recipe.pk)
+
+                # Syncing clients pick the metadata up as a change
+                for user_id, recipe_ids in touched.items():
+                    touch_recipes(user_id, recipe_ids)
+                    updated += len(recipe_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored metadata of {updated} images"))
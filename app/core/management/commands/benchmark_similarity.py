@@ -0,0 +1,74 @@
+import random
+import time
+from typing import Any
+
+from django.core.management import BaseCommand
+
+from recipe.similarity import SimilarityIndex
+
+
+class Command(BaseCommand):
+    """Django command to benchmark the recipe similarity index"""
+
+    help = "Time building and querying a similarity index of fake recipes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=100000)
+        parser.add_argument("--tags", type=int, default=200)
+        parser.add_argument("--ingredients", type=int, default=2000)
+        parser.add_argument("--tags-per-recipe", type=int, default=3)
+        parser.add_argument("--ingredients-per-recipe", type=int, default=8)
+        parser.add_argument("--queries", type=int, default=1000)
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def _rows(self, rng, recipes, choices, per_recipe):
+        # Skewed choices, like real libraries a few tags and
+        # ingredients are on a large share of the recipes
+        weights = [1 / (rank + 1) for rank in range(choices)]
+        for recipe_id in range(1, recipes + 1):
+            picked = rng.choices(range(1, choices + 1), weights, k=per_recipe)
+            for choice in set(picked):
+                yield recipe_id, choice
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        rng = random.Random(options["seed"])
+        recipes = options["recipes"]
+        tag_rows = list(self._rows(
+            rng, recipes, options["tags"], options["tags_per_recipe"]
+        ))
+        ingredient_rows = list(self._rows(
+            rng, recipes, options["ingredients"],
+            options["ingredients_per_recipe"]
+        ))
+
+        start = time.perf_counter()
+        index = SimilarityIndex.from_rows(
+            range(1, recipes + 1), tag_rows, ingredient_rows
+        )
+        build = time.perf_counter() - start
+        self.stdout.write(
+            f"Built index of {len(index)} recipes "
+            f"({len(tag_rows) + len(ingredient_rows)} links) in {build:.2f}s"
+        )
+
+        timings = []
+        for _ in range(options["queries"]):
+            recipe_id = rng.randint(1, recipes)
+            start = time.perf_counter()
+            index.similar(recipe_id, options["limit"])
+            timings.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        index.set_features(1, index.features[2])
+        update = (time.perf_counter() - start) * 1000
+
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(timings)} queries: "
+            f"p50={timings[len(timings) // 2]:.2f}ms "
+            f"p99={timings[int(len(timings) * 0.99)]:.2f}ms "
+            f"max={timings[-1]:.2f}ms, update={update:.3f}ms"
+        ))
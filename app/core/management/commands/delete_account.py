@@ -0,0 +1,37 @@
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from core.deletion import delete_user_data
+
+
+class Command(BaseCommand):
+    """Django command to delete an account and its data in batches"""
+
+    help = "Delete a user with all their recipes, tags and ingredients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("email")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        user = get_user_model().objects.with_email(
+            options["email"]).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+
+        # Lock the account out before the slow part starts
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+
+        stats = delete_user_data(
+            user.pk,
+            batch_size=options["batch_size"],
+            report=self.stdout.write
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {options['email']} in {stats['seconds']}s"))
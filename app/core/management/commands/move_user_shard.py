@@ -0,0 +1,50 @@
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from core.sharding import data_databases, move_user
+
+
+class Command(BaseCommand):
+    """Django command to move a user's data to another shard"""
+
+    help = (
+        "Move a user's recipes, tags and ingredients to another database. "
+        "The rows are copied while the user keeps working, then the "
+        "user's writes get a 503 for the grace period plus the copy of "
+        "what changed meanwhile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("email")
+        parser.add_argument("database")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--grace", type=float, default=None,
+            help="Seconds to wait for cached shard maps to expire, "
+                 "defaults to SHARD_MAP_CACHE_SECONDS. 0 is safe with a "
+                 "cache shared by all processes"
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        if options["database"] not in data_databases():
+            raise CommandError(f"{options['database']} holds no data")
+
+        user = get_user_model().objects.with_email(
+            options["email"]).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+
+        copied = move_user(
+            user.pk, options["database"],
+            batch_size=options["batch_size"],
+            grace=options["grace"],
+            report=self.stdout.write
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {copied} rows of {options['email']} "
+            f"to {options['database']}"))
@@ -0,0 +1,26 @@
+from typing import Any
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from core.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    """Django command to compact the deletion records kept for syncing"""
+
+    help = "Delete tombstones older than the sync retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.SYNC_TOMBSTONE_DAYS,
+            help="Keep the tombstones of the last DAYS days"
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        pruned = prune_tombstones(options["days"], options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(f"Pruned {pruned} tombstones"))
@@ -0,0 +1,21 @@
+from typing import Any
+
+from django.core.management import BaseCommand
+
+from core.authentication import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    """Django command to delete expired API tokens"""
+
+    help = "Delete expired API tokens in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        purged = purge_expired_tokens(options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} tokens"))
@@ -0,0 +1,123 @@
+import threading
+import time
+from typing import Any
+
+from django.core.management import BaseCommand
+from django.db import connection
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    """Django command to run the background tasks stored in the database"""
+
+    help = "Run queued background tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=1,
+            help="Number of tasks run at the same time"
+        )
+        parser.add_argument(
+            "--poll", type=float, default=1.0,
+            help="Seconds to wait when the queue is empty"
+        )
+        parser.add_argument(
+            "--requeue-interval", type=float, default=300.0,
+            help="Seconds between looks for tasks of dead workers"
+        )
+        parser.add_argument(
+            "--burst", action="store_true",
+            help="Exit once the queue is empty"
+        )
+        parser.add_argument(
+            "--stats", action="store_true",
+            help="Show the queue depth and exit"
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        if options["stats"]:
+            self.show_stats()
+            return
+
+        self.requeue_interval = options["requeue_interval"]
+        self.next_requeue = 0
+        self.requeue_lock = threading.Lock()
+        self.requeue_stale()
+
+        self.stop = threading.Event()
+        concurrency = max(options["concurrency"], 1)
+        self.stdout.write(f"Starting worker with {concurrency} threads")
+
+        if concurrency == 1:
+            self.work(options["poll"], options["burst"])
+            return
+
+        threads = [
+            threading.Thread(
+                target=self.work_thread,
+                args=(options["poll"], options["burst"]),
+                daemon=True
+            )
+            for _ in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the running tasks")
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self, poll, burst):
+        """Run tasks until stopped, or the queue is empty in burst mode"""
+
+        while not self.stop.is_set():
+            # A long running worker also picks up what others left
+            self.requeue_stale()
+            if tasks.run_next():
+                continue
+            if burst:
+                break
+            self.stop.wait(poll)
+
+    def requeue_stale(self):
+        """Requeue the tasks of dead workers, once per interval across
+        the threads"""
+
+        with self.requeue_lock:
+            now = time.monotonic()
+            if now < self.next_requeue:
+                return
+            self.next_requeue = now + self.requeue_interval
+
+        requeued = tasks.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale tasks")
+
+    def work_thread(self, poll, burst):
+        """Worker loop run in a thread with its own connection"""
+
+        try:
+            self.work(poll, burst)
+        finally:
+            connection.close()
+
+    def show_stats(self):
+        """Print the number of tasks per status and priority"""
+
+        depth = tasks.queue_depth()
+        if not depth:
+            self.stdout.write("Queue is empty")
+
+        for row in depth:
+            self.stdout.write(
+                f"{row['status']:<8} priority={row['priority']:<4} "
+                f"{row['count']}"
+            )
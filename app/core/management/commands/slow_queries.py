@@ -0,0 +1,60 @@
+from typing import Any
+
+from django.core.management import BaseCommand
+
+from core.models import SlowQuery
+
+
+ORDERINGS = {
+    "total": "-total_ms",
+    "count": "-count",
+    "max": "-max_ms",
+    "recent": "-last_seen",
+}
+
+
+class Command(BaseCommand):
+    """Django command to show the queries caught by the slow query log"""
+
+    help = "List slow queries grouped by fingerprint"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--order", choices=sorted(ORDERINGS), default="total",
+            help="Sort by total time, count, max time or last seen"
+        )
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument(
+            "--plans", action="store_true",
+            help="Show the captured EXPLAIN plans"
+        )
+        parser.add_argument(
+            "--clear", action="store_true",
+            help="Delete every stored slow query"
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        """Handle the command"""
+
+        if options["clear"]:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(
+                self.style.SUCCESS(f"Deleted {deleted} slow queries"))
+            return
+
+        queries = SlowQuery.objects.order_by(
+            ORDERINGS[options["order"]])[:options["limit"]]
+
+        for query in queries:
+            self.stdout.write(self.style.WARNING(
+                f"[{query.fingerprint}] {query.count}x "
+                f"total={query.total_ms:.1f}ms "
+                f"avg={query.total_ms / max(query.count, 1):.1f}ms "
+                f"max={query.max_ms:.1f}ms view={query.view or '-'}"
+            ))
+            self.stdout.write(f"  {query.sql}")
+            if query.params:
+                self.stdout.write(f"  params: {query.params}")
+            if options["plans"] and query.plan:
+                for line in query.plan.splitlines():
+                    self.stdout.write(f"    {line}")
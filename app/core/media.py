@@ -0,0 +1,231 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, \
+    StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.authentication import ExpiringTokenAuthentication
+from core.imagecache import get_variant_cache, variant_key
+from core.images import FORMATS, render_variant
+from core.models import Recipe
+from core.sharding import data_databases
+
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+# Uploaded files get a random name and are never overwritten
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+VARIANT_MAX_AGE = 60 * 60
+
+
+def can_access(request, recipe):
+    """Return True if the request may read the recipe's image"""
+
+    if recipe is None or not recipe.image:
+        return False
+
+    if not settings.MEDIA_PRIVATE:
+        return True
+
+    try:
+        auth = ExpiringTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+
+    return auth is not None and auth[0].pk == recipe.user_id
+
+
+def find_recipe(**filters):
+    """Return the recipe matching filters on whichever database has it"""
+
+    for alias in data_databases():
+        recipe = Recipe.objects.using(alias).filter(**filters) \
+            .only("image", "user_id").first()
+        if recipe is not None:
+            return recipe
+
+    return None
+
+
+def _parse_range(header, size):
+    """Return the (start, end) of a single byte range
+
+    None means the header should be ignored and the whole file sent, a
+    ValueError is raised for ranges outside the file.
+    """
+
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+
+    start, end = match.groups()
+    if start == "":
+        # suffix range, the last N bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+
+    return start, end
+
+
+def _read_range(file, start, length):
+    """Yield a part of an open file in chunks, then close it"""
+
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, name, max_age=None):
+    """Return a response for a file in MEDIA_ROOT
+
+    The transfer is handed to the web server with X-Accel-Redirect or
+    X-Sendfile when configured. Otherwise the file is streamed by Django
+    with support for conditional and Range requests. Without a max_age
+    the file is cached as immutable.
+    """
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        content_type = mimetypes.guess_type(path)[0] or \
+            "application/octet-stream"
+
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = \
+                settings.MEDIA_ACCEL_REDIRECT + quote(name)
+        elif settings.MEDIA_SENDFILE:
+            response = HttpResponse(content_type=content_type)
+            response["X-Sendfile"] = path
+        else:
+            response = _django_file_response(
+                request, path, stat.st_size, content_type, etag,
+                last_modified
+            )
+
+    cache = "private" if settings.MEDIA_PRIVATE else "public"
+    if max_age is None:
+        cache += f", max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache += f", max-age={max_age}"
+    response["Cache-Control"] = cache
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+
+    return response
+
+
+def _django_file_response(request, path, size, content_type, etag,
+                          last_modified):
+    """Stream the whole file or the requested byte range"""
+
+    range_header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if range_header and if_range and if_range != etag and \
+            parse_http_date_safe(if_range) != last_modified:
+        # The client's copy is outdated, it needs the whole file
+        range_header = None
+
+    try:
+        byte_range = _parse_range(range_header, size) \
+            if range_header else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        # FileResponse lets the WSGI server use sendfile when it can
+        return FileResponse(open(path, "rb"), content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    # Opened here, so a missing file raises before the response starts
+    response = StreamingHttpResponse(
+        _read_range(open(path, "rb"), start, length),
+        status=206,
+        content_type=content_type
+    )
+    response["Content-Length"] = str(length)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve an uploaded file to a client allowed to see it"""
+
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+
+    recipe = find_recipe(image=path)
+    if not os.path.isfile(full_path) or not can_access(request, recipe):
+        raise Http404
+
+    return file_response(request, full_path, path)
+
+
+@require_safe
+def recipe_image_variant(request, recipe_id, width, height, fmt):
+    """Serve a recipe image resized to one of the allowed sizes"""
+
+    size = f"{width}x{height}"
+    if size not in settings.RECIPE_IMAGE_SIZES or fmt not in FORMATS:
+        raise Http404
+
+    recipe = find_recipe(pk=recipe_id)
+    if not can_access(request, recipe):
+        raise Http404
+
+    source = recipe.image.path
+    if not os.path.isfile(source):
+        raise Http404
+
+    cache = get_variant_cache()
+    key = variant_key(recipe.image.name, width, height, fmt)
+
+    def respond():
+        path = cache.get_or_render(
+            key, lambda: render_variant(source, width, height, fmt)
+        )
+        # Variants change when a new image is uploaded, so unlike the
+        # originals they have to be revalidated
+        return file_response(
+            request, path, os.path.relpath(path, settings.MEDIA_ROOT),
+            max_age=VARIANT_MAX_AGE
+        )
+
+    try:
+        return respond()
+    except FileNotFoundError:
+        # Evicted between the lookup and the read, rendered again
+        return respond()
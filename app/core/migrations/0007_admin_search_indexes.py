@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+# Admin prefix searches are run as UPPER(column) LIKE 'TERM%', these
+# expression indexes let postgres answer them without a sequential scan
+INDEXES = (
+    ("core_tag_name_upper_like", "core_tag", "name"),
+    ("core_ingredient_name_upper_like", "core_ingredient", "name"),
+    ("core_recipe_title_upper_like", "core_recipe", "title"),
+    ("core_user_email_upper_like", "core_user", "email"),
+)
+
+
+def create_indexes(apps, schema_editor):
+    """Create the search indexes on postgres only"""
+
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    # CONCURRENTLY keeps the tables writable while the indexes build
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+            f"(UPPER({column}) varchar_pattern_ops)"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    """Drop the search indexes"""
+
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    # Postgres can only build indexes CONCURRENTLY outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0006_slowquery'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
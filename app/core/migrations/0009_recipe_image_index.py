@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-19 16:51
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_task'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, null=True, upload_to=core.models.reciepe_image_file_path),
+        ),
+    ]
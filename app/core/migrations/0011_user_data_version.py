@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipe_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='data_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+
+def count_ingredients(apps, schema_editor):
+    """Fill ingredient_count in batches of recipe ids"""
+
+    alias = schema_editor.connection.alias
+    Recipe = apps.get_model("core", "Recipe")
+    Link = Recipe.ingredients.through
+    recipes = Recipe.objects.using(alias)
+    counts = Link.objects.filter(recipe_id=OuterRef("pk")).order_by() \
+        .values("recipe_id").annotate(count=Count("pk")).values("count")
+
+    last_id = 0
+    while True:
+        ids = list(
+            recipes.filter(pk__gt=last_id).order_by("pk")
+            .values_list("pk", flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+
+        recipes.filter(pk__in=ids).update(
+            ingredient_count=Coalesce(Subquery(counts), 0)
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    # Each batch is one UPDATE committed on its own, so a big table
+    # isn't locked until the end, and a rerun after a failure starts over
+    # safely
+    atomic = False
+
+    dependencies = [
+        ('core', '0012_recipe_ingredient_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_ingredients, migrations.RunPython.noop),
+    ]
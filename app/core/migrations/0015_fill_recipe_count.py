@@ -0,0 +1,88 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+# Autocomplete prefix matches, UPPER(name) LIKE 'TERM%', use the
+# indexes of 0007. These trigram indexes serve the fuzzy matches, and
+# btree_gin lets them lead with user_id so a match only reads the
+# user's own names
+INDEXES = (
+    ("core_tag_user_name_trgm", "core_tag",
+     "USING gin (user_id, name gin_trgm_ops)"),
+    ("core_ingredient_user_name_trgm", "core_ingredient",
+     "USING gin (user_id, name gin_trgm_ops)"),
+)
+
+
+def count_recipes(apps, schema_editor):
+    """Fill recipe_count in batches of ids"""
+
+    alias = schema_editor.connection.alias
+    Recipe = apps.get_model("core", "Recipe")
+    for model_name, through, column in (
+            ("Tag", Recipe.tags.through, "tag_id"),
+            ("Ingredient", Recipe.ingredients.through, "ingredient_id")):
+        rows = apps.get_model("core", model_name).objects.using(alias)
+        counts = through.objects.filter(**{column: OuterRef("pk")}) \
+            .order_by().values(column).annotate(count=Count("pk")) \
+            .values("count")
+
+        last_id = 0
+        while True:
+            ids = list(
+                rows.filter(pk__gt=last_id).order_by("pk")
+                .values_list("pk", flat=True)[:BATCH_SIZE]
+            )
+            if not ids:
+                break
+
+            rows.filter(pk__in=ids).update(
+                recipe_count=Coalesce(Subquery(counts), 0)
+            )
+            last_id = ids[-1]
+
+
+def create_indexes(apps, schema_editor):
+    """Create the search indexes on postgres only"""
+
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # CONCURRENTLY keeps the tables writable while the indexes build
+    for name, table, definition in INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON {table} {definition}"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    """Drop the search indexes"""
+
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    # Each batch is one UPDATE committed on its own, so a big table
+    # isn't locked until the end, and a rerun after a failure starts over
+    # safely
+    atomic = False
+
+    dependencies = [
+        ('core', '0014_tag_ingredient_recipe_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,147 @@
+import unicodedata
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+
+def normalize_name(name):
+    """core.vocabulary.normalize_name as it was when this migration ran"""
+
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+def link_canonical(apps, schema_editor):
+    """Link every tag and ingredient to the canonical form of its name"""
+
+    alias = schema_editor.connection.alias
+    names = apps.get_model("core", "CanonicalName").objects.using(alias)
+
+    for model_name in ("Tag", "Ingredient"):
+        model = apps.get_model("core", model_name).objects.using(alias)
+
+        while True:
+            rows = list(
+                model.filter(canonical__isnull=True).order_by("pk")
+                [:BATCH_SIZE]
+            )
+            if not rows:
+                break
+
+            normalized = {normalize_name(row.name) for row in rows}
+            with transaction.atomic(using=alias):
+                names.bulk_create(
+                    [names.model(name=name) for name in normalized],
+                    ignore_conflicts=True
+                )
+                ids = dict(
+                    names.filter(name__in=normalized)
+                    .values_list("name", "pk")
+                )
+                for row in rows:
+                    row.canonical_id = ids[normalize_name(row.name)]
+                model.bulk_update(rows, ["canonical"])
+
+
+def _merge(model, links, column, survivor, duplicates):
+    """Move the recipe links of duplicates to survivor, then delete them"""
+
+    recipe_ids = set(
+        links.filter(**{f"{column}__in": duplicates})
+        .values_list("recipe_id", flat=True)
+    )
+    links.bulk_create(
+        [
+            links.model(**{"recipe_id": recipe_id, column: survivor})
+            for recipe_id in recipe_ids
+        ],
+        ignore_conflicts=True
+    )
+    links.filter(**{f"{column}__in": duplicates}).delete()
+    model.filter(pk__in=duplicates).delete()
+
+    return recipe_ids
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge the tags, then the ingredients, of a user sharing a
+    canonical name
+
+    The oldest row of a group is kept and takes over the recipe links
+    of the others, which are deleted. Each batch of groups commits with
+    its counters, so a rerun carries on with the groups left.
+    """
+
+    alias = schema_editor.connection.alias
+    Recipe = apps.get_model("core", "Recipe")
+    recipes = Recipe.objects.using(alias)
+    users = apps.get_model("core", "User").objects.using(alias)
+
+    for model_name, through, column in (
+            ("Tag", Recipe.tags.through, "tag_id"),
+            ("Ingredient", Recipe.ingredients.through, "ingredient_id")):
+        model = apps.get_model("core", model_name).objects.using(alias)
+        links = through.objects.using(alias)
+        groups = model.values("user_id", "canonical_id") \
+            .annotate(rows=Count("pk")).filter(rows__gt=1) \
+            .order_by("user_id", "canonical_id")
+        recipe_counts = through.objects.filter(**{column: OuterRef("pk")}) \
+            .order_by().values(column).annotate(count=Count("pk")) \
+            .values("count")
+        ingredient_counts = through.objects \
+            .filter(recipe_id=OuterRef("pk")).order_by().values("recipe_id") \
+            .annotate(count=Count("pk")).values("count")
+
+        # Merged groups disappear from the query, so it always restarts
+        # from the first remaining group
+        while True:
+            batch = list(groups[:BATCH_SIZE])
+            if not batch:
+                break
+
+            with transaction.atomic(using=alias):
+                kept = []
+                recipe_ids = set()
+                for group in batch:
+                    keep, *duplicates = model.filter(
+                        user_id=group["user_id"],
+                        canonical_id=group["canonical_id"]
+                    ).order_by("pk").values_list("pk", flat=True)
+                    recipe_ids |= _merge(
+                        model, links, column, keep, duplicates
+                    )
+                    kept.append(keep)
+
+                model.filter(pk__in=kept).update(
+                    recipe_count=Coalesce(Subquery(recipe_counts), 0)
+                )
+                if model_name == "Ingredient":
+                    recipes.filter(pk__in=recipe_ids).update(
+                        ingredient_count=Coalesce(
+                            Subquery(ingredient_counts), 0
+                        )
+                    )
+                users.filter(
+                    pk__in={group["user_id"] for group in batch}
+                ).update(data_version=models.F("data_version") + 1)
+
+
+class Migration(migrations.Migration):
+
+    # Batches commit on their own instead of holding every tag and
+    # ingredient row locked until the end
+    atomic = False
+
+    dependencies = [
+        ('core', '0016_canonical_names'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_canonical, migrations.RunPython.noop),
+        # Deleted duplicates can't be brought back, so this migration
+        # can't be unapplied
+        migrations.RunPython(merge_duplicates),
+    ]
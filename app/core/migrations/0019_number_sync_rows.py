@@ -0,0 +1,54 @@
+from django.db import migrations, transaction
+
+
+BATCH_SIZE = 1000
+
+
+def number_rows(apps, schema_editor):
+    """Give every existing row its own change number within its user"""
+
+    alias = schema_editor.connection.alias
+    User = apps.get_model("core", "User")
+    users = User.objects.using(alias)
+    models_ = [
+        apps.get_model("core", name).objects.using(alias)
+        for name in ("Tag", "Ingredient", "Recipe")
+    ]
+
+    for user_id in users.order_by("pk").values_list("pk", flat=True) \
+            .iterator():
+        with transaction.atomic(using=alias):
+            user = users.select_for_update().get(pk=user_id)
+            seq = user.data_version
+            for rows_ in models_:
+                last_id = 0
+                while True:
+                    rows = list(
+                        rows_.filter(user_id=user_id, seq=0, pk__gt=last_id)
+                        .order_by("pk").only("pk")[:BATCH_SIZE]
+                    )
+                    if not rows:
+                        break
+
+                    for row in rows:
+                        seq += 1
+                        row.seq = seq
+                    rows_.bulk_update(rows, ["seq"])
+                    last_id = rows[-1].pk
+            users.filter(pk=user_id).update(data_version=seq)
+
+
+class Migration(migrations.Migration):
+
+    # Each user's rows are numbered in a transaction of their own, so the
+    # tables aren't locked until every user is done; rows already numbered
+    # keep their seq, so a rerun after a failure carries on where it stopped
+    atomic = False
+
+    dependencies = [
+        ('core', '0018_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.14 on 2026-10-19 17:21
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+BATCH_SIZE = 1000
+
+
+def copy_drf_tokens(apps, schema_editor):
+    """Move the never expiring DRF tokens over, so clients stay logged in
+
+    They get a full lifetime from now, and are then renewed with use
+    like any other token.
+    """
+
+    alias = schema_editor.connection.alias
+    Token = apps.get_model("authtoken", "Token")
+    AuthToken = apps.get_model("core", "AuthToken")
+    drf_tokens = Token.objects.using(alias)
+    now = django.utils.timezone.now()
+    expires = now + settings.AUTH_TOKEN_LIFETIME
+
+    while True:
+        tokens = list(drf_tokens.order_by("key")[:BATCH_SIZE])
+        if not tokens:
+            break
+
+        AuthToken.objects.using(alias).bulk_create(
+            [
+                AuthToken(
+                    key=token.key, user_id=token.user_id,
+                    created=token.created, last_used=now, expires=expires
+                )
+                for token in tokens
+            ],
+            ignore_conflicts=True
+        )
+        drf_tokens.filter(
+            key__in=[token.key for token in tokens]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_recipe_ordering_indexes'),
+        ('authtoken', '0002_auto_20160226_1747'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthToken',
+            fields=[
+                ('key', models.CharField(default=core.models.generate_token_key, max_length=40, primary_key=True, serialize=False)),
+                ('device', models.CharField(blank=True, max_length=255)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auth_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_drf_tokens, migrations.RunPython.noop),
+    ]
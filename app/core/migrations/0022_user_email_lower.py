@@ -0,0 +1,99 @@
+import logging
+
+from django.db import migrations, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Lower
+
+
+BATCH_SIZE = 1000
+
+INDEX = "core_user_email_lower_uniq"
+
+logger = logging.getLogger("core.migrations")
+
+
+def resolve_case_duplicates(apps, schema_editor):
+    """Rename the accounts whose email only differs by case from another
+
+    The account last logged into keeps the address. The others keep
+    their data and tokens but get a unique placeholder address, so an
+    admin can merge or restore them.
+    """
+
+    alias = schema_editor.connection.alias
+    users = apps.get_model("core", "User").objects.using(alias)
+    groups = users.annotate(email_lower=Lower("email")) \
+        .values("email_lower").annotate(users=Count("pk")) \
+        .filter(users__gt=1).order_by("email_lower")
+
+    # Resolved groups disappear from the query, so it always restarts
+    # from the first remaining group
+    while True:
+        batch = list(groups.values_list("email_lower", flat=True)[:BATCH_SIZE])
+        if not batch:
+            break
+
+        renamed = []
+        with transaction.atomic(using=alias):
+            for email in batch:
+                keep, *duplicates = users \
+                    .annotate(email_lower=Lower("email")) \
+                    .filter(email_lower=email) \
+                    .order_by(F("last_login").desc(nulls_last=True), "pk")
+                for user in duplicates:
+                    old_email = user.email
+                    user.email = f"duplicate-{user.pk}.{user.email}"[:255]
+                    user.save(update_fields=["email"])
+                    renamed.append((user.pk, old_email, user.email, keep.pk))
+
+        # Listed once committed, so admins know which accounts to check
+        for pk, old_email, new_email, keep_pk in renamed:
+            logger.warning(
+                "Renamed user %s from %s to %s, user %s keeps the address",
+                pk, old_email, new_email, keep_pk
+            )
+
+
+def create_index(apps, schema_editor):
+    """Create the unique index on LOWER(email)
+
+    On postgres it is built CONCURRENTLY so signups and logins aren't
+    blocked meanwhile. A failed concurrent build leaves an invalid
+    index behind, which is dropped first when the migration is rerun.
+    """
+
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX}")
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY {INDEX} "
+            f"ON core_user (LOWER(email))"
+        )
+    else:
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX {INDEX} ON core_user (LOWER(email))"
+        )
+
+
+def drop_index(apps, schema_editor):
+    """Drop the unique index on LOWER(email)"""
+
+    schema_editor.execute(f"DROP INDEX {INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    # Batches commit on their own instead of locking every user row
+    # until the index is built, and postgres can only build the index
+    # CONCURRENTLY outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0021_auth_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            resolve_case_duplicates, migrations.RunPython.noop
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
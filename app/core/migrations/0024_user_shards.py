@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-19 17:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserShard',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.user')),
+                ('alias', models.CharField(max_length=64)),
+                ('moving', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:16
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_user_shards'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name',
+            field=models.CharField(max_length=255, validators=[core.models.validate_canonical_name]),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=255, validators=[core.models.validate_canonical_name]),
+        ),
+    ]
@@ -1,11 +1,17 @@
+import secrets
 import uuid
 import os
 
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Value
 from django.db.models.deletion import CASCADE
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 
 def reciepe_image_file_path(instance, filename):
@@ -20,6 +26,27 @@ def reciepe_image_file_path(instance, filename):
     return os.path.join("uploads/recipe/", filename)
 
 
+# Longest canonical tag or ingredient name
+CANONICAL_NAME_LENGTH = 255
+
+
+def validate_canonical_name(name):
+    """Reject names too long for CanonicalName once normalized
+
+    Folding can make a name longer than typed, "ß" becomes "ss" and
+    some ligatures a dozen characters.
+    """
+
+    # vocabulary imports the models
+    from core.vocabulary import normalize_name
+
+    if len(normalize_name(name)) > CANONICAL_NAME_LENGTH:
+        raise ValidationError(
+            f"Ensure this name has no more than {CANONICAL_NAME_LENGTH} "
+            f"characters once normalized."
+        )
+
+
 class UserManager(BaseUserManager):
     """Manager for our custom User model"""
 
@@ -29,12 +56,32 @@ class UserManager(BaseUserManager):
         if not email:
             raise ValueError("user must have an email address")
 
-        user = self.model(email=self.normalize_email(email), **extra_fields)
+        email = self.normalize_email(email)
+        if self.with_email(email).exists():
+            raise ValueError("user with this email already exists")
+
+        user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
 
         return user
 
+    def with_email(self, email):
+        """Filter the users with email whatever its case
+
+        Both sides go through the database's LOWER(), which the unique
+        index on LOWER(email) uses too, so they agree even where
+        Python's lower() doesn't.
+        """
+
+        return self.annotate(email_lower=Lower("email")) \
+            .filter(email_lower=Lower(Value(email)))
+
+    def get_by_natural_key(self, username):
+        """Find a user by email whatever its case"""
+
+        return self.with_email(username).get()
+
     def create_superuser(self, email, password):
         """Create and save a noew superuser"""
 
@@ -49,44 +96,182 @@ class UserManager(BaseUserManager):
 class User(AbstractBaseUser, PermissionsMixin):
     """Modifying defualt user model"""
 
+    # Also unique whatever the case, see migration 0022
     email = models.EmailField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    # Bumped whenever the user's recipes, tags or ingredients change, so
+    # anything computed from them can be cached per version
+    data_version = models.BigIntegerField(default=0)
+    # Change numbers up to this one may have lost their tombstones, a
+    # client that synced before it has to start over
+    sync_floor = models.BigIntegerField(default=0)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
+    # Only ever moved by F() updates, see core.sync
+    COUNTERS = ("data_version", "sync_floor")
+
+    def save(self, *args, **kwargs):
+        """Save the user, leaving the change counters alone
+
+        Writing back the counters loaded with the user could move them
+        back, and hand out change numbers clients already synced.
+        """
+
+        if not self._state.adding and not kwargs.get("force_insert") \
+                and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS
+            ]
+
+        super().save(*args, **kwargs)
+
+
+class SyncedQuerySet(models.QuerySet):
+
+    def create(self, **kwargs):
+        """Create a row, on its owner's shard unless using() picked one
+
+        The stock create() saves to the database the router gives
+        without an instance, which can't know the owner's shard.
+        """
+
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+
+        return obj
+
+
+class Synced(models.Model):
+    """Rows clients can sync incrementally
+
+    Every save takes the next change number of the owner, see core.sync.
+    """
 
-class Tag(models.Model):
+    objects = SyncedQuerySet.as_manager()
+
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+    seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # core.sync imports the models
+        from core.sync import allocate_seq, data_changed
+
+        # Rows go to their owner's shard unless the caller picked one
+        using = kwargs.get("using") or \
+            router.db_for_write(type(self), instance=self)
+        kwargs["using"] = using
+        # The owner's row stays locked until the save commits, so change
+        # numbers become visible in order
+        with transaction.atomic(using=using):
+            self.seq = allocate_seq(self.user_id)
+            super().save(*args, **kwargs)
+
+        data_changed.send(
+            sender=type(self),
+            user_id=self.user_id,
+            count=1,
+            recipe_ids=[self.pk] if isinstance(self, Recipe) else []
+        )
+
+
+class Tag(Synced):
     """Tag to be used for a recipe"""
 
-    name = models.CharField(max_length=255)
+    name = models.CharField(
+        max_length=255, validators=[validate_canonical_name]
+    )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=CASCADE
     )
+    # Number of recipes using it, kept up to date by signals
+    recipe_count = models.PositiveIntegerField(default=0)
+    # Shared normalized name, set on save
+    canonical = models.ForeignKey(
+        "CanonicalName",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="+"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "canonical"],
+                name="core_tag_canonical_idx"
+            ),
+            models.Index(
+                fields=["user", "seq"], name="core_tag_seq_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(Synced):
     """Ingredient to be used in a recipe"""
 
-    name = models.CharField(max_length=255)
+    name = models.CharField(
+        max_length=255, validators=[validate_canonical_name]
+    )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=CASCADE
     )
+    # Number of recipes using it, kept up to date by signals
+    recipe_count = models.PositiveIntegerField(default=0)
+    # Shared normalized name, set on save
+    canonical = models.ForeignKey(
+        "CanonicalName",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="+"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "canonical"],
+                name="core_ingredient_canonical_idx"
+            ),
+            models.Index(
+                fields=["user", "seq"], name="core_ingredient_seq_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class CanonicalName(models.Model):
+    """Normalized tag or ingredient name shared by all users
+
+    Per user rows point at it, so cross-user features can group by a
+    small integer instead of comparing free text.
+    """
+
+    name = models.CharField(max_length=CANONICAL_NAME_LENGTH, unique=True)
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(Synced):
     """Recipe model"""
 
     user = models.ForeignKey(
@@ -99,10 +284,211 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     ingredients = models.ManyToManyField("Ingredient")
     tags = models.ManyToManyField("Tag")
-    image = models.ImageField(null=True, upload_to=reciepe_image_file_path)
+    image = models.ImageField(
+        null=True, upload_to=reciepe_image_file_path, db_index=True
+    )
     # here we don't want to call our fucntion by () insted we are passing
     # a reference to the fuction so it will be called every time user upload
     # an image
+    # Filled when an image is uploaded so clients can lay out and paint
+    # a placeholder before downloading the image
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_bytes = models.PositiveIntegerField(null=True, blank=True)
+    image_color = models.CharField(max_length=7, blank=True)
+    image_placeholder = models.TextField(blank=True)
+    # Kept equal to the number of linked ingredients by signals, so a
+    # recipe covered by a set of ingredients is found by counting matches
+    ingredient_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "ingredient_count"],
+                name="core_recipe_ingr_count_idx"
+            ),
+            models.Index(
+                fields=["user", "seq"], name="core_recipe_seq_idx"
+            ),
+            # One per list ordering, the id breaks ties so pages can
+            # resume after the last (value, id) seen
+            models.Index(
+                fields=["user", "id"], name="core_recipe_user_id_idx"
+            ),
+            models.Index(
+                fields=["user", "price", "id"], name="core_recipe_price_idx"
+            ),
+            models.Index(
+                fields=["user", "time_minutes", "id"],
+                name="core_recipe_time_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class SlowQuery(models.Model):
+    """Slow query seen by the slow query log, deduplicated by fingerprint"""
+
+    fingerprint = models.CharField(max_length=32, unique=True)
+    sql = models.TextField()
+    params = models.TextField(blank=True)
+    view = models.CharField(max_length=255, blank=True)
+    plan = models.TextField(blank=True)
+    count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.fingerprint
+
+
+class Task(models.Model):
+    """Background task waiting in the database backed queue"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    )
+
+    # dotted path of a function decorated with core.tasks.task
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # higher priorities are picked first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "-priority", "run_at"],
+                name="core_task_pick_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class Tombstone(models.Model):
+    """Record of a deleted recipe, tag or ingredient for syncing clients
+
+    The user is a plain id, tombstones are written while an account's
+    rows are being deleted and must not hold its deletion back.
+    """
+
+    KIND_RECIPE = "recipe"
+    KIND_TAG = "tag"
+    KIND_INGREDIENT = "ingredient"
+    KINDS = (
+        (KIND_RECIPE, "Recipe"),
+        (KIND_TAG, "Tag"),
+        (KIND_INGREDIENT, "Ingredient"),
+    )
+
+    user_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.BigIntegerField()
+    seq = models.BigIntegerField()
+    deleted = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user_id", "seq"], name="core_tombstone_seq_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+def generate_token_key():
+    return secrets.token_hex(20)
+
+
+class AuthToken(models.Model):
+    """API token of one of a user's devices, valid until it expires
+
+    Using a token pushes its expiry back, see ExpiringTokenAuthentication.
+    """
+
+    key = models.CharField(
+        max_length=40, primary_key=True, default=generate_token_key
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="auth_tokens",
+        on_delete=CASCADE
+    )
+    device = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(default=timezone.now)
+    # Indexed for the purge of expired tokens
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.device}".strip()
+
+
+class IdempotencyKey(models.Model):
+    """Outcome of a write made with an Idempotency-Key header
+
+    A row without status is still being executed. Finished ones are
+    replayed to retries until IDEMPOTENCY_KEY_TTL has passed.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(
+        null=True, blank=True, encoder=DjangoJSONEncoder
+    )
+    location = models.CharField(max_length=2048, blank=True)
+    # Indexed for the purge of expired keys
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="core_idempotency_key_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
+class UserShard(models.Model):
+    """Database holding a user's recipes, tags and ingredients
+
+    Kept on the default database. Users without a row predate sharding
+    and have their data on the default database.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, primary_key=True, on_delete=CASCADE
+    )
+    alias = models.CharField(max_length=64)
+    # Set while the data is copied to another shard, writes wait for it
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.user_id} {self.alias}"
@@ -0,0 +1,68 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset):
+    """Return the planner's row estimate for a queryset
+
+    Only postgres exposes a usable estimate, None is returned for the
+    other databases so callers can fall back to an exact count.
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def bounded_count(queryset, limit):
+    """Return the count of a queryset and whether it is approximate
+
+    Rows are counted exactly up to limit, a LIMITed count that stops
+    early however large the queryset is. Past it the planner's estimate
+    is used when there is one, never below what was actually counted.
+    """
+
+    if not queryset.query.is_sliced:
+        queryset = queryset.order_by()
+    count = queryset[:limit + 1].count()
+    if count <= limit:
+        return count, False
+
+    estimate = estimated_count(queryset)
+    if estimate is None:
+        return queryset.count(), False
+
+    return max(estimate, count), True
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator using the planner's estimate for very large querysets
+
+    Like the API lists, rows are counted exactly up to
+    LIST_EXACT_COUNT_LIMIT.
+    """
+
+    @cached_property
+    def count(self):
+        """Return the bounded count of a queryset"""
+
+        if hasattr(self.object_list, "query"):
+            return bounded_count(
+                self.object_list, settings.LIST_EXACT_COUNT_LIMIT
+            )[0]
+
+        return super().count
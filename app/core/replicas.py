@@ -0,0 +1,152 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.sharding import current_user_id
+
+
+PIN_COOKIE = "primary_pin"
+
+# Set once the current request or command has written, so it reads its
+# own writes from the primary instead of a possibly lagging replica
+_pinned = ContextVar("pinned_to_primary", default=False)
+# User whose pin was last looked up in the cache, so a request asks once
+_checked_user_id = ContextVar("pin_checked_user_id", default=None)
+# Set to send every read to one database, e.g. to share a snapshot
+_read_alias = ContextVar("read_alias", default=None)
+
+
+def pin_to_primary():
+    """Send the remaining reads of this request to the primary"""
+
+    _pinned.set(True)
+
+
+def _pin_key(user_id):
+    return f"primary-pin:{user_id}"
+
+
+def pin_user(user_id):
+    """Send a user's reads to the primary for the staleness window
+
+    Unlike the cookie this also holds for token clients that drop
+    cookies, and for the user's other devices.
+    """
+
+    cache.set(_pin_key(user_id), True, settings.REPLICA_STALENESS_SECONDS)
+
+
+def is_pinned():
+    """Return True when reads have to go to the primary"""
+
+    if _pinned.get():
+        return True
+
+    user_id = current_user_id()
+    if user_id is None or _checked_user_id.get() == user_id:
+        return False
+
+    _checked_user_id.set(user_id)
+    if cache.get(_pin_key(user_id)):
+        _pinned.set(True)
+
+    return _pinned.get()
+
+
+@contextmanager
+def read_from(alias):
+    """Send the reads made inside the block to one database"""
+
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Send reads to the replicas and writes to the primary database"""
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "REPLICA_DATABASES", [])
+        if not replicas or is_pinned():
+            return DEFAULT_DB_ALIAS
+
+        if _read_alias.get() is not None:
+            return _read_alias.get()
+
+        # Reads inside a transaction have to see what it wrote
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        # Follow the database the related instance was loaded from,
+        # unless that is a shard holding other models
+        instance = hints.get("instance")
+        if instance is not None and \
+                instance._state.db in (DEFAULT_DB_ALIAS, *replicas):
+            return instance._state.db
+
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in getattr(settings, "REPLICA_DATABASES", []):
+            return False
+
+        return None
+
+
+class PrimaryPinMiddleware:
+    """Keep a client on the primary for a while after it wrote
+
+    The client is pinned by a cookie and, once authenticated, by its user.
+    """
+
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Writes, and clients that wrote within the staleness window,
+        # read from the primary for the whole request
+        token = _pinned.set(
+            request.method not in self.safe_methods
+            or PIN_COOKIE in request.COOKIES
+        )
+        checked_token = _checked_user_id.set(None)
+
+        try:
+            response = self.get_response(request)
+            if request.method not in self.safe_methods:
+                response.set_cookie(
+                    PIN_COOKIE, "1",
+                    max_age=settings.REPLICA_STALENESS_SECONDS,
+                    httponly=True,
+                    samesite="Lax"
+                )
+                # Set by the authentication of DRF views too
+                user = getattr(request, "user", None)
+                if user is not None and user.is_authenticated:
+                    pin_user(user.pk)
+        finally:
+            _pinned.reset(token)
+            _checked_user_id.reset(checked_token)
+
+        return response
@@ -0,0 +1,52 @@
+from django.db import connections
+from django.db.models import BooleanField, Case, F, FloatField, Func, Q, \
+    Value, When
+
+
+class TrigramSimilar(Func):
+    """name % term, true over pg_trgm's similarity threshold
+
+    django.contrib.postgres has this as a lookup, but importing it
+    requires psycopg2 which sqlite setups don't have.
+    """
+
+    arg_joiner = " %% "
+    template = "(%(expressions)s)"
+    output_field = BooleanField()
+
+
+class TrigramSimilarity(Func):
+    function = "SIMILARITY"
+    output_field = FloatField()
+
+
+def search_names(queryset, term):
+    """Filter and rank tags or ingredients for autocompletion
+
+    Names starting with the term come first, then on postgres names
+    close to it by trigram similarity, which catches typos. Each group
+    is ranked by how many recipes use the name.
+    """
+
+    prefix = Q(name__istartswith=term)
+    queryset = queryset.annotate(
+        is_prefix=Case(
+            When(prefix, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        )
+    )
+
+    if connections[queryset.db].vendor == "postgresql":
+        queryset = queryset.annotate(
+            fuzzy=TrigramSimilar(F("name"), Value(term)),
+            similarity=TrigramSimilarity(F("name"), Value(term))
+        ).filter(prefix | Q(fuzzy=True))
+    else:
+        queryset = queryset.annotate(
+            similarity=Value(0.0, output_field=FloatField())
+        ).filter(prefix)
+
+    return queryset.order_by(
+        "-is_prefix", "-recipe_count", "-similarity", "name"
+    )
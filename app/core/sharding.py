@@ -0,0 +1,575 @@
+import hashlib
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.models import CanonicalName, Ingredient, Recipe, Tag, Tombstone, \
+    UserShard
+
+
+logger = logging.getLogger("core.sharding")
+
+# User whose data the current request or job works on, set when a
+# request is authenticated
+_user_id = ContextVar("shard_user_id", default=None)
+
+BATCH_SIZE = 1000
+# Largest value of the 32-bit id columns
+MAX_ID = 2 ** 31 - 1
+
+
+class ShardMoving(APIException):
+    """The user's data is being moved to another shard"""
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Your data is being moved, try again shortly.")
+    default_code = "shard_moving"
+
+
+def sharded_models():
+    """Return the models whose rows live on their owner's shard"""
+
+    return (
+        Recipe, Tag, Ingredient, Recipe.tags.through,
+        Recipe.ingredients.through, Tombstone,
+    )
+
+
+def data_databases():
+    """Return every database that may hold recipe data"""
+
+    return [DEFAULT_DB_ALIAS] + [
+        alias for alias in settings.SHARD_DATABASES
+        if alias != DEFAULT_DB_ALIAS
+    ]
+
+
+def activate_user(user_id):
+    """Route the rest of the request's recipe queries to a user's shard"""
+
+    _user_id.set(user_id)
+
+
+def current_user_id():
+    return _user_id.get()
+
+
+@contextmanager
+def for_user(user_id):
+    """Route the recipe queries made inside the block to a user's shard"""
+
+    token = _user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _user_id.reset(token)
+
+
+def hash_shard(user_id):
+    """Return the shard a new user is placed on"""
+
+    digest = hashlib.sha1(str(user_id).encode()).digest()
+    shards = settings.SHARD_DATABASES
+
+    return shards[int.from_bytes(digest[:8], "big") % len(shards)]
+
+
+def _cache_key(user_id):
+    return f"user-shard:{user_id}"
+
+
+def shard_for(user_id, writing=False):
+    """Return the database holding a user's recipe data
+
+    The map is cached for SHARD_MAP_CACHE_SECONDS, except while the user
+    is being moved. Writes during a move raise ShardMoving.
+    """
+
+    if not settings.SHARD_DATABASES or user_id is None:
+        return DEFAULT_DB_ALIAS
+
+    alias = cache.get(_cache_key(user_id))
+    if alias is not None:
+        return alias
+
+    shard = UserShard.objects.using(DEFAULT_DB_ALIAS) \
+        .filter(user_id=user_id).values("alias", "moving").first()
+    if shard is None:
+        alias = DEFAULT_DB_ALIAS
+    elif shard["moving"]:
+        if writing:
+            raise ShardMoving()
+        return shard["alias"]
+    else:
+        alias = shard["alias"]
+
+    cache.set(_cache_key(user_id), alias, settings.SHARD_MAP_CACHE_SECONDS)
+
+    return alias
+
+
+def counters(user_id):
+    """Return a queryset of the user row holding the data counters
+
+    data_version and sync_floor are kept next to the data, on the
+    user's shard, so they change in the same transactions.
+    """
+
+    return get_user_model().objects.using(shard_for(user_id)) \
+        .filter(pk=user_id)
+
+
+def user_counter(user, field):
+    """Return data_version or sync_floor of an authenticated user
+
+    The user row read at authentication is current unless the counters
+    live on a shard.
+    """
+
+    if shard_for(user.pk) == DEFAULT_DB_ALIAS:
+        return getattr(user, field)
+
+    return counters(user.pk).values_list(field, flat=True).first()
+
+
+def ensure_shadow_user(user, alias):
+    """Create the copy of a user that a shard's foreign keys point at"""
+
+    if alias == DEFAULT_DB_ALIAS:
+        return
+
+    get_user_model().objects.using(alias).bulk_create(
+        [get_user_model()(
+            pk=user.pk, email=user.email, name=user.name, password="!",
+            is_active=False
+        )],
+        ignore_conflicts=True
+    )
+
+
+def place_user(user):
+    """Put a new user on the shard their id hashes to"""
+
+    if not settings.SHARD_DATABASES:
+        return
+
+    alias = hash_shard(user.pk)
+    ensure_shadow_user(user, alias)
+    UserShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        user_id=user.pk, defaults={"alias": alias}
+    )
+
+
+def copy_canonical_names(ids, alias):
+    """Copy canonical names to a shard, keeping their ids"""
+
+    if alias == DEFAULT_DB_ALIAS or not ids:
+        return
+
+    CanonicalName.objects.using(alias).bulk_create(
+        CanonicalName.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=ids),
+        ignore_conflicts=True
+    )
+
+
+def id_range(alias):
+    """Return the first and last recipe, tag and ingredient id of a database
+
+    The default database keeps the ids up to SHARD_ID_SPAN, shard n
+    hands out those from (n + 1) * SHARD_ID_SPAN + 1 to
+    (n + 2) * SHARD_ID_SPAN. Ranges must fit the 32-bit id columns.
+    """
+
+    span = settings.SHARD_ID_SPAN
+    if alias not in settings.SHARD_DATABASES:
+        return 1, span
+
+    index = settings.SHARD_DATABASES.index(alias)
+    start, end = (index + 1) * span + 1, (index + 2) * span
+    if end > MAX_ID:
+        raise ImproperlyConfigured(
+            f"The ids of {alias} would go past {MAX_ID}, use fewer shards "
+            f"or a smaller SHARD_ID_SPAN"
+        )
+
+    return start, end
+
+
+def _reserve_ids(alias, model, start, end):
+    """Make a table's new ids on a database start at start, end at end"""
+
+    connection = connections[alias]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT pg_get_serial_sequence(%s, 'id')", [table]
+            )
+            sequence = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT setval(%s, %s, false) FROM {sequence} "
+                f"WHERE last_value < %s",
+                [sequence, start, start]
+            )
+            # Fails when the database already went past its range, and
+            # makes inserts fail once the range is used up
+            cursor.execute(f"ALTER SEQUENCE {sequence} MAXVALUE {end:d}")
+        elif connection.vendor == "sqlite":
+            # SQLite has no upper bound, it also continues after the
+            # largest id a move brought in from a later range
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = %s "
+                "WHERE name = %s AND seq < %s",
+                [start - 1, table, start - 1]
+            )
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS "
+                "(SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, start - 1, table]
+            )
+
+
+def reserve_ids(alias):
+    """Limit a database to its own range of recipe, tag and ingredient ids
+
+    Moved rows keep their ids, so ids must never be handed out by two
+    databases, see id_range().
+    """
+
+    if not settings.SHARD_DATABASES or alias not in data_databases():
+        return
+
+    start, end = id_range(alias)
+    for model in (Recipe, Tag, Ingredient):
+        _reserve_ids(alias, model, start, end)
+
+
+def _batches(queryset, batch_size):
+    """Yield the rows of a queryset ordered by pk, batch_size at a time"""
+
+    queryset = queryset.order_by("pk")
+    last = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last)[:batch_size])
+        if not rows:
+            break
+
+        last = rows[-1].pk
+        yield rows
+
+
+def _copy(queryset, target, batch_size, keep_pk=True):
+    """Copy the rows of a queryset to another database"""
+
+    copied = 0
+    for rows in _batches(queryset, batch_size):
+        if not keep_pk:
+            for row in rows:
+                row.pk = None
+        queryset.model.objects.using(target).bulk_create(rows)
+        copied += len(rows)
+
+    return copied
+
+
+def _copy_over(queryset, target, batch_size):
+    """Copy the rows of a queryset over their older copies on target"""
+
+    model = queryset.model
+    fields = [
+        field.name for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    copied = 0
+    for rows in _batches(queryset, batch_size):
+        existing = set(
+            model.objects.using(target).filter(pk__in=[r.pk for r in rows])
+            .values_list("pk", flat=True)
+        )
+        model.objects.using(target).bulk_update(
+            [row for row in rows if row.pk in existing], fields
+        )
+        model.objects.using(target).bulk_create(
+            [row for row in rows if row.pk not in existing]
+        )
+        copied += len(rows)
+
+    return copied
+
+
+def _delete_ids(model, column, ids, alias, batch_size):
+    """Delete the rows whose column is one of ids, without signals"""
+
+    # core.deletion imports core.signals, which imports this module
+    from core.deletion import _raw_delete
+
+    ids = list(ids)
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        deleted += _raw_delete(
+            model, column, ids[start:start + batch_size], using=alias
+        )
+
+    return deleted
+
+
+def _delete(model, alias, filters, batch_size):
+    """Delete the rows of a user without signals, in batches"""
+
+    deleted = 0
+    while True:
+        ids = list(
+            model.objects.using(alias).filter(**filters)
+            .order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+
+        with transaction.atomic(using=alias):
+            deleted += _delete_ids(model, "id", ids, alias, batch_size)
+
+    return deleted
+
+
+def _delete_user_rows(user_id, alias, batch_size):
+    for through in (Recipe.tags.through, Recipe.ingredients.through):
+        _delete(through, alias, {"recipe__user_id": user_id}, batch_size)
+    for model in (Recipe, Tag, Ingredient, Tombstone):
+        _delete(model, alias, {"user_id": user_id}, batch_size)
+
+
+def _copy_names(queryset, target):
+    copy_canonical_names(
+        list(queryset.values_list("canonical_id", flat=True).distinct()),
+        target
+    )
+
+
+def _copy_snapshot(user_id, source, target, batch_size):
+    """Copy the rows of a user who may still be writing
+
+    Returns the data version the copy started from, rows changed after
+    it may be copied in any state and are copied again by
+    _copy_changes().
+    """
+
+    version = get_user_model().objects.using(source).filter(pk=user_id) \
+        .values_list("data_version", flat=True).get()
+
+    copied = 0
+    for model in (Tag, Ingredient, Recipe):
+        rows = model.objects.using(source).filter(user_id=user_id)
+        if model is not Recipe:
+            _copy_names(rows, target)
+        copied += _copy(rows, target, batch_size)
+
+    # A recipe unchanged since the version only links rows that existed
+    # then, and were copied above
+    for through in (Recipe.tags.through, Recipe.ingredients.through):
+        copied += _copy(
+            through.objects.using(source).filter(
+                recipe__user_id=user_id, recipe__seq__lte=version
+            ),
+            target, batch_size, keep_pk=False
+        )
+    copied += _copy(
+        Tombstone.objects.using(source)
+        .filter(user_id=user_id, seq__lte=version),
+        target, batch_size, keep_pk=False
+    )
+
+    return version, copied
+
+
+def _copy_changes(user_id, source, target, version, batch_size):
+    """Bring a copy made by _copy_snapshot() up to date
+
+    Run while the user can't write. Everything changed after the
+    version has a higher change number or a tombstone: changed rows are
+    copied over, deleted rows are deleted, and the links of changed
+    recipes are copied again.
+    """
+
+    # core.signals imports this module
+    from core.signals import recipe_links, update_recipe_counts
+
+    deleted = defaultdict(list)
+    tombstones = Tombstone.objects.using(source) \
+        .filter(user_id=user_id, seq__gt=version)
+    for kind, object_id in tombstones.values_list("kind", "object_id"):
+        deleted[kind].append(object_id)
+    changed = {
+        model: model.objects.using(source)
+        .filter(user_id=user_id, seq__gt=version)
+        for model in (Tag, Ingredient, Recipe)
+    }
+    recipe_ids = list(changed[Recipe].values_list("pk", flat=True))
+    relinked = recipe_ids + deleted[Recipe._meta.model_name]
+
+    copied = 0
+    recount = {}
+    with transaction.atomic(using=target):
+        for model in (Tag, Ingredient):
+            through, column = recipe_links(model)
+            recount[model] = set(
+                through.objects.using(target)
+                .filter(recipe_id__in=relinked)
+                .values_list(column, flat=True)
+            )
+            _delete_ids(through, "recipe_id", relinked, target, batch_size)
+            _delete_ids(
+                through, column, deleted[model._meta.model_name], target,
+                batch_size
+            )
+
+        for model in (Recipe, Tag, Ingredient):
+            _delete_ids(
+                model, "id", deleted[model._meta.model_name], target,
+                batch_size
+            )
+
+        for model in (Tag, Ingredient, Recipe):
+            if model is not Recipe:
+                _copy_names(changed[model], target)
+            copied += _copy_over(changed[model], target, batch_size)
+
+        for model in (Tag, Ingredient):
+            through, column = recipe_links(model)
+            links = through.objects.using(source) \
+                .filter(recipe_id__in=recipe_ids)
+            recount[model].update(links.values_list(column, flat=True))
+            copied += _copy(links, target, batch_size, keep_pk=False)
+            update_recipe_counts(model, recount[model], target)
+
+        copied += _copy(tombstones, target, batch_size, keep_pk=False)
+
+        counters = get_user_model().objects.using(source).filter(
+            pk=user_id
+        ).values("data_version", "sync_floor").get()
+        get_user_model().objects.using(target).filter(pk=user_id) \
+            .update(**counters)
+
+    return copied
+
+
+def _set_moving(user_id, alias, moving):
+    UserShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        user_id=user_id, defaults={"alias": alias, "moving": moving}
+    )
+    cache.delete(_cache_key(user_id))
+
+
+def move_user(user_id, target, batch_size=None, grace=None, report=None):
+    """Move a user's recipe data to another database while online
+
+    The rows are copied with their ids while the user keeps using the
+    source. Writes are then refused with ShardMoving and, once the
+    processes that cached the old map had grace seconds to notice, the
+    rows changed since the copy started are copied again. The map is
+    switched to the target and the rows are deleted from the source.
+    Writes are only refused for the grace period and the last copy.
+    """
+
+    batch_size = batch_size or BATCH_SIZE
+    grace = settings.SHARD_MAP_CACHE_SECONDS if grace is None else grace
+    report = report or logger.info
+    user = get_user_model().objects.using(DEFAULT_DB_ALIAS).get(pk=user_id)
+    source = shard_for(user_id)
+    if source == target:
+        return 0
+
+    # Left over by a move that failed
+    _delete_user_rows(user_id, target, batch_size)
+    ensure_shadow_user(user, target)
+    version, copied = _copy_snapshot(user_id, source, target, batch_size)
+    report(f"Copied {copied} rows of user {user_id}, refusing writes")
+
+    _set_moving(user_id, source, True)
+    try:
+        # Processes that cached the old map may still be writing
+        time.sleep(grace)
+        copied += _copy_changes(user_id, source, target, version, batch_size)
+    except Exception:
+        _set_moving(user_id, source, False)
+        raise
+
+    _set_moving(user_id, target, False)
+    report(f"User {user_id} now on {target}")
+
+    _delete_user_rows(user_id, source, batch_size)
+    if source != DEFAULT_DB_ALIAS:
+        get_user_model().objects.using(source).filter(pk=user_id).delete()
+
+    return copied
+
+
+def _hint_user_id(hints):
+    instance = hints.get("instance")
+    if instance is None:
+        return None
+
+    if isinstance(instance, get_user_model()):
+        return instance.pk
+
+    return getattr(instance, "user_id", None)
+
+
+class ShardRouter:
+    """Send a user's recipe data to the database the shard map names
+
+    The user comes from the instance involved, or from the request.
+    Users on the default database are left to the replica router.
+    """
+
+    def _route(self, model, hints, writing):
+        if not settings.SHARD_DATABASES or model not in sharded_models():
+            return None
+
+        user_id = _hint_user_id(hints)
+        if user_id is None:
+            user_id = current_user_id()
+
+        alias = shard_for(user_id, writing=writing)
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints, writing=False)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints, writing=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users are read from the default database or its replicas, and
+        # own rows on the shards
+        databases = {*data_databases(), *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+
+        return None
+
+
+class ShardMiddleware:
+    """Forget the user a previous request routed to"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _user_id.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _user_id.reset(token)
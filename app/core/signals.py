@@ -0,0 +1,153 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, \
+    post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core.models import Tag, Ingredient, Recipe
+from core.sharding import place_user
+from core.sync import record_deletions, touch_recipes
+from core.vocabulary import canonical_ids, normalize_name
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+def record_deletion(sender, instance, **kwargs):
+    """Leave a tombstone for syncing clients"""
+
+    record_deletions(
+        instance.user_id, sender._meta.model_name, [instance.pk]
+    )
+
+
+def recipe_links(model):
+    """Return the through model and column linking recipes to a model"""
+
+    if model is Tag:
+        return Recipe.tags.through, "tag_id"
+
+    return Recipe.ingredients.through, "ingredient_id"
+
+
+def linked_ids(recipe_ids, using=None):
+    """Return the ids of the tags and ingredients linked to recipes"""
+
+    linked = {}
+    for model in (Tag, Ingredient):
+        through, column = recipe_links(model)
+        linked[model] = list(
+            through.objects.using(using).filter(recipe_id__in=recipe_ids)
+            .values_list(column, flat=True).distinct()
+        )
+
+    return linked
+
+
+def update_recipe_counts(model, ids, using=None):
+    """Recount the recipes using some tags or ingredients"""
+
+    through, column = recipe_links(model)
+    counts = through.objects.filter(**{column: OuterRef("pk")}) \
+        .order_by().values(column).annotate(count=Count("pk")) \
+        .values("count")
+
+    model.objects.using(using).filter(pk__in=ids).update(
+        recipe_count=Coalesce(Subquery(counts), 0)
+    )
+
+
+def update_ingredient_counts(recipe_ids, using=None):
+    """Recount the ingredients linked to some recipes"""
+
+    counts = Recipe.ingredients.through.objects \
+        .filter(recipe_id=OuterRef("pk")).order_by().values("recipe_id") \
+        .annotate(count=Count("pk")).values("count")
+
+    Recipe.objects.using(using).filter(pk__in=recipe_ids).update(
+        ingredient_count=Coalesce(Subquery(counts), 0)
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_counted(sender, instance, action, reverse, pk_set, using,
+                         **kwargs):
+    """Keep the counts and change numbers in step with the links"""
+
+    model = Tag if sender is Recipe.tags.through else Ingredient
+    _, column = recipe_links(model)
+    source, target = (column, "recipe_id") if reverse \
+        else ("recipe_id", column)
+
+    if action == "pre_clear":
+        # The rows losing a link are unknown after the clear
+        instance._cleared_ids = list(
+            sender.objects.using(using).filter(**{source: instance.pk})
+            .values_list(target, flat=True)
+        )
+        return
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    ids = instance._cleared_ids if action == "post_clear" else pk_set
+    recipe_ids, attr_ids = (ids, [instance.pk]) if reverse \
+        else ([instance.pk], ids)
+
+    update_recipe_counts(model, attr_ids, using)
+    if model is Ingredient:
+        update_ingredient_counts(recipe_ids, using)
+    touch_recipes(instance.user_id, recipe_ids)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, using, **kwargs):
+    # The links are removed by the cascade, which sends no m2m signal
+    instance._linked_ids = linked_ids([instance.pk], using)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, using, **kwargs):
+    for model, ids in getattr(instance, "_linked_ids", {}).items():
+        update_recipe_counts(model, ids, using)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def attr_deleting(sender, instance, using, **kwargs):
+    instance._linked_recipe_ids = list(
+        instance.recipe_set.using(using).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def attr_deleted(sender, instance, using, **kwargs):
+    recipe_ids = getattr(instance, "_linked_recipe_ids", [])
+    if sender is Ingredient:
+        update_ingredient_counts(recipe_ids, using)
+    touch_recipes(instance.user_id, recipe_ids)
+
+
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Ingredient)
+def set_canonical_name(sender, instance, using, update_fields=None,
+                       **kwargs):
+    """Point tags and ingredients at their shared normalized name"""
+
+    if update_fields is not None and "name" not in update_fields:
+        return
+
+    name = normalize_name(instance.name)
+    instance.canonical_id = canonical_ids([name], using)[name]
+
+
+@receiver(post_save, sender=get_user_model())
+def user_placed(sender, instance, created, using, raw=False, **kwargs):
+    """Give new users a shard, shadow copies on the shards excepted"""
+
+    if created and not raw and using == DEFAULT_DB_ALIAS:
+        place_user(instance)
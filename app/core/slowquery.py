@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.utils import IntegrityError
+
+
+logger = logging.getLogger("core.slowquery")
+
+# Patterns used to turn a query into a stable fingerprint, so the same
+# statement with different literals or IN list sizes is counted once
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+EXPLAIN_SAVEPOINT = "slow_query_explain"
+
+
+def normalize_sql(sql):
+    """Return the sql with literals and IN lists replaced by placeholders"""
+
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = _IN_LIST_RE.sub("IN (...)", sql)
+
+    return _SPACE_RE.sub(" ", sql).strip()
+
+
+def fingerprint(sql):
+    """Return a short hash identifying the shape of a query"""
+
+    return hashlib.md5(normalize_sql(sql).encode()).hexdigest()
+
+
+def view_name(view_func):
+    """Return a dotted name for a view function or DRF viewset"""
+
+    view = getattr(view_func, "cls", view_func)
+
+    return f"{view.__module__}.{view.__name__}"
+
+
+class SlowQueryRecorder:
+    """Execute wrapper collecting queries slower than the threshold"""
+
+    def __init__(self, threshold_ms, explain_rate=0.0):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.view = ""
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        if duration_ms >= self.threshold_ms:
+            plan = ""
+            if not many and self._should_explain(sql, context):
+                plan = self._explain(sql, params, context)
+
+            logger.warning(
+                "Slow query (%.1f ms) in %s: %s; params=%r",
+                duration_ms, self.view or "-", sql, params
+            )
+            self.queries.append({
+                "sql": sql,
+                "params": "" if many else repr(params),
+                "duration_ms": duration_ms,
+                "plan": plan,
+            })
+
+        return result
+
+    def _should_explain(self, sql, context):
+        """Only sample plain SELECTs and only postgres knows BUFFERS"""
+
+        return (
+            context["connection"].vendor == "postgresql"
+            and sql.lstrip().upper().startswith("SELECT")
+            and random.random() < self.explain_rate
+        )
+
+    def _explain(self, sql, params, context):
+        """Capture the actual plan of a query that was just executed
+
+        ANALYZE runs the query again, so it runs in a savepoint, or in a
+        transaction of its own outside one, that is always rolled back.
+        A failing EXPLAIN can't abort the caller's transaction and
+        nothing the query does is kept.
+        """
+
+        if context["connection"].in_atomic_block:
+            begin = [f"SAVEPOINT {EXPLAIN_SAVEPOINT}"]
+            rollback = [
+                f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}",
+                f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}",
+            ]
+        else:
+            begin, rollback = ["BEGIN"], ["ROLLBACK"]
+
+        # Using the raw DB-API connection so the EXPLAIN doesn't go back
+        # through the execute wrappers or clobber the caller's cursor
+        raw_connection = context["connection"].connection
+        try:
+            with raw_connection.cursor() as cursor:
+                for statement in begin:
+                    cursor.execute(statement)
+                try:
+                    cursor.execute(
+                        "EXPLAIN (ANALYZE, BUFFERS) " + sql, params
+                    )
+                    return "\n".join(row[0] for row in cursor.fetchall())
+                finally:
+                    for statement in rollback:
+                        cursor.execute(statement)
+        except Exception:
+            logger.exception("Unable to capture plan for slow query")
+            return ""
+
+    def flush(self):
+        """Store collected queries, deduplicated by fingerprint"""
+
+        from core.models import SlowQuery
+
+        for query in self.queries:
+            fields = {
+                "sql": query["sql"],
+                "params": query["params"],
+                "view": self.view,
+            }
+            if query["plan"]:
+                fields["plan"] = query["plan"]
+
+            key = fingerprint(query["sql"])
+            updated = SlowQuery.objects.filter(fingerprint=key).update(
+                count=F("count") + 1,
+                total_ms=F("total_ms") + query["duration_ms"],
+                max_ms=Greatest("max_ms", query["duration_ms"]),
+                **fields
+            )
+            if updated:
+                continue
+
+            try:
+                SlowQuery.objects.create(
+                    fingerprint=key,
+                    count=1,
+                    total_ms=query["duration_ms"],
+                    max_ms=query["duration_ms"],
+                    **fields
+                )
+            except IntegrityError:
+                # Another worker created it first, count it there
+                SlowQuery.objects.filter(fingerprint=key).update(
+                    count=F("count") + 1,
+                    total_ms=F("total_ms") + query["duration_ms"],
+                )
+
+        self.queries = []
+
+
+class SlowQueryMiddleware:
+    """Record slow queries made while handling each request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "SLOW_QUERY_LOG", False):
+            return self.get_response(request)
+
+        recorder = SlowQueryRecorder(
+            settings.SLOW_QUERY_THRESHOLD_MS,
+            settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+        )
+        request.slow_query_recorder = recorder
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        try:
+            recorder.flush()
+        except Exception:
+            # Telemetry must never break the actual response
+            logger.exception("Unable to store slow queries")
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Remember which view the queries are coming from"""
+
+        recorder = getattr(request, "slow_query_recorder", None)
+        if recorder is not None:
+            recorder.view = view_name(view_func)
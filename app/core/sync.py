@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, Max, Value, When
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+from django.utils import timezone
+
+from core.models import Recipe, Tombstone
+from core.sharding import counters, data_databases, shard_for
+
+
+# Sent after change numbers are taken, with user_id, count and the ids of
+# the recipes whose content changed
+data_changed = Signal()
+
+BATCH_SIZE = 500
+
+
+def allocate_seq(user_id, count=1):
+    """Take the next count change numbers of a user, returns the first
+
+    The numbers come from User.data_version, so taking them also
+    invalidates what is cached from the user's data. Callers must be in
+    a transaction: the user's row stays locked until it commits, so a
+    change can't become visible after a later numbered one. With shards
+    the row is the user's copy on their shard, next to the data.
+    """
+
+    users = counters(user_id)
+    users.update(data_version=F("data_version") + count)
+    last = users.values_list("data_version", flat=True).get()
+
+    return last - count + 1
+
+
+def touch_recipes(user_id, recipe_ids):
+    """Give recipes whose tags or ingredients changed new change numbers"""
+
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return
+
+    using = shard_for(user_id, writing=True)
+    with transaction.atomic(using=using):
+        first = allocate_seq(user_id, len(recipe_ids))
+        now = timezone.now()
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            batch = recipe_ids[start:start + BATCH_SIZE]
+            Recipe.objects.using(using).filter(pk__in=batch).update(
+                seq=Case(*[
+                    When(pk=pk, then=Value(first + start + offset))
+                    for offset, pk in enumerate(batch)
+                ]),
+                updated=now
+            )
+
+    data_changed.send(
+        sender=Recipe, user_id=user_id, count=len(recipe_ids),
+        recipe_ids=recipe_ids
+    )
+
+
+def record_deletions(user_id, kind, ids):
+    """Write tombstones for deleted recipes, tags or ingredients"""
+
+    ids = list(ids)
+    if not ids:
+        return
+
+    using = shard_for(user_id, writing=True)
+    with transaction.atomic(using=using):
+        first = allocate_seq(user_id, len(ids))
+        Tombstone.objects.using(using).bulk_create([
+            Tombstone(
+                user_id=user_id, kind=kind, object_id=object_id,
+                seq=first + offset
+            )
+            for offset, object_id in enumerate(ids)
+        ])
+
+    data_changed.send(
+        sender=Tombstone, user_id=user_id, count=len(ids),
+        recipe_ids=ids if kind == Tombstone.KIND_RECIPE else []
+    )
+
+
+def prune_tombstones(days=None, batch_size=None):
+    """Delete tombstones older than days, returns how many
+
+    Each user's sync floor is raised to the newest pruned change, so
+    clients that last synced before it know to start over.
+    """
+
+    days = settings.SYNC_TOMBSTONE_DAYS if days is None else days
+    batch_size = batch_size or BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+    pruned = 0
+
+    for using in data_databases():
+        while True:
+            batch = list(
+                Tombstone.objects.using(using).filter(deleted__lt=cutoff)
+                .order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+
+            with transaction.atomic(using=using):
+                tombstones = Tombstone.objects.using(using) \
+                    .filter(pk__in=batch)
+                floors = tombstones.values("user_id") \
+                    .annotate(seq=Max("seq"))
+                for floor in floors:
+                    get_user_model().objects.using(using) \
+                        .filter(pk=floor["user_id"]).update(
+                            sync_floor=Greatest(
+                                "sync_floor", Value(floor["seq"])
+                            )
+                        )
+                pruned += tombstones.delete()[0]
+
+    return pruned
@@ -0,0 +1,148 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Task
+
+
+logger = logging.getLogger("core.tasks")
+
+
+def task(func):
+    """Mark a function as runnable by the worker
+
+    The function gets a delay() method to enqueue it with the default
+    priority, its arguments have to be JSON serializable.
+    """
+
+    func.is_task = True
+    func.task_name = f"{func.__module__}.{func.__qualname__}"
+
+    def delay(*args, **kwargs):
+        return enqueue(func, args=args, kwargs=kwargs)
+
+    func.delay = delay
+
+    return func
+
+
+def enqueue(func, args=(), kwargs=None, priority=0, delay=0,
+            max_attempts=None):
+    """Add a call of a task function to the queue"""
+
+    if not getattr(func, "is_task", False):
+        raise ValueError(f"{func!r} is not decorated with @task")
+
+    return Task.objects.create(
+        name=func.task_name,
+        args=list(args),
+        kwargs=kwargs or {},
+        priority=priority,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+    )
+
+
+def claim(limit=1):
+    """Lock and return up to limit tasks that are due"""
+
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = Task.objects.filter(
+            status=Task.QUEUED,
+            run_at__lte=now
+        ).order_by("-priority", "run_at", "id")
+
+        # On postgres concurrent workers skip each other's rows, other
+        # databases fall back on the conditional update bellow
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+
+        claimed = []
+        for candidate in queryset[:limit]:
+            updated = Task.objects.filter(
+                pk=candidate.pk,
+                status=Task.QUEUED
+            ).update(
+                status=Task.RUNNING,
+                locked_at=now,
+                attempts=F("attempts") + 1
+            )
+            if updated:
+                candidate.status = Task.RUNNING
+                candidate.locked_at = now
+                candidate.attempts += 1
+                claimed.append(candidate)
+
+    return claimed
+
+
+def run(task_obj):
+    """Run a claimed task, then delete it or schedule a retry"""
+
+    try:
+        func = import_string(task_obj.name)
+        if not getattr(func, "is_task", False):
+            raise ValueError(f"{task_obj.name} is not a task")
+        func(*task_obj.args, **task_obj.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Task %s (%s) failed", task_obj.pk, task_obj.name)
+
+        if task_obj.attempts >= task_obj.max_attempts:
+            Task.objects.filter(pk=task_obj.pk).update(
+                status=Task.FAILED,
+                locked_at=None,
+                last_error=error
+            )
+            return False
+
+        backoff = settings.TASK_RETRY_BACKOFF * 2 ** (task_obj.attempts - 1)
+        Task.objects.filter(pk=task_obj.pk).update(
+            status=Task.QUEUED,
+            locked_at=None,
+            run_at=timezone.now() + timedelta(seconds=backoff),
+            last_error=error
+        )
+        return False
+
+    # Finished tasks are removed so the queue table stays small
+    Task.objects.filter(pk=task_obj.pk).delete()
+    return True
+
+
+def requeue_stale():
+    """Put back tasks whose worker died while running them"""
+
+    cutoff = timezone.now() - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+
+    return Task.objects.filter(
+        status=Task.RUNNING,
+        locked_at__lt=cutoff
+    ).update(status=Task.QUEUED, locked_at=None)
+
+
+def run_next():
+    """Claim and run a single task, return False if nothing was due"""
+
+    tasks = claim()
+    for task_obj in tasks:
+        run(task_obj)
+
+    return bool(tasks)
+
+
+def queue_depth():
+    """Return the number of tasks per status and priority"""
+
+    return list(
+        Task.objects.values("status", "priority")
+        .annotate(count=Count("id"))
+        .order_by("status", "-priority")
+    )
@@ -1,7 +1,12 @@
-from django.test import TestCase, Client
+from unittest.mock import patch
+
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core import models
+from core.pagination import EstimatedCountPaginator, bounded_count
+
 
 class AdminSiteTest(TestCase):
     """Test admin side methods working"""
@@ -49,3 +54,103 @@ class AdminSiteTest(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_recipe_changelist(self):
+        """Test recipes are listed with their user"""
+
+        models.Recipe.objects.create(
+            user=self.user, title="Admin Soup", time_minutes=5, price=5.00
+        )
+
+        url = reverse("admin:core_recipe_changelist")
+        res = self.client.get(url)
+
+        self.assertContains(res, "Admin Soup")
+        self.assertContains(res, self.user.email)
+
+    def test_tag_and_ingredient_search(self):
+        """Test tags and ingredients can be searched by name prefix"""
+
+        models.Tag.objects.create(user=self.user, name="Spicy")
+        models.Tag.objects.create(user=self.user, name="Sweet")
+        models.Ingredient.objects.create(user=self.user, name="Salt")
+
+        res = self.client.get(
+            reverse("admin:core_tag_changelist"), {"q": "spi"}
+        )
+        self.assertContains(res, "Spicy")
+        self.assertNotContains(res, "Sweet")
+
+        res = self.client.get(
+            reverse("admin:core_ingredient_changelist"), {"q": "sa"}
+        )
+        self.assertContains(res, "Salt")
+
+    def test_tag_keyset_navigation(self):
+        """Test the next page link filters on the last id shown"""
+
+        tags = [
+            models.Tag(user=self.user, name=f"Tag {i}") for i in range(101)
+        ]
+        models.Tag.objects.bulk_create(tags)
+        oldest = models.Tag.objects.order_by("id").first()
+
+        url = reverse("admin:core_tag_changelist")
+        res = self.client.get(url)
+
+        next_url = res.context["cl"].keyset_next_url
+        self.assertIn("id__lt=", next_url)
+        self.assertNotContains(res, oldest.name)
+
+        res = self.client.get(url + next_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, oldest.name)
+        self.assertIsNone(res.context["cl"].keyset_next_url)
+
+    def test_recipe_add_page(self):
+        """Test the recipe add page renders with the lightweight widgets"""
+
+        url = reverse("admin:core_recipe_add")
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, "vForeignKeyRawIdAdminField")
+        self.assertContains(res, "admin-autocomplete")
+
+    def test_paginator_exact_count_fallback(self):
+        """Test small or non postgres querysets are counted exactly"""
+
+        models.Tag.objects.create(user=self.user, name="Counted")
+        paginator = EstimatedCountPaginator(
+            models.Tag.objects.order_by("id"), 10
+        )
+
+        self.assertEqual(paginator.count, 1)
+
+    @override_settings(LIST_EXACT_COUNT_LIMIT=2)
+    def test_paginator_estimate_past_limit(self):
+        """Test the admin estimates past the same limit as the API"""
+
+        for i in range(3):
+            models.Tag.objects.create(user=self.user, name=f"Tag {i}")
+        paginator = EstimatedCountPaginator(
+            models.Tag.objects.order_by("id"), 10
+        )
+
+        with patch("core.pagination.estimated_count", return_value=5000):
+            self.assertEqual(paginator.count, 5000)
+
+    def test_bounded_count(self):
+        """Test counts are exact up to the limit and estimated past it"""
+
+        for i in range(3):
+            models.Tag.objects.create(user=self.user, name=f"Tag {i}")
+        tags = models.Tag.objects.filter(user=self.user)
+
+        self.assertEqual(bounded_count(tags, 3), (3, False))
+        # Without a planner estimate the count stays exact
+        self.assertEqual(bounded_count(tags, 2), (3, False))
+        with patch("core.pagination.estimated_count", return_value=5000):
+            self.assertEqual(bounded_count(tags, 2), (5000, True))
+        with patch("core.pagination.estimated_count", return_value=1):
+            self.assertEqual(bounded_count(tags, 2), (3, True))
@@ -0,0 +1,145 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag
+
+
+BATCH_URL = reverse("batch")
+
+
+class BatchApiTests(TestCase):
+    """Test the batch API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "batch@test.com", "testpass", name="Batch"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_login_required(self):
+        """Test the batch needs an authenticated user"""
+
+        res = APIClient().post(
+            BATCH_URL, {"requests": [{"path": "/user/me/"}]}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_reads_in_one_round_trip(self):
+        """Test reads run together and return every response"""
+
+        Tag.objects.create(user=self.user, name="Vegan")
+
+        res = self.client.post(BATCH_URL, {"requests": [
+            {"path": "/user/me/"},
+            {"path": "/recipe/tags/?q=veg"},
+            {"path": "/recipe/recipes/"},
+            {"path": "/recipe/nothing/"},
+        ]}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        responses = res.data["responses"]
+        self.assertEqual(
+            [r["status"] for r in responses], [200, 200, 200, 404]
+        )
+        self.assertEqual(responses[0]["body"]["name"], "Batch")
+        self.assertEqual(responses[1]["body"][0]["name"], "Vegan")
+        self.assertEqual(responses[2]["body"], [])
+
+    def test_reads_share_transaction(self):
+        """Test a read only batch runs in one transaction"""
+
+        connection = connections["default"]
+        depths = []
+
+        def record():
+            depths.append(len(connection.savepoint_ids))
+            return Tag.objects.none()
+
+        with patch(
+            "recipe.views.TagViewSet.get_queryset", side_effect=record
+        ):
+            self.client.post(BATCH_URL, {"requests": [
+                {"path": "/recipe/tags/"},
+            ]}, format="json")
+            self.client.post(BATCH_URL, {"requests": [
+                {"path": "/recipe/tags/"},
+                {"method": "POST", "path": "/recipe/tags/",
+                 "body": {"name": "Quick"}},
+            ]}, format="json")
+
+        # Only the read only batch opened a transaction of its own
+        self.assertEqual(depths[0], depths[1] + 1)
+
+    def test_writes(self):
+        """Test writes are run in order with their bodies"""
+
+        res = self.client.post(BATCH_URL, {"requests": [
+            {"method": "POST", "path": "/recipe/tags/",
+             "body": {"name": "Quick"}},
+            {"path": "/recipe/tags/"},
+        ]}, format="json")
+
+        responses = res.data["responses"]
+        self.assertEqual(responses[0]["status"], status.HTTP_201_CREATED)
+        self.assertEqual(responses[1]["body"][0]["name"], "Quick")
+        self.assertTrue(Tag.objects.filter(name="Quick").exists())
+
+    def test_headers_per_request(self):
+        """Test calls don't inherit the batch's Idempotency-Key but can
+        send their own"""
+
+        tag = {"method": "POST", "path": "/recipe/tags/"}
+        res = self.client.post(BATCH_URL, {"requests": [
+            {**tag, "body": {"name": "Quick"}},
+            {**tag, "body": {"name": "Vegan"}},
+            {**tag, "body": {"name": "Hot"},
+             "headers": {"Idempotency-Key": "hot"}},
+            {**tag, "body": {"name": "Hot"},
+             "headers": {"Idempotency-Key": "hot"}},
+        ]}, format="json", HTTP_IDEMPOTENCY_KEY="batch")
+
+        responses = res.data["responses"]
+        self.assertEqual(
+            [r["status"] for r in responses], [201, 201, 201, 201]
+        )
+        self.assertEqual(responses[2]["body"], responses[3]["body"])
+        self.assertEqual(
+            sorted(Tag.objects.values_list("name", flat=True)),
+            ["Hot", "Quick", "Vegan"]
+        )
+
+    def test_fixed_headers_refused(self):
+        """Test a call can't set the headers the batch decides"""
+
+        res = self.client.post(BATCH_URL, {"requests": [
+            {"path": "/user/me/", "headers": {"Authorization": "Token x"}},
+        ]}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_paths(self):
+        """Test only API paths can be batched"""
+
+        res = self.client.post(BATCH_URL, {"requests": [
+            {"path": "/admin/"},
+        ]}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_too_many_requests(self):
+        """Test the number of calls is bounded"""
+
+        with self.settings(BATCH_MAX_REQUESTS=2):
+            res = self.client.post(BATCH_URL, {"requests": [
+                {"path": "/user/me/"}] * 3}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,9 +1,16 @@
+from io import BytesIO, StringIO
 from unittest.mock import patch
 
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.models import Recipe
+
 
 class CommandsTestCase(TestCase):
     """Test wait for db method is executing when calling"""
@@ -32,3 +39,27 @@ class CommandsTestCase(TestCase):
             call_command("wait_for_db")
 
             self.assertEqual(gi.call_count, 6)
+
+    def test_backfill_image_metadata(self):
+        """Test images stored without metadata get it, as a change"""
+
+        user = get_user_model().objects.create_user(
+            "test@backfill.com", "testpass"
+        )
+        buffer = BytesIO()
+        Image.new("P", (40, 20)).save(buffer, format="PNG")
+        recipe = Recipe.objects.create(
+            user=user, title="Curry", time_minutes=5, price=5,
+            image=SimpleUploadedFile("a.png", buffer.getvalue())
+        )
+        self.addCleanup(recipe.image.delete, save=False)
+        seq = recipe.seq
+        out = StringIO()
+
+        call_command("backfill_image_metadata", stdout=out)
+
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.image_width, recipe.image_height), (40, 20))
+        self.assertEqual(recipe.image_color, "#000000")
+        self.assertGreater(recipe.seq, seq)
+        self.assertIn("Stored metadata of 1 images", out.getvalue())
@@ -0,0 +1,121 @@
+import tempfile
+import os
+from io import StringIO
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+
+from core import deletion, tasks
+from core.models import Tag, Ingredient, Recipe, Task
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe with a tag and an ingredient"""
+
+    defaults = {"title": "Soup", "time_minutes": 10, "price": 5.00}
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.tags.add(Tag.objects.create(user=user, name="Tag"))
+    recipe.ingredients.add(Ingredient.objects.create(user=user, name="Salt"))
+
+    return recipe
+
+
+class DeletionTests(TestCase):
+    """Test batched deletion of accounts and recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="delete@me.com",
+            password="deletepass"
+        )
+        self.other = get_user_model().objects.create_user(
+            email="keep@me.com",
+            password="keeppass"
+        )
+
+    def test_delete_user_data(self):
+        """Test a user and everything they own are removed in batches"""
+
+        for _ in range(5):
+            sample_recipe(self.user)
+        kept = sample_recipe(self.other)
+
+        progress = []
+        stats = deletion.delete_user_data(
+            self.user.pk, batch_size=2, report=progress.append
+        )
+
+        self.assertEqual(stats["recipes"], 5)
+        self.assertEqual(stats["tags"], 5)
+        self.assertEqual(stats["ingredients"], 5)
+        self.assertIn("seconds", stats)
+        self.assertGreaterEqual(len(progress), 3)
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Recipe.tags.through.objects.filter(
+            recipe__user=self.user).exists())
+        self.assertEqual(Recipe.objects.get(), kept)
+        self.assertEqual(kept.tags.count(), 1)
+        self.assertEqual(kept.ingredients.count(), 1)
+
+    def test_deactivate_queues_deletion(self):
+        """Test deactivating blocks the account and deletes it later"""
+
+        sample_recipe(self.user)
+
+        deletion.deactivate_user(self.user)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(
+            Task.objects.get().name, deletion.delete_user.task_name)
+
+        tasks.run_next()
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists())
+
+    def test_delete_account_any_case(self):
+        """Test the command finds the account whatever the email's case"""
+
+        sample_recipe(self.user)
+
+        call_command("delete_account", "Delete@ME.com", stdout=StringIO())
+
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists())
+        self.assertTrue(
+            get_user_model().objects.filter(pk=self.other.pk).exists())
+
+    def test_reactivated_user_not_deleted(self):
+        """Test the task leaves alone an account that is active again"""
+
+        deletion.delete_user(self.user.pk)
+
+        self.assertTrue(
+            get_user_model().objects.filter(pk=self.user.pk).exists())
+
+    def test_images_removed(self):
+        """Test image files are deleted with their recipes"""
+
+        recipe = sample_recipe(self.user)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
+            Image.new("RGB", (10, 10)).save(ntf, format="JPEG")
+            ntf.seek(0)
+            recipe.image = SimpleUploadedFile("a.jpg", ntf.read())
+            recipe.save()
+        path = recipe.image.path
+        self.assertTrue(os.path.exists(path))
+
+        recipes, images = deletion.delete_recipes_in_batches(
+            Recipe.objects.filter(pk=recipe.pk)
+        )
+
+        self.assertEqual((recipes, images), (1, 1))
+        self.assertFalse(os.path.exists(path))
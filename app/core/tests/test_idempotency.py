@@ -0,0 +1,132 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.idempotency import purge_idempotency_keys
+from core.models import IdempotencyKey, Recipe, Tag
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+TAGS_URL = reverse("recipe:tag-list")
+
+
+class IdempotencyKeyTests(TestCase):
+    """Test writes sent with an Idempotency-Key header"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "test@idempotency.com", "testpass"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payload = {"title": "Curry", "time_minutes": 30, "price": "5.00"}
+
+    def post(self, url, payload, key="key-1"):
+        return self.client.post(url, payload, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_response(self):
+        """Test a retried create runs once and gets the same response"""
+
+        first = self.post(RECIPES_URL, self.payload)
+        retry = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data["id"], first.data["id"])
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_without_key_not_deduplicated(self):
+        """Test requests without a key all run"""
+
+        self.client.post(RECIPES_URL, self.payload)
+        self.client.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_key_reused_for_other_request(self):
+        """Test a key can't be replayed for a different request"""
+
+        self.post(RECIPES_URL, self.payload)
+        res = self.post(RECIPES_URL, {**self.payload, "title": "Other"})
+
+        self.assertEqual(
+            res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_in_flight_request_conflicts(self):
+        """Test a retry gives up waiting on a request still running"""
+
+        self.post(RECIPES_URL, self.payload)
+        IdempotencyKey.objects.update(status=None, response=None)
+
+        res = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_abandoned_request_runs_again(self):
+        """Test a request unfinished past the claim timeout is retried"""
+
+        self.post(RECIPES_URL, self.payload)
+        IdempotencyKey.objects.update(
+            status=None, response=None,
+            created=timezone.now() - timedelta(minutes=5)
+        )
+
+        res = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(res.has_header("Idempotent-Replayed"))
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(
+            IdempotencyKey.objects.get().status, status.HTTP_201_CREATED
+        )
+
+    def test_expired_key_runs_again(self):
+        """Test a key past its TTL no longer replays"""
+
+        self.post(RECIPES_URL, self.payload)
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(days=2)
+        )
+
+        res = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(res.has_header("Idempotent-Replayed"))
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_tag_create_idempotent(self):
+        """Test tags are created once per key"""
+
+        self.post(TAGS_URL, {"name": "Vegan"})
+        res = self.post(TAGS_URL, {"name": "Vegan"})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_purge_expired_keys(self):
+        """Test the purge task deletes expired keys only"""
+
+        self.post(RECIPES_URL, self.payload, key="old")
+        self.post(RECIPES_URL, self.payload, key="new")
+        IdempotencyKey.objects.filter(key="old").update(
+            created=timezone.now() - timedelta(days=2)
+        )
+
+        self.assertEqual(purge_idempotency_keys(batch_size=1), 1)
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list("key", flat=True)),
+            ["new"]
+        )
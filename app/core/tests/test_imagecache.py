@@ -0,0 +1,118 @@
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core.imagecache import VariantCache, variant_key
+
+
+class VariantCacheTests(SimpleTestCase):
+    """Test the disk cache of resized images"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = VariantCache(self.tmp.name, max_bytes=100)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_render_once(self):
+        """Test a cached file isn't rendered again"""
+
+        renders = []
+
+        def render():
+            renders.append(1)
+            return b"data"
+
+        path = self.cache.get_or_render("ab-1", render)
+        self.assertEqual(self.cache.get_or_render("ab-1", render), path)
+
+        self.assertEqual(len(renders), 1)
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), b"data")
+
+    def test_evicted_on_hit_rendered_again(self):
+        """Test a file evicted just as it is hit is rendered again"""
+
+        path = self.cache.get_or_render("ab-1", lambda: b"old")
+        touch = self.cache._touch
+        evicted = []
+
+        def evict_first(path):
+            if not evicted:
+                evicted.append(path)
+                os.remove(path)
+            touch(path)
+
+        with patch.object(self.cache, "_touch", side_effect=evict_first):
+            self.assertEqual(
+                self.cache.get_or_render("ab-1", lambda: b"new"), path
+            )
+
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), b"new")
+
+    def test_concurrent_requests_collapsed(self):
+        """Test concurrent misses for the same key render it once"""
+
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.05)
+            return b"data"
+
+        threads = [
+            threading.Thread(
+                target=self.cache.get_or_render, args=("cd-1", render)
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(renders), 1)
+
+    def test_least_recently_used_evicted(self):
+        """Test the cache stays under its limit dropping unused files"""
+
+        old = self.cache.get_or_render("aa-old", lambda: b"x" * 40)
+        used = self.cache.get_or_render("bb-used", lambda: b"x" * 40)
+        os.utime(old, (1, 1))
+        os.utime(used, (2, 2))
+        # a hit makes the file the most recently used
+        self.cache.get_or_render("bb-used", lambda: b"")
+
+        new = self.cache.get_or_render("cc-new", lambda: b"x" * 40)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(used))
+        self.assertTrue(os.path.exists(new))
+
+    def test_walks_only_over_limit(self):
+        """Test renders under the limit don't walk the cache"""
+
+        with patch("core.imagecache.os.walk", wraps=os.walk) as walk:
+            for index in range(2):
+                self.cache.get_or_render(f"d{index}-1", lambda: b"x" * 40)
+            self.assertEqual(walk.call_count, 0)
+
+            self.cache.get_or_render("ee-1", lambda: b"x" * 40)
+            self.assertEqual(walk.call_count, 1)
+
+        with open(self.cache.size_path) as file:
+            self.assertEqual(int(file.read()), 80)
+
+    def test_key_depends_on_original(self):
+        """Test a new upload gets new variants"""
+
+        self.assertNotEqual(
+            variant_key("a.jpg", 10, 10, "jpg"),
+            variant_key("b.jpg", 10, 10, "jpg")
+        )
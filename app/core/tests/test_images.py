@@ -0,0 +1,157 @@
+import struct
+import zlib
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.test import SimpleTestCase
+
+from core import images
+
+
+def png_bomb(width, height):
+    """Return a tiny PNG whose header claims a huge size
+
+    Only the header is valid, decoding it would try to allocate
+    width * height pixels.
+    """
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+        )
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"\x00" * 64))
+        + chunk(b"IEND", b"")
+    )
+
+
+def sample_image(size=(10, 10), image_format="JPEG"):
+    """Return a file with a real image"""
+
+    buffer = BytesIO()
+    Image.new("RGB", size, "blue").save(buffer, format=image_format)
+    buffer.seek(0)
+
+    return buffer
+
+
+LIMITS = {
+    "max_bytes": 1024 * 1024,
+    "max_pixels": 1000 * 1000,
+    "max_dimension": 2000,
+    "formats": ("JPEG", "PNG"),
+}
+
+
+class ImageLimitTests(SimpleTestCase):
+    """Test uploads are checked from their headers"""
+
+    def test_valid_image(self):
+        """Test an image within the limits is accepted"""
+
+        self.assertEqual(
+            images.check_limits(sample_image(), **LIMITS), ("JPEG", 10, 10)
+        )
+
+    def test_bomb_rejected_from_header(self):
+        """Test a decompression bomb is refused without decoding it"""
+
+        with self.assertRaises(images.ImageRejected):
+            images.check_limits(BytesIO(png_bomb(20000, 20000)), **LIMITS)
+
+    def test_huge_bomb_rejected(self):
+        """Test bombs over Pillow's own limit are reported as rejected"""
+
+        with self.assertRaises(images.ImageRejected):
+            images.check_limits(BytesIO(png_bomb(60000, 60000)), **LIMITS)
+
+    def test_too_many_pixels(self):
+        """Test the pixel count limit applies within the dimensions"""
+
+        with self.assertRaises(images.ImageRejected):
+            images.check_limits(BytesIO(png_bomb(1500, 1500)), **LIMITS)
+
+    def test_file_size_limit(self):
+        """Test files over the size limit are refused"""
+
+        file = sample_image()
+        file.size = LIMITS["max_bytes"] + 1
+
+        with self.assertRaises(images.ImageRejected):
+            images.check_limits(file, **LIMITS)
+
+    def test_format_not_allowed(self):
+        """Test only the configured formats are accepted"""
+
+        with self.assertRaises(images.ImageRejected):
+            images.check_limits(sample_image(image_format="GIF"), **LIMITS)
+
+    def test_header_read_rewinds(self):
+        """Test the file can be read again after the check"""
+
+        file = sample_image()
+        images.check_limits(file, **LIMITS)
+
+        self.assertEqual(file.tell(), 0)
+
+    def test_downscale(self):
+        """Test large images are shrunk with their aspect ratio"""
+
+        data = images.downscale(sample_image((800, 400)), 200, "JPEG")
+
+        self.assertEqual(Image.open(BytesIO(data)).size, (200, 100))
+
+    def test_other_modes_scaled(self):
+        """Test palette, 1-bit and 16-bit images can be shrunk"""
+
+        for mode in ("P", "1", "I;16"):
+            with self.subTest(mode=mode):
+                buffer = BytesIO()
+                Image.new(mode, (300, 300)).save(buffer, format="PNG")
+                buffer.seek(0)
+
+                data = images.render_variant(buffer, 64, 64, "webp")
+
+                self.assertEqual(Image.open(BytesIO(data)).size, (64, 64))
+
+    def test_metadata(self):
+        """Test the size, color and placeholder of an image"""
+
+        file = sample_image((300, 200))
+        file.size = len(file.getvalue())
+
+        meta = images.image_metadata(file)
+
+        self.assertEqual(meta["image_width"], 300)
+        self.assertEqual(meta["image_height"], 200)
+        self.assertEqual(meta["image_bytes"], file.size)
+        # blue, give or take the JPEG compression
+        self.assertRegex(
+            meta["image_color"], r"^#0[0-9a-f]0[0-9a-f]f[0-9a-f]$")
+        self.assertTrue(
+            meta["image_placeholder"].startswith("data:image/jpeg;base64,"))
+        self.assertLess(len(meta["image_placeholder"]), 1000)
+
+    def test_metadata_without_preview(self):
+        """Test an image that can't be previewed still gets its size"""
+
+        file = sample_image((30, 20))
+        with patch("core.images._preview", side_effect=OSError("broken")), \
+                self.assertLogs("core.images", "WARNING") as logs:
+            meta = images.image_metadata(file)
+
+        self.assertEqual((meta["image_width"], meta["image_height"]),
+                         (30, 20))
+        self.assertEqual(meta["image_placeholder"], "")
+        self.assertEqual(file.tell(), 0)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("No preview for image", logs.records[0].getMessage())
+        self.assertEqual(str(logs.records[0].exc_info[1]), "broken")
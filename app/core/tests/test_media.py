@@ -0,0 +1,244 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.authentication import issue_token
+from core.imagecache import VariantCache
+
+from core.models import Recipe
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+CONTENT = b"0123456789abcdef"
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    MEDIA_ACCEL_REDIRECT="",
+    MEDIA_SENDFILE=False,
+    MEDIA_PRIVATE=False
+)
+class ServeMediaTests(TestCase):
+    """Test uploaded files are served with caching and Range support"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="media@user.com",
+            password="mediapass"
+        )
+        self.recipe = Recipe.objects.create(
+            user=self.user, title="Pie", time_minutes=5, price=5.00
+        )
+        self.recipe.image.save("pie.jpg", ContentFile(CONTENT))
+        self.url = self.recipe.image.url
+
+    def tearDown(self):
+        self.recipe.image.delete()
+
+    def test_full_file(self):
+        """Test the whole file is sent with long lived cache headers"""
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b"".join(res.streaming_content), CONTENT)
+        self.assertIn("immutable", res["Cache-Control"])
+        self.assertIn("ETag", res)
+        self.assertIn("Last-Modified", res)
+        self.assertEqual(res["Accept-Ranges"], "bytes")
+
+    def test_not_modified(self):
+        """Test a matching If-None-Match gets a 304"""
+
+        etag = self.client.get(self.url)["ETag"]
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_range(self):
+        """Test a byte range is sent as partial content"""
+
+        res = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b"".join(res.streaming_content), b"2345")
+        self.assertEqual(res["Content-Range"], f"bytes 2-5/{len(CONTENT)}")
+
+    def test_suffix_range(self):
+        """Test the last bytes of the file can be requested"""
+
+        res = self.client.get(self.url, HTTP_RANGE="bytes=-3")
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b"".join(res.streaming_content), b"def")
+
+    def test_unsatisfiable_range(self):
+        """Test a range after the end of the file is rejected"""
+
+        res = self.client.get(self.url, HTTP_RANGE="bytes=100-200")
+
+        self.assertEqual(res.status_code, 416)
+
+    def test_stale_if_range_sends_whole_file(self):
+        """Test a Range with an outdated If-Range gets the whole file"""
+
+        res = self.client.get(
+            self.url, HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"old"'
+        )
+
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT="/protected-media/")
+    def test_accel_redirect(self):
+        """Test the transfer is handed to nginx when configured"""
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res["X-Accel-Redirect"],
+            "/protected-media/" + self.recipe.image.name
+        )
+        self.assertEqual(res.content, b"")
+
+    @override_settings(MEDIA_SENDFILE=True)
+    def test_sendfile(self):
+        """Test the transfer is handed to the web server with X-Sendfile"""
+
+        res = self.client.get(self.url)
+
+        self.assertEqual(res["X-Sendfile"], self.recipe.image.path)
+
+    def test_unknown_file(self):
+        """Test files that are not recipe images are not served"""
+
+        self.assertEqual(
+            self.client.get("/media/uploads/recipe/missing.jpg").status_code,
+            404
+        )
+        self.assertEqual(
+            self.client.get("/media/../../etc/passwd").status_code, 404
+        )
+
+    @override_settings(MEDIA_PRIVATE=True)
+    def test_private_media(self):
+        """Test only the owner can read images in private mode"""
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        token = issue_token(self.user)
+        res = self.client.get(
+            self.url, HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res["Cache-Control"].startswith("private"))
+
+
+def variant_url(recipe_id, size="150x150", fmt="jpg"):
+    """Return the url of a resized recipe image"""
+
+    width, height = size.split("x")
+    return reverse("recipe-image-variant", kwargs={
+        "recipe_id": recipe_id,
+        "width": width,
+        "height": height,
+        "fmt": fmt,
+    })
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    MEDIA_ACCEL_REDIRECT="",
+    MEDIA_SENDFILE=False,
+    MEDIA_PRIVATE=False,
+    RECIPE_IMAGE_SIZES=("150x150",)
+)
+class RecipeImageVariantTests(TestCase):
+    """Test recipe images resized on demand"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="resize@user.com",
+            password="resizepass"
+        )
+        self.recipe = Recipe.objects.create(
+            user=self.user, title="Cake", time_minutes=5, price=5.00
+        )
+        buffer = BytesIO()
+        Image.new("RGB", (600, 300), "red").save(buffer, format="JPEG")
+        self.recipe.image.save("cake.jpg", ContentFile(buffer.getvalue()))
+
+    def tearDown(self):
+        self.recipe.image.delete()
+        shutil.rmtree(f"{MEDIA_ROOT}/variants", ignore_errors=True)
+
+    def test_resized(self):
+        """Test the image is shrunk to fit in the requested size"""
+
+        res = self.client.get(variant_url(self.recipe.id, fmt="webp"))
+
+        self.assertEqual(res.status_code, 200)
+        image = Image.open(BytesIO(b"".join(res.streaming_content)))
+        self.assertEqual(image.format, "WEBP")
+        self.assertEqual(image.size, (150, 75))
+        self.assertNotIn("immutable", res["Cache-Control"])
+
+    def test_evicted_before_read(self):
+        """Test a variant evicted before it is read is rendered again"""
+
+        get_or_render = VariantCache.get_or_render
+        evicted = []
+
+        def evict_first(cache, key, render):
+            path = get_or_render(cache, key, render)
+            if not evicted:
+                evicted.append(path)
+                os.remove(path)
+            return path
+
+        with patch.object(VariantCache, "get_or_render", evict_first):
+            res = self.client.get(variant_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(evicted), 1)
+        image = Image.open(BytesIO(b"".join(res.streaming_content)))
+        self.assertEqual(image.size, (150, 75))
+
+    def test_size_not_allowed(self):
+        """Test sizes outside the whitelist are rejected"""
+
+        res = self.client.get(variant_url(self.recipe.id, size="151x151"))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_format_not_allowed(self):
+        """Test unknown formats are rejected"""
+
+        res = self.client.get(variant_url(self.recipe.id, fmt="gif"))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_recipe_without_image(self):
+        """Test recipes without an image have no variants"""
+
+        recipe = Recipe.objects.create(
+            user=self.user, title="Plain", time_minutes=5, price=5.00
+        )
+
+        self.assertEqual(
+            self.client.get(variant_url(recipe.id)).status_code, 404
+        )
@@ -4,6 +4,7 @@ from django.contrib.auth import get_user_model
 from unittest.mock import patch
 
 from core import models
+from core.vocabulary import normalize_name
 
 
 def sample_user(email="test@email.com", password="testPass"):
@@ -57,6 +58,39 @@ class ModelTest(TestCase):
                 password="Password"
             )
 
+    def test_email_taken_in_other_case(self):
+        """Test a user can't be created with an email differing by case"""
+
+        sample_user(email="taken@email.com")
+
+        with self.assertRaises(ValueError):
+            sample_user(email="Taken@email.com")
+
+    def test_natural_key_any_case(self):
+        """Test users are found by their email in any case"""
+
+        user = sample_user(email="Found@email.com")
+
+        self.assertEqual(
+            get_user_model().objects.get_by_natural_key("fOUND@email.com"),
+            user
+        )
+
+    def test_save_keeps_counters(self):
+        """Test saving a user loaded earlier doesn't roll counters back"""
+
+        user = sample_user()
+        get_user_model().objects.filter(pk=user.pk).update(
+            data_version=5, sync_floor=3
+        )
+
+        user.name = "Renamed"
+        user.save()
+
+        user.refresh_from_db()
+        self.assertEqual(user.name, "Renamed")
+        self.assertEqual((user.data_version, user.sync_floor), (5, 3))
+
     def test_admin_user_has_permissions(self):
         """test superuser function give the is staff and super permissions"""
 
@@ -111,5 +145,46 @@ class ModelTest(TestCase):
         exp_path = f"uploads/recipe/{uuid}.jpg"
         self.assertEqual(file_path, exp_path)
 
+    def test_normalize_name(self):
+        """Test names differing in case, width or spacing normalize alike"""
+
+        self.assertEqual(normalize_name("  Olive   Oil "), "olive oil")
+        self.assertEqual(normalize_name("ＳＡＬＴ"), "salt")
+        self.assertEqual(normalize_name("Straße"), "strasse")
+
+    def test_canonical_name_shared(self):
+        """Test tags and ingredients of all users share canonical names"""
+
+        user1 = sample_user()
+        user2 = sample_user("other@email.com")
+        tag = models.Tag.objects.create(user=user1, name="Salt")
+        ingredient = models.Ingredient.objects.create(user=user2, name="salt ")
+
+        self.assertEqual(tag.canonical.name, "salt")
+        self.assertEqual(tag.canonical_id, ingredient.canonical_id)
+
+        tag.name = "Pepper"
+        tag.save()
+        self.assertEqual(tag.canonical.name, "pepper")
+
+    def test_data_version_bumped(self):
+        """Test the user's data version changes with their recipe data"""
+
+        user = sample_user()
+        tag = models.Tag.objects.create(user=user, name="Vegan")
+        recipe = models.Recipe.objects.create(
+            user=user, title="Soup", time_minutes=5, price=5.00
+        )
+        user.refresh_from_db()
+        version = user.data_version
+
+        recipe.tags.add(tag)
+        user.refresh_from_db()
+        self.assertEqual(user.data_version, version + 1)
+
+        tag.delete()
+        user.refresh_from_db()
+        self.assertGreater(user.data_version, version + 1)
+
 
 #######
@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import replicas, sharding
+from core.models import Tag
+
+
+@override_settings(REPLICA_DATABASES=["replica_0"])
+class ReplicaRouterTests(SimpleTestCase):
+    """Test reads go to the replicas and writes to the primary"""
+
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+        self.token = replicas._pinned.set(False)
+
+    def tearDown(self):
+        replicas._pinned.reset(self.token)
+
+    def test_read_uses_replica(self):
+        """Test reads are sent to a replica"""
+
+        self.assertEqual(self.router.db_for_read(Tag), "replica_0")
+
+    def test_write_uses_primary_and_pins(self):
+        """Test writes go to the primary and later reads follow them"""
+
+        self.assertEqual(self.router.db_for_write(Tag), "default")
+        self.assertEqual(self.router.db_for_read(Tag), "default")
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas(self):
+        """Test everything goes to the primary without replicas"""
+
+        self.assertEqual(self.router.db_for_read(Tag), "default")
+
+    def test_transaction_reads_primary(self):
+        """Test reads inside a transaction see its writes"""
+
+        with patch.object(
+            connections["default"], "in_atomic_block", True
+        ):
+            self.assertEqual(self.router.db_for_read(Tag), "default")
+
+    @override_settings(REPLICA_DATABASES=["replica_0", "replica_1"])
+    def test_read_from(self):
+        """Test reads can be held on one database"""
+
+        with replicas.read_from("replica_1"):
+            for _ in range(10):
+                self.assertEqual(self.router.db_for_read(Tag), "replica_1")
+
+    def test_replicas_not_migrated(self):
+        """Test the schema is only migrated on the primary"""
+
+        self.assertFalse(self.router.allow_migrate("replica_0", "core"))
+        self.assertIsNone(self.router.allow_migrate("default", "core"))
+
+
+@override_settings(
+    REPLICA_DATABASES=["replica_0"],
+    REPLICA_STALENESS_SECONDS=7
+)
+class PrimaryPinMiddlewareTests(SimpleTestCase):
+    """Test clients stick to the primary after writing"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = replicas.ReplicaRouter()
+        self.seen = []
+
+    def get_response(self, request):
+        """Fake view remembering where reads would go"""
+
+        self.seen.append(self.router.db_for_read(Tag))
+        return HttpResponse()
+
+    def test_safe_request_reads_replica(self):
+        """Test a GET without the pin cookie reads from a replica"""
+
+        middleware = replicas.PrimaryPinMiddleware(self.get_response)
+        response = middleware(self.factory.get("/"))
+
+        self.assertEqual(self.seen, ["replica_0"])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_write_sets_pin_cookie(self):
+        """Test a write reads the primary and pins the client"""
+
+        middleware = replicas.PrimaryPinMiddleware(self.get_response)
+        response = middleware(self.factory.post("/"))
+
+        self.assertEqual(self.seen, ["default"])
+        cookie = response.cookies[replicas.PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], 7)
+
+    def test_pinned_client_reads_primary(self):
+        """Test a GET within the staleness window reads the primary"""
+
+        middleware = replicas.PrimaryPinMiddleware(self.get_response)
+        request = self.factory.get("/")
+        request.COOKIES[replicas.PIN_COOKIE] = "1"
+        middleware(request)
+
+        self.assertEqual(self.seen, ["default"])
+
+    def test_user_pinned_without_cookie(self):
+        """Test a user's writes pin their later requests, cookie or not"""
+
+        user = SimpleNamespace(pk=42, is_authenticated=True)
+        self.addCleanup(cache.delete, replicas._pin_key(user.pk))
+        middleware = replicas.PrimaryPinMiddleware(self.get_response)
+        request = self.factory.post("/")
+        request.user = user
+        middleware(request)
+
+        with sharding.for_user(user.pk):
+            middleware(self.factory.get("/"))
+        with sharding.for_user(43):
+            middleware(self.factory.get("/"))
+
+        self.assertEqual(self.seen, ["default", "default", "replica_0"])
+
+    def test_pin_reset_after_request(self):
+        """Test the pin of one request doesn't leak into the next"""
+
+        middleware = replicas.PrimaryPinMiddleware(self.get_response)
+        middleware(self.factory.post("/"))
+        middleware(self.factory.get("/"))
+
+        self.assertEqual(self.seen, ["default", "replica_0"])
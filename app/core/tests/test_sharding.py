@@ -0,0 +1,289 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connections, router
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import sharding
+from core.authentication import issue_token
+from core.models import Recipe, Tag, UserShard
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+TAGS_URL = reverse("recipe:tag-list")
+SYNC_URL = reverse("recipe:sync")
+BATCH_URL = reverse("batch")
+
+
+@override_settings(SHARD_DATABASES=["shard_0", "shard_1"])
+class ShardRouterTests(SimpleTestCase):
+    """Test users are spread over the shards and queries follow them"""
+
+    def setUp(self):
+        self.router = sharding.ShardRouter()
+
+    def test_hash_shard_spreads_users(self):
+        """Test a user always hashes to the same shard, and both are used"""
+
+        shards = [sharding.hash_shard(user_id) for user_id in range(100)]
+
+        self.assertEqual(shards, [
+            sharding.hash_shard(user_id) for user_id in range(100)
+        ])
+        self.assertEqual(set(shards), {"shard_0", "shard_1"})
+
+    def test_id_ranges(self):
+        """Test every database hands out ids from a range of its own"""
+
+        self.assertEqual(sharding.id_range("default"), (1, 10 ** 8))
+        self.assertEqual(
+            sharding.id_range("shard_1"), (2 * 10 ** 8 + 1, 3 * 10 ** 8)
+        )
+
+    def test_id_ranges_fit_32_bits(self):
+        """Test too many shards for the 32-bit ids are refused"""
+
+        shards = [f"shard_{index}" for index in range(21)]
+        with override_settings(SHARD_DATABASES=shards):
+            sharding.id_range("shard_19")
+            with self.assertRaises(ImproperlyConfigured):
+                sharding.id_range("shard_20")
+
+    @override_settings(SHARD_DATABASES=[])
+    def test_unsharded(self):
+        """Test everything stays on the default database without shards"""
+
+        self.assertEqual(sharding.shard_for(1, writing=True), "default")
+        with sharding.for_user(1):
+            self.assertIsNone(self.router.db_for_write(Recipe))
+
+    def test_routes_by_instance_then_request(self):
+        """Test the owner of the instance wins over the request's user"""
+
+        def shard_for(user_id, writing=False):
+            return {1: "shard_0", 2: "shard_1"}.get(user_id, "default")
+
+        with patch("core.sharding.shard_for", side_effect=shard_for):
+            with sharding.for_user(1):
+                self.assertEqual(self.router.db_for_read(Tag), "shard_0")
+                self.assertEqual(
+                    self.router.db_for_write(Tag, instance=Tag(user_id=2)),
+                    "shard_1"
+                )
+                self.assertIsNone(
+                    self.router.db_for_read(get_user_model())
+                )
+            self.assertIsNone(self.router.db_for_read(Tag))
+
+
+SHARDS = ["test_shard_0", "test_shard_1"]
+
+
+@override_settings(SHARD_DATABASES=SHARDS)
+class ShardingTests(TestCase):
+    """Test recipe data lives on the user's shard and can be moved
+
+    The shards are in memory SQLite databases added for these tests
+    only, the rest of the suite runs unsharded.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Declared here, the test runner would look for them at startup
+        cls.databases = {"default", *SHARDS}
+        for alias in SHARDS:
+            connections.databases[alias] = {
+                "ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:",
+            }
+            with override_settings(SHARD_DATABASES=SHARDS):
+                call_command("migrate", database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in SHARDS:
+            connections[alias].connection.close()
+            del connections[alias]
+            del connections.databases[alias]
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            "test@sharding.com", "testpass"
+        )
+        self.alias = UserShard.objects.get(user=self.user).alias
+        self.other = next(alias for alias in SHARDS if alias != self.alias)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {issue_token(self.user).key}"
+        )
+
+    def create_recipe(self, title="Curry", tag="Vegan"):
+        tag = self.client.post(TAGS_URL, {"name": tag})
+        return self.client.post(RECIPES_URL, {
+            "title": title, "time_minutes": 30, "price": "5.00",
+            "tags": [tag.data["id"]],
+        })
+
+    def move(self):
+        call_command(
+            "move_user_shard", self.user.email, self.other, grace=0,
+            stdout=StringIO()
+        )
+
+    def test_new_user_placed(self):
+        """Test a new user gets a shard and a copy of their row on it"""
+
+        self.assertEqual(self.alias, sharding.hash_shard(self.user.pk))
+        self.assertTrue(
+            get_user_model().objects.using(self.alias)
+            .filter(pk=self.user.pk).exists()
+        )
+
+    def test_api_uses_shard(self):
+        """Test the API writes and reads the user's shard only"""
+
+        res = self.create_recipe()
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.using(self.alias).get(pk=res.data["id"])
+        self.assertEqual(recipe.tags.get().recipe_count, 1)
+        self.assertFalse(Recipe.objects.using("default").exists())
+        # Each shard hands out its own ids, so moved rows keep theirs
+        start, end = sharding.id_range(self.alias)
+        self.assertTrue(start <= recipe.pk <= end)
+        self.assertEqual(
+            [r["id"] for r in self.client.get(RECIPES_URL).data],
+            [recipe.pk]
+        )
+
+    def test_batch_reads_users_from_default(self):
+        """Test a read only batch reads only the recipe data on the shard"""
+
+        def dispatch(*args):
+            seen.append((
+                router.db_for_read(Recipe),
+                router.db_for_read(get_user_model())
+            ))
+            return {"status": status.HTTP_200_OK, "body": None}
+
+        seen = []
+        # The default database standing in for a replica, with reads not
+        # pinned to the primary by the POST
+        with override_settings(REPLICA_DATABASES=["default"]), \
+                patch("core.replicas.is_pinned", return_value=False), \
+                patch("core.batch._dispatch", side_effect=dispatch):
+            self.client.post(
+                BATCH_URL, {"requests": [{"path": "/user/me/"}]},
+                format="json"
+            )
+
+        self.assertEqual(seen, [(self.alias, "default")])
+
+    def test_save_outside_request(self):
+        """Test rows go to the owner's shard unless a database is given"""
+
+        tag = Tag.objects.create(user=self.user, name="Vegan")
+        self.assertEqual(tag._state.db, self.alias)
+        self.assertTrue(Tag.objects.using(self.alias).filter(
+            pk=tag.pk).exists())
+
+        tag = Tag(user=self.user, name="Quick")
+        tag.save(using="default")
+        self.assertTrue(Tag.objects.using("default").filter(
+            pk=tag.pk).exists())
+
+    def test_move_user(self):
+        """Test a move copies everything, keeping ids and change numbers"""
+
+        recipe_id = self.create_recipe().data["id"]
+        cursor = self.client.get(SYNC_URL, {"since": 0}).data["cursor"]
+
+        self.move()
+
+        self.assertEqual(sharding.shard_for(self.user.pk), self.other)
+        self.assertFalse(
+            Recipe.objects.using(self.alias).filter(pk=recipe_id).exists()
+        )
+        recipe = Recipe.objects.using(self.other).get(pk=recipe_id)
+        self.assertEqual(recipe.tags.get().name, "Vegan")
+        res = self.client.get(SYNC_URL, {"since": cursor})
+        self.assertEqual(res.data["recipes"], [])
+        res = self.client.patch(
+            reverse("recipe:recipe-detail", args=[recipe_id]),
+            {"title": "Green Curry"}
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(SYNC_URL, {"since": cursor})
+        self.assertEqual([r["id"] for r in res.data["recipes"]], [recipe_id])
+
+    def test_move_copies_changes_made_during_copy(self):
+        """Test writes made while the rows are copied reach the target"""
+
+        kept = self.create_recipe().data
+        gone = self.create_recipe("Soup", "Hot").data
+        cursor = self.client.get(SYNC_URL, {"since": 0}).data["cursor"]
+        copy_snapshot = sharding._copy_snapshot
+
+        def write_during_copy(*args):
+            copied = copy_snapshot(*args)
+            self.client.delete(
+                reverse("recipe:recipe-detail", args=[gone["id"]])
+            )
+            Tag.objects.using(self.alias).get(pk=kept["tags"][0]).delete()
+            quick = self.client.post(TAGS_URL, {"name": "Quick"}).data
+            self.client.patch(
+                reverse("recipe:recipe-detail", args=[kept["id"]]),
+                {"title": "Green Curry", "tags": [quick["id"]]}
+            )
+            self.create_recipe("Salad", "Cold")
+            return copied
+
+        with patch(
+            "core.sharding._copy_snapshot", side_effect=write_during_copy
+        ):
+            self.move()
+
+        recipes = Recipe.objects.using(self.other)
+        self.assertEqual(
+            sorted(recipes.values_list("title", flat=True)),
+            ["Green Curry", "Salad"]
+        )
+        recipe = recipes.get(pk=kept["id"])
+        self.assertEqual(
+            [(t.name, t.recipe_count) for t in recipe.tags.all()],
+            [("Quick", 1)]
+        )
+        self.assertEqual(
+            sorted(Tag.objects.using(self.other)
+                   .values_list("name", flat=True)),
+            ["Cold", "Hot", "Quick"]
+        )
+        self.assertEqual(Tag.objects.using(self.other).get(
+            name="Hot").recipe_count, 0)
+        res = self.client.get(SYNC_URL, {"since": cursor})
+        self.assertEqual(
+            sorted(d["type"] for d in res.data["deleted"]), ["recipe", "tag"]
+        )
+
+    def test_writes_refused_while_moving(self):
+        """Test writes get a 503 while the data moves, reads still work"""
+
+        self.create_recipe()
+        UserShard.objects.filter(user=self.user).update(moving=True)
+        cache.clear()
+
+        res = self.client.post(TAGS_URL, {"name": "Quick"})
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data), 1)
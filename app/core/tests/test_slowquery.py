@@ -0,0 +1,159 @@
+from io import StringIO
+from unittest.mock import MagicMock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import slowquery
+from core.models import SlowQuery
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+
+
+class FingerprintTests(TestCase):
+    """Test queries are grouped by their shape"""
+
+    def test_literals_ignored(self):
+        """Test the same query with other values has the same fingerprint"""
+
+        self.assertEqual(
+            slowquery.fingerprint("SELECT * FROM t WHERE a = 1 AND b = 'x'"),
+            slowquery.fingerprint("SELECT * FROM t WHERE a = 22 AND b = 'y'")
+        )
+
+    def test_in_list_size_ignored(self):
+        """Test IN lists of different lengths have the same fingerprint"""
+
+        self.assertEqual(
+            slowquery.fingerprint("SELECT * FROM t WHERE id IN (%s, %s)"),
+            slowquery.fingerprint("SELECT * FROM t WHERE id IN (%s)")
+        )
+
+    def test_different_queries(self):
+        """Test different queries get different fingerprints"""
+
+        self.assertNotEqual(
+            slowquery.fingerprint("SELECT * FROM a"),
+            slowquery.fingerprint("SELECT * FROM b")
+        )
+
+
+class ExplainTests(TestCase):
+    """Test plans are captured without touching the caller's work"""
+
+    def explain(self, in_atomic_block, fail=False):
+        connection = MagicMock(vendor="postgresql",
+                               in_atomic_block=in_atomic_block)
+        cursor = connection.connection.cursor.return_value \
+            .__enter__.return_value
+        cursor.fetchall.return_value = [("Seq Scan on t",)]
+
+        def execute(sql, params=None):
+            if fail and sql.startswith("EXPLAIN"):
+                raise RuntimeError("canceled")
+        cursor.execute.side_effect = execute
+
+        plan = slowquery.SlowQueryRecorder(0)._explain(
+            "SELECT * FROM t", (), {"connection": connection}
+        )
+        return plan, [c.args[0] for c in cursor.execute.call_args_list]
+
+    def test_explain_in_savepoint(self):
+        """Test the plan is captured in a savepoint rolled back after"""
+
+        plan, statements = self.explain(in_atomic_block=True)
+
+        self.assertEqual(plan, "Seq Scan on t")
+        self.assertEqual(statements, [
+            "SAVEPOINT slow_query_explain",
+            "EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM t",
+            "ROLLBACK TO SAVEPOINT slow_query_explain",
+            "RELEASE SAVEPOINT slow_query_explain",
+        ])
+
+    def test_failed_explain_rolled_back(self):
+        """Test a failing EXPLAIN is rolled back and gives no plan"""
+
+        with self.assertLogs("core.slowquery"):
+            plan, statements = self.explain(in_atomic_block=False, fail=True)
+
+        self.assertEqual(plan, "")
+        self.assertEqual(statements[0], "BEGIN")
+        self.assertEqual(statements[-1], "ROLLBACK")
+
+    def test_only_selects_explained(self):
+        """Test statements other than SELECT are never run again"""
+
+        recorder = slowquery.SlowQueryRecorder(0, explain_rate=1.0)
+        context = {"connection": MagicMock(vendor="postgresql")}
+
+        self.assertTrue(recorder._should_explain(" SELECT 1", context))
+        for sql in ("UPDATE t SET a = 1", "DELETE FROM t",
+                    "WITH x AS (DELETE FROM t) SELECT 1"):
+            self.assertFalse(recorder._should_explain(sql, context))
+
+
+@override_settings(
+    SLOW_QUERY_LOG=True,
+    SLOW_QUERY_THRESHOLD_MS=0,
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE=0
+)
+class SlowQueryMiddlewareTests(TestCase):
+    """Test slow queries made by requests are recorded"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="slow@query.com",
+            password="slowpass"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_queries_recorded_with_view(self):
+        """Test queries over the threshold are stored with their view"""
+
+        with self.assertLogs("core.slowquery", level="WARNING"):
+            self.client.get(RECIPES_URL)
+
+        query = SlowQuery.objects.get(sql__icontains="core_recipe")
+        self.assertEqual(query.count, 1)
+        self.assertEqual(query.view, "recipe.views.RecipeViewSet")
+        self.assertIn(str(self.user.id), query.params)
+
+    def test_queries_deduplicated(self):
+        """Test the same query made twice is counted twice"""
+
+        with self.assertLogs("core.slowquery", level="WARNING"):
+            self.client.get(RECIPES_URL)
+            self.client.get(RECIPES_URL)
+
+        query = SlowQuery.objects.get(sql__icontains="core_recipe")
+        self.assertEqual(query.count, 2)
+        self.assertGreaterEqual(query.total_ms, query.max_ms)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=60 * 1000)
+    def test_fast_queries_ignored(self):
+        """Test queries under the threshold are not stored"""
+
+        self.client.get(RECIPES_URL)
+
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_command_lists_queries(self):
+        """Test the management command shows the stored queries"""
+
+        with self.assertLogs("core.slowquery", level="WARNING"):
+            self.client.get(RECIPES_URL)
+
+        out = StringIO()
+        call_command("slow_queries", stdout=out)
+
+        self.assertIn("core_recipe", out.getvalue())
+
+        call_command("slow_queries", "--clear", stdout=StringIO())
+        self.assertFalse(SlowQuery.objects.exists())
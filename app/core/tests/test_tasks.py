@@ -0,0 +1,154 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import tasks
+from core.models import Task
+
+
+CALLS = []
+
+
+@tasks.task
+def record_call(value, suffix=""):
+    """Sample task remembering its arguments"""
+
+    CALLS.append(f"{value}{suffix}")
+
+
+@tasks.task
+def strand(task_id):
+    """Sample task leaving another task as if its worker had died"""
+
+    Task.objects.filter(pk=task_id).update(
+        status=Task.RUNNING,
+        locked_at=timezone.now() - timedelta(days=1)
+    )
+
+
+@tasks.task
+def always_fail():
+    """Sample task that never succeeds"""
+
+    raise RuntimeError("boom")
+
+
+def not_a_task():
+    """Function that was not registered as a task"""
+
+
+class TaskQueueTests(TestCase):
+    """Test the database backed task queue"""
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_and_run(self):
+        """Test a queued task is run with its arguments and removed"""
+
+        record_call.delay("a", suffix="!")
+
+        self.assertTrue(tasks.run_next())
+        self.assertEqual(CALLS, ["a!"])
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(tasks.run_next())
+
+    def test_enqueue_requires_task(self):
+        """Test only decorated functions can be queued"""
+
+        with self.assertRaises(ValueError):
+            tasks.enqueue(not_a_task)
+
+    def test_priority_order(self):
+        """Test higher priorities run first"""
+
+        tasks.enqueue(record_call, args=["low"])
+        tasks.enqueue(record_call, args=["high"], priority=10)
+
+        tasks.run_next()
+        tasks.run_next()
+
+        self.assertEqual(CALLS, ["high", "low"])
+
+    def test_delayed_task_not_claimed(self):
+        """Test tasks scheduled in the future are left alone"""
+
+        tasks.enqueue(record_call, args=["later"], delay=60)
+
+        self.assertEqual(tasks.claim(), [])
+
+    @override_settings(TASK_RETRY_BACKOFF=10)
+    def test_failed_task_retried_with_backoff(self):
+        """Test a failing task is requeued later with the error saved"""
+
+        always_fail.delay()
+        with self.assertLogs("core.tasks", level="ERROR"):
+            tasks.run_next()
+
+        task = Task.objects.get()
+        self.assertEqual(task.status, Task.QUEUED)
+        self.assertEqual(task.attempts, 1)
+        self.assertIn("boom", task.last_error)
+        self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=5))
+
+    def test_task_failed_after_max_attempts(self):
+        """Test a task stops being retried after its last attempt"""
+
+        tasks.enqueue(always_fail, max_attempts=1)
+        with self.assertLogs("core.tasks", level="ERROR"):
+            tasks.run_next()
+
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_stale_task_requeued(self):
+        """Test tasks locked by a dead worker are put back in the queue"""
+
+        task = record_call.delay("stale")
+        Task.objects.filter(pk=task.pk).update(
+            status=Task.RUNNING,
+            locked_at=timezone.now() - timedelta(days=1)
+        )
+
+        self.assertEqual(tasks.requeue_stale(), 1)
+        self.assertTrue(tasks.run_next())
+        self.assertEqual(CALLS, ["stale"])
+
+    def test_worker_burst(self):
+        """Test the worker command drains the queue in burst mode"""
+
+        record_call.delay(1)
+        record_call.delay(2)
+
+        call_command("run_worker", "--burst", stdout=StringIO())
+
+        self.assertEqual(sorted(CALLS), ["1", "2"])
+        self.assertFalse(Task.objects.exists())
+
+    def test_worker_requeues_periodically(self):
+        """Test the worker requeues tasks stranded while it runs"""
+
+        stranded = record_call.delay("stranded")
+        tasks.enqueue(strand, args=[stranded.pk], priority=5)
+
+        call_command(
+            "run_worker", "--burst", "--requeue-interval", "0",
+            stdout=StringIO()
+        )
+
+        self.assertEqual(CALLS, ["stranded"])
+        self.assertFalse(Task.objects.exists())
+
+    def test_worker_stats(self):
+        """Test the worker command shows the queue depth"""
+
+        record_call.delay(1)
+        tasks.enqueue(record_call, args=[2], priority=5)
+
+        out = StringIO()
+        call_command("run_worker", "--stats", stdout=out)
+
+        self.assertIn("priority=5", out.getvalue())
+        self.assertIn("queued", out.getvalue())
@@ -0,0 +1,138 @@
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+
+
+TOKEN_URL = reverse("user:token")
+TAGS_URL = reverse("recipe:tag-list")
+
+
+class SharedBucketStoreTests(TestCase):
+    """Test the memory mapped token buckets"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "buckets")
+        self.store = throttling.SharedBucketStore(self.path, 64)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_burst_then_refill(self):
+        """Test a bucket allows its capacity then refills over time"""
+
+        for _ in range(3):
+            allowed, _ = self.store.consume("key", 3, 1.0, now=100)
+            self.assertTrue(allowed)
+
+        allowed, wait = self.store.consume("key", 3, 1.0, now=100)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+
+        allowed, _ = self.store.consume("key", 3, 1.0, now=101)
+        self.assertTrue(allowed)
+
+    def test_keys_independent(self):
+        """Test buckets of different keys don't share tokens"""
+
+        self.store.consume("a", 1, 1.0, now=100)
+
+        self.assertFalse(self.store.consume("a", 1, 1.0, now=100)[0])
+        self.assertTrue(self.store.consume("b", 1, 1.0, now=100)[0])
+
+    def test_shared_between_mappings(self):
+        """Test two mappings of the same file see the same buckets"""
+
+        other = throttling.SharedBucketStore(self.path, 64)
+        self.store.consume("key", 1, 1.0, now=100)
+
+        self.assertFalse(other.consume("key", 1, 1.0, now=100)[0])
+
+    def test_full_table_evicts(self):
+        """Test keys still get a bucket when the table is full"""
+
+        store = throttling.SharedBucketStore(self.path + "-small", 2)
+        for index in range(10):
+            self.assertTrue(store.consume(f"k{index}", 1, 1.0, now=index)[0])
+
+
+class ThrottleApiTests(TestCase):
+    """Test the throttles limit the API"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            THROTTLE_STORE_PATH=os.path.join(self.tmp.name, "buckets"),
+            REST_FRAMEWORK={"DEFAULT_THROTTLE_RATES": {
+                "login": "2/min",
+                "read": "2/min",
+                "write": "1/min",
+                "upload": "1/min",
+            }, "NUM_PROXIES": 0}
+        )
+        self.settings_override.enable()
+        self.client = APIClient()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp.cleanup()
+
+    def test_login_throttled_per_ip(self):
+        """Test login attempts are limited"""
+
+        payload = {"email": "no@user.com", "password": "wrong"}
+        for _ in range(2):
+            res = self.client.post(TOKEN_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(TOKEN_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", res)
+
+    def test_login_spoofed_forwarded_for(self):
+        """Test a made up X-Forwarded-For doesn't get a fresh bucket"""
+
+        payload = {"email": "no@user.com", "password": "wrong"}
+        for index in range(2):
+            self.client.post(
+                TOKEN_URL, payload, HTTP_X_FORWARDED_FOR=f"10.0.0.{index}"
+            )
+
+        res = self.client.post(
+            TOKEN_URL, payload, HTTP_X_FORWARDED_FOR="10.0.0.9"
+        )
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_reads_and_writes_limited_separately(self):
+        """Test reads and writes of a user use their own buckets"""
+
+        user = get_user_model().objects.create_user(
+            email="busy@user.com",
+            password="busypass"
+        )
+        self.client.force_authenticate(user)
+
+        self.assertEqual(
+            self.client.post(TAGS_URL, {"name": "a"}).status_code,
+            status.HTTP_201_CREATED
+        )
+        self.assertEqual(
+            self.client.post(TAGS_URL, {"name": "b"}).status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+        for _ in range(2):
+            res = self.client.get(TAGS_URL)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.client.get(TAGS_URL).status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS
+        )
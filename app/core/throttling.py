@@ -0,0 +1,204 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+# One bucket: hash of the throttle key, tokens left, last refill time
+SLOT = struct.Struct("<Qdd")
+# How many neighbouring slots are tried before evicting a bucket
+PROBES = 8
+
+
+class SharedBucketStore:
+    """Token buckets in a memory mapped file shared by the host's workers
+
+    Every process maps the same file, so a limit holds across all the
+    workers of the host without a network round trip. Updates are
+    serialized with an flock on the file.
+    """
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * SLOT.size
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        # flock doesn't exclude threads sharing the same file descriptor
+        self.lock = threading.Lock()
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        # 0 marks an empty slot
+        return int.from_bytes(digest, "little") or 1
+
+    def _find_slot(self, key_hash):
+        """Return the offset of the bucket for a key, or the one to reuse"""
+
+        stalest = None
+        for probe in range(PROBES):
+            offset = ((key_hash + probe) % self.slots) * SLOT.size
+            slot_hash, _, updated = SLOT.unpack_from(self.map, offset)
+            if slot_hash in (key_hash, 0):
+                return offset
+            if stalest is None or updated < stalest[1]:
+                stalest = (offset, updated)
+
+        # Idle buckets refill to full anyway, so evicting the stalest
+        # one only forgets a client that has been quiet the longest
+        return stalest[0]
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Take a token from a bucket
+
+        Returns whether the request is allowed and, when it isn't, how
+        many seconds until a token is available.
+        """
+
+        key_hash = self._hash(key)
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                offset = self._find_slot(key_hash)
+                slot_hash, tokens, updated = SLOT.unpack_from(
+                    self.map, offset)
+                if slot_hash != key_hash:
+                    tokens = capacity
+                else:
+                    elapsed = max(now - updated, 0)
+                    tokens = min(capacity, tokens + elapsed * refill_rate)
+
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                SLOT.pack_into(self.map, offset, key_hash, tokens, now)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        if allowed:
+            return True, 0
+
+        return False, (1 - tokens) / refill_rate
+
+    def clear(self):
+        """Forget every bucket"""
+
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                self.map[:] = bytes(len(self.map))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+_stores = {}
+
+
+def get_store():
+    """Return the bucket store of this process"""
+
+    # Keyed by pid so forked workers open their own file description,
+    # flock wouldn't exclude processes sharing an inherited one
+    key = (settings.THROTTLE_STORE_PATH, os.getpid())
+    if key not in _stores:
+        _stores[key] = SharedBucketStore(
+            settings.THROTTLE_STORE_PATH, settings.THROTTLE_STORE_SLOTS
+        )
+
+    return _stores[key]
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Token bucket throttle per user, or per IP for anonymous requests
+
+    The rate "60/min" allows bursts of 60 requests refilled at one per
+    second. When methods is set only requests using one of them count.
+    """
+
+    methods = None
+
+    def get_rate(self):
+        # Read the rates on each use so they can be changed in settings
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+
+        return super().get_rate()
+
+    def applies_to(self, request, view):
+        """Return True when the request counts against this scope"""
+
+        return self.methods is None or request.method in self.methods
+
+    def get_cache_key(self, request, view):
+        if not self.applies_to(request, view):
+            return None
+
+        if request.user and request.user.is_authenticated:
+            ident = f"user-{request.user.pk}"
+        else:
+            ident = f"ip-{self.get_ident(request)}"
+
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        allowed, self.wait_seconds = get_store().consume(
+            self.key,
+            self.num_requests,
+            self.num_requests / self.duration,
+            self.timer()
+        )
+
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginRateThrottle(TokenBucketThrottle):
+    """Limit login and signup attempts per IP"""
+
+    scope = "login"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": f"ip-{self.get_ident(request)}"
+        }
+
+
+class ReadRateThrottle(TokenBucketThrottle):
+    """Limit reads"""
+
+    scope = "read"
+    methods = ("GET", "HEAD", "OPTIONS")
+
+
+class WriteRateThrottle(TokenBucketThrottle):
+    """Limit writes"""
+
+    scope = "write"
+    methods = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class UploadRateThrottle(TokenBucketThrottle):
+    """Limit image uploads, on top of the write limit"""
+
+    scope = "upload"
+    actions = ("upload_image",)
+
+    def applies_to(self, request, view):
+        return getattr(view, "action", None) in self.actions
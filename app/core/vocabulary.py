@@ -0,0 +1,47 @@
+import unicodedata
+
+from django.db import DEFAULT_DB_ALIAS
+
+from core.models import CanonicalName
+from core.sharding import copy_canonical_names
+
+
+def normalize_name(name):
+    """Return the canonical form of a tag or ingredient name
+
+    Compatibility characters are folded (NFKC), case is folded and
+    whitespace collapsed, so "Salt", "salt " and "ＳＡＬＴ" are one name.
+    """
+
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+def canonical_ids(names, using=None):
+    """Return a {normalized name: CanonicalName id} dict for names
+
+    Missing names are inserted in one statement, a concurrent insert of
+    the same name is ignored thanks to the unique constraint. The ids
+    come from the default database, names used on a shard are copied
+    there with the same ids.
+    """
+
+    normalized = {normalize_name(name) for name in names}
+    names = CanonicalName.objects.using(DEFAULT_DB_ALIAS)
+    ids = dict(
+        names.filter(name__in=normalized).values_list("name", "pk")
+    )
+
+    missing = normalized - ids.keys()
+    if missing:
+        names.bulk_create(
+            [CanonicalName(name=name) for name in missing],
+            ignore_conflicts=True
+        )
+        ids.update(
+            names.filter(name__in=missing).values_list("name", "pk")
+        )
+
+    if using is not None:
+        copy_canonical_names(list(ids.values()), using)
+
+    return ids
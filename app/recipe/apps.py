@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    def ready(self):
+        # Keep the loaded similarity indexes in step with recipe changes
+        from recipe import similarity  # noqa: F401
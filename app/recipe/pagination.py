@@ -0,0 +1,132 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.encoding import force_str
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, \
+    LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from core.pagination import bounded_count
+
+
+class KeysetPagination(BasePagination):
+    """Opt-in keyset pagination over an (field, id) ordering
+
+    Lists stay unpaginated unless ?page_size= or ?cursor= is given. The
+    cursor holds the sort value and id of the last row, so the next
+    page is a range scan of the (user, field, id) index however deep
+    it is, unlike an OFFSET. The count is of the whole filtered list.
+    """
+
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    page_size = 50
+    max_page_size = 200
+
+    def _page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        return max(1, min(size, self.max_page_size))
+
+    def _encode(self, value, pk):
+        data = json.dumps([force_str(value), pk]).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def _decode(self, cursor, field):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return field.to_python(value), int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound("Invalid cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.page_size_query_param not in params and \
+                self.cursor_query_param not in params:
+            return None
+
+        self.request = request
+        # The queryset is ordered by this field, then by id the same way
+        ordering = view.get_ordering()
+        name = ordering.lstrip("-")
+        after = "lt" if ordering.startswith("-") else "gt"
+        self.count, self.count_approximate = bounded_count(
+            queryset, settings.LIST_EXACT_COUNT_LIMIT
+        )
+
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self._decode(
+                cursor, queryset.model._meta.get_field(name)
+            )
+            queryset = queryset.filter(
+                Q(**{f"{name}__{after}": value}) |
+                Q(**{name: value, f"id__{after}": pk})
+            )
+
+        size = self._page_size(request)
+        rows = list(queryset[:size + 1])
+        page = rows[:size]
+
+        self.next_cursor = None
+        if len(rows) > size:
+            last = page[-1]
+            self.next_cursor = self._encode(getattr(last, name), last.pk)
+
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("count", self.count),
+            ("count_approximate", self.count_approximate),
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+
+class BoundedCountPagination(LimitOffsetPagination):
+    """Opt-in ?limit=&offset= pages with a bounded count
+
+    Counting a large filtered list exactly can cost more than the page
+    itself, so past LIST_EXACT_COUNT_LIMIT the count is an estimate.
+    """
+
+    max_limit = 1000
+
+    def get_count(self, queryset):
+        self.count_approximate = False
+        if isinstance(queryset, list):
+            return len(queryset)
+
+        count, self.count_approximate = bounded_count(
+            queryset, settings.LIST_EXACT_COUNT_LIMIT
+        )
+        return count
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("count", self.count),
+            ("count_approximate", self.count_approximate),
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
@@ -1,5 +1,11 @@
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
 from rest_framework import serializers
 
+from core import images
 from core.models import Tag, Ingredient, Recipe
 
 
@@ -37,9 +43,13 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             "id", "title", "tags", "ingredients", "time_minutes",
-            "price", "link"
+            "price", "link", "image", "image_width", "image_height",
+            "image_bytes", "image_color", "image_placeholder"
+        )
+        read_only_fields = (
+            "id", "image", "image_width", "image_height", "image_bytes",
+            "image_color", "image_placeholder"
         )
-        read_only_fields = ("id",)
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -49,10 +59,163 @@ class RecipeDetailSerializer(RecipeSerializer):
     ingredients = IngredientSerializer(many=True, read_only=True)
 
 
+class SimilarRecipeSerializer(RecipeSerializer):
+    """Serialize a recipe with its similarity to another one"""
+
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ("similarity",)
+
+
+class CookableRecipeSerializer(RecipeSerializer):
+    """Serialize a recipe with the ingredients missing to cook it"""
+
+    missing = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ("missing",)
+
+
+class BoundedImageField(serializers.ImageField):
+    """Image field enforcing the upload limits before decoding anything"""
+
+    default_error_messages = {
+        "limit": "{message}",
+    }
+
+    def to_internal_value(self, data):
+        if not hasattr(data, "read"):
+            # Let ImageField report what's wrong with it
+            return super().to_internal_value(data)
+
+        try:
+            image_format, width, height = images.check_limits(
+                data,
+                max_bytes=settings.IMAGE_UPLOAD_MAX_BYTES,
+                max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS,
+                max_dimension=settings.IMAGE_UPLOAD_MAX_DIMENSION,
+                formats=settings.IMAGE_UPLOAD_FORMATS
+            )
+        except images.ImageRejected as error:
+            self.fail("limit", message=str(error))
+        except Exception:
+            self.fail("invalid_image")
+
+        data = super().to_internal_value(data)
+
+        max_dimension = settings.IMAGE_STORE_MAX_DIMENSION
+        if width > max_dimension or height > max_dimension:
+            data.seek(0)
+            name = os.path.basename(data.name)
+            data = ContentFile(
+                images.downscale(data, max_dimension, image_format),
+                name=name
+            )
+
+        return data
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading imgages to recipes"""
 
+    image = BoundedImageField(allow_null=True)
+
     class Meta:
         model = Recipe
         fields = ("id", "image")
         read_only_fields = ("id", )
+
+    def update(self, instance, validated_data):
+        """Store the image metadata along with the image"""
+
+        image = validated_data.get("image")
+        if image:
+            image.seek(0)
+            validated_data.update(images.image_metadata(image))
+        else:
+            validated_data.update(images.EMPTY_METADATA)
+
+        return super().update(instance, validated_data)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Serializer for actions working on many recipes at once"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=10000
+    )
+
+
+def _link_ids():
+    return serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        max_length=1000
+    )
+
+
+class RecipeLinksSerializer(serializers.Serializer):
+    """Tags and ingredients to add to or remove from recipes"""
+
+    tags_add = _link_ids()
+    tags_remove = _link_ids()
+    ingredients_add = _link_ids()
+    ingredients_remove = _link_ids()
+
+    def _check_owned(self, model, ids):
+        """Reject ids to add that aren't the user's, in one query"""
+
+        user = self.context["request"].user
+        owned = set(
+            model.objects.filter(user=user, pk__in=ids)
+            .values_list("pk", flat=True)
+        )
+        missing = sorted(set(ids) - owned)
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid pk {missing[0]} - object does not exist."
+            )
+
+        return ids
+
+    def validate_tags_add(self, ids):
+        return self._check_owned(Tag, ids)
+
+    def validate_ingredients_add(self, ids):
+        return self._check_owned(Ingredient, ids)
+
+    def validate(self, attrs):
+        if not any(attrs.values()):
+            raise serializers.ValidationError(
+                "Nothing to add or remove"
+            )
+
+        for name in ("tags", "ingredients"):
+            both = set(attrs.get(f"{name}_add", ())) & \
+                set(attrs.get(f"{name}_remove", ()))
+            if both:
+                raise serializers.ValidationError(
+                    f"Can't both add and remove {name} {sorted(both)}"
+                )
+
+        return attrs
+
+
+class RecipeLinksBulkSerializer(RecipeLinksSerializer):
+    """Tags and ingredients to add to or remove from many recipes"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000
+    )
+
+    def validate(self, attrs):
+        ids = attrs.pop("ids")
+        attrs = super().validate(attrs)
+        attrs["ids"] = ids
+
+        return attrs
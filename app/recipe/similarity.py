@@ -0,0 +1,233 @@
+import heapq
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from core.models import Recipe
+from core.sharding import counters, for_user
+from core.sync import data_changed
+
+
+def tag_feature(tag_id):
+    return tag_id * 2
+
+
+def ingredient_feature(ingredient_id):
+    return ingredient_id * 2 + 1
+
+
+class SimilarityIndex:
+    """Inverted index of the tags and ingredients of a user's recipes
+
+    Tags and ingredients share one feature space, each recipe is the set
+    of its features. A query only visits the recipes sharing at least
+    one feature with the recipe asked about, which is what keeps top-k
+    queries fast on large libraries.
+    """
+
+    def __init__(self, version=0):
+        self.version = version
+        self.features = {}
+        self.postings = defaultdict(set)
+        # Recipe to feature links held, what the memory use follows
+        self.links = 0
+        self.lock = threading.Lock()
+        # Changes seen in this process since the index was last synced
+        self.pending = 0
+        self.dirty = set()
+
+    @classmethod
+    def from_rows(cls, recipe_ids, tag_rows, ingredient_rows, version=0):
+        """Build an index from (recipe_id, tag_id) and
+        (recipe_id, ingredient_id) pairs"""
+
+        index = cls(version)
+        features = {recipe_id: set() for recipe_id in recipe_ids}
+        for recipe_id, tag_id in tag_rows:
+            features[recipe_id].add(tag_feature(tag_id))
+        for recipe_id, ingredient_id in ingredient_rows:
+            features[recipe_id].add(ingredient_feature(ingredient_id))
+
+        for recipe_id, recipe_features in features.items():
+            index.set_features(recipe_id, recipe_features)
+
+        return index
+
+    def __len__(self):
+        return len(self.features)
+
+    def set_features(self, recipe_id, features):
+        """Add or replace a recipe"""
+
+        self.remove(recipe_id)
+        features = frozenset(features)
+        self.features[recipe_id] = features
+        self.links += len(features)
+        for feature in features:
+            self.postings[feature].add(recipe_id)
+
+    def remove(self, recipe_id):
+        """Drop a recipe from the index"""
+
+        features = self.features.pop(recipe_id, ())
+        self.links -= len(features)
+        for feature in features:
+            postings = self.postings.get(feature)
+            if postings is None:
+                continue
+            postings.discard(recipe_id)
+            if not postings:
+                del self.postings[feature]
+
+    def similar(self, recipe_id, limit):
+        """Return the (recipe_id, score) pairs most similar to a recipe
+
+        The score is the Jaccard similarity of the feature sets, ties are
+        broken by recipe id so results are stable. Shared features are
+        counted in C by Counter, then candidates are scored from the most
+        shared features down, stopping once no remaining candidate can
+        beat the results found.
+        """
+
+        # Held for the whole query, other threads update the index in
+        # place under the same lock
+        with self.lock:
+            return self._similar(recipe_id, limit)
+
+    def _similar(self, recipe_id, limit):
+        features = self.features.get(recipe_id)
+        if not features or limit < 1:
+            return []
+
+        shared = Counter()
+        for feature in features:
+            shared.update(self.postings.get(feature, ()))
+        del shared[recipe_id]
+
+        by_common = defaultdict(list)
+        for other, common in shared.items():
+            by_common[common].append(other)
+
+        size = len(features)
+        # min-heap of the best (score, -recipe_id) found so far
+        best = []
+        for common in sorted(by_common, reverse=True):
+            # A recipe sharing common features scores at most common/size
+            if len(best) == limit and common / size < best[0][0]:
+                break
+
+            for other in by_common[common]:
+                item = (
+                    common / (size + len(self.features[other]) - common),
+                    -other
+                )
+                if len(best) < limit:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+
+        return [(-other, score) for score, other in sorted(best, reverse=True)]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _recipe_rows(user_id, recipe_ids=None):
+    """Return the recipe ids and link rows of a user's recipes"""
+
+    recipes = Recipe.objects.filter(user_id=user_id)
+    tags = Recipe.tags.through.objects.filter(recipe__user_id=user_id)
+    ingredients = Recipe.ingredients.through.objects.filter(
+        recipe__user_id=user_id
+    )
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+
+    return (
+        list(recipes.values_list("pk", flat=True)),
+        tags.values_list("recipe_id", "tag_id").iterator(),
+        ingredients.values_list("recipe_id", "ingredient_id").iterator(),
+    )
+
+
+def _sync(index, user_id, version):
+    """Apply the changes recorded by this process to the index
+
+    Returns False when the data changed in ways this process didn't
+    see, another worker or a raw query wrote, and a rebuild is needed.
+    """
+
+    if version != index.version + index.pending:
+        return False
+
+    if index.dirty:
+        dirty = list(index.dirty)
+        partial = SimilarityIndex.from_rows(*_recipe_rows(user_id, dirty))
+        for recipe_id in dirty:
+            if recipe_id in partial.features:
+                index.set_features(recipe_id, partial.features[recipe_id])
+            else:
+                index.remove(recipe_id)
+
+    index.version = version
+    index.pending = 0
+    index.dirty.clear()
+
+    return True
+
+
+def get_index(user):
+    """Return the up to date similarity index of a user
+
+    Indexes are kept in memory for the most recently used users, up to
+    SIMILARITY_INDEX_MAX_LINKS links in all. They are updated in place
+    from the changes this process made, and only rebuilt from the
+    through tables when the data version shows a change made elsewhere.
+    """
+
+    with _indexes_lock:
+        index = _indexes.get(user.pk)
+        if index is not None:
+            _indexes.move_to_end(user.pk)
+
+    # The version the request was authenticated with may be behind the
+    # changes this request made itself, and is kept on the user's shard
+    version = counters(user.pk) \
+        .values_list("data_version", flat=True).first()
+
+    with for_user(user.pk):
+        if index is not None:
+            with index.lock:
+                if index.version == version or \
+                        _sync(index, user.pk, version):
+                    return index
+
+        index = SimilarityIndex.from_rows(*_recipe_rows(user.pk), version)
+    with _indexes_lock:
+        _indexes[user.pk] = index
+        # The index just built is kept even when over the limit alone
+        while len(_indexes) > 1 and sum(
+                loaded.links for loaded in _indexes.values()
+        ) > settings.SIMILARITY_INDEX_MAX_LINKS:
+            _indexes.popitem(last=False)
+
+    return index
+
+
+@receiver(data_changed)
+def record_change(sender, user_id, count, recipe_ids, **kwargs):
+    """Note a change to a user's data in their loaded index"""
+
+    index = _indexes.get(user_id)
+    if index is None:
+        return
+
+    with index.lock:
+        # Matches the change numbers taken from the data version
+        index.pending += count
+        index.dirty.update(recipe_ids)
@@ -0,0 +1,125 @@
+from django.db import connections
+from django.db.models import Avg, Count, Max, Min, Q
+
+from core.models import Tag, Ingredient, Recipe
+
+
+# Upper bounds of the histogram buckets, the last bucket is open ended
+TIME_BUCKETS = (15, 30, 60, 120)
+PRICE_BUCKETS = (5, 10, 20, 50)
+# Number of tags and ingredients listed
+TOP = 10
+
+
+def _bucket_bounds(bounds):
+    """Return (low, high) pairs covering everything from 0"""
+
+    lows = (0,) + bounds
+    highs = bounds + (None,)
+
+    return list(zip(lows, highs))
+
+
+def _bucket_filter(field, low, high):
+    if high is None:
+        return Q(**{f"{field}__gte": low})
+
+    return Q(**{f"{field}__gte": low, f"{field}__lt": high})
+
+
+def _histogram(row, field, bounds):
+    return [
+        {"min": low, "max": high, "count": row[f"{field}_{index}"]}
+        for index, (low, high) in enumerate(_bucket_bounds(bounds))
+    ]
+
+
+def _top(model, ids):
+    """Return a query of the most used tags or ingredients among the
+    recipes"""
+
+    return model.objects.filter(recipe__in=ids) \
+        .values("id", "name") \
+        .annotate(count=Count("recipe")) \
+        .order_by("-count", "name")[:TOP]
+
+
+def _rankings(ids):
+    """Return the tag and ingredient rankings from one query
+
+    Each ranking keeps its own LIMIT in a derived table, joined by
+    UNION ALL. Django only builds that compound query on some
+    databases, so it is put together from the compiled rankings.
+    """
+
+    kinds = (("tags", Tag), ("ingredients", Ingredient))
+    parts, params = [], []
+    for index, (kind, model) in enumerate(kinds):
+        queryset = _top(model, ids)
+        sql, part_params = queryset.query.get_compiler(queryset.db).as_sql()
+        parts.append(f"SELECT {index}, {kind}.* FROM ({sql}) {kind}")
+        params.extend(part_params)
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(" UNION ALL ".join(parts), params)
+        rows = cursor.fetchall()
+
+    rankings = {kind: [] for kind, _ in kinds}
+    for index, pk, name, count in sorted(
+            rows, key=lambda row: (row[0], -row[3], row[2])):
+        rankings[kinds[index][0]].append(
+            {"id": pk, "name": name, "count": count}
+        )
+
+    return rankings
+
+
+def recipe_stats(queryset):
+    """Return statistics of the recipes of a queryset
+
+    One aggregate query computes the numbers and histograms, and one
+    more the tag and ingredient rankings.
+    """
+
+    # Filtering on tags or ingredients joins rows, the subquery makes
+    # sure every recipe is only counted once
+    ids = queryset.order_by().values("pk")
+    recipes = Recipe.objects.filter(pk__in=ids)
+
+    aggregates = {
+        "count": Count("pk"),
+        "price_min": Min("price"),
+        "price_avg": Avg("price"),
+        "price_max": Max("price"),
+        "time_min": Min("time_minutes"),
+        "time_avg": Avg("time_minutes"),
+        "time_max": Max("time_minutes"),
+    }
+    for field, bounds in (
+            ("time_minutes", TIME_BUCKETS), ("price", PRICE_BUCKETS)):
+        for index, (low, high) in enumerate(_bucket_bounds(bounds)):
+            aggregates[f"{field}_{index}"] = Count(
+                "pk", filter=_bucket_filter(field, low, high)
+            )
+
+    row = recipes.aggregate(**aggregates)
+
+    def rounded(value):
+        return None if value is None else round(float(value), 2)
+
+    return {
+        "count": row["count"],
+        "price": {
+            "min": rounded(row["price_min"]),
+            "avg": rounded(row["price_avg"]),
+            "max": rounded(row["price_max"]),
+            "histogram": _histogram(row, "price", PRICE_BUCKETS),
+        },
+        "time_minutes": {
+            "min": row["time_min"],
+            "avg": rounded(row["time_avg"]),
+            "max": row["time_max"],
+            "histogram": _histogram(row, "time_minutes", TIME_BUCKETS),
+        },
+        **_rankings(ids),
+    }
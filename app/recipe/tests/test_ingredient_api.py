@@ -89,6 +89,26 @@ class PrivateIngredientApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_ingredient_too_long_once_normalized(self):
+        """Test a name growing past 255 characters when folded fails"""
+
+        res = self.client.post(INGREDIENTS_URL, {"name": "\u00df" * 255})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_create_ingredient_existing_name(self):
+        """Test a new name gets a 201, one the user has a 200 and the
+        existing ingredient"""
+
+        res = self.client.post(INGREDIENTS_URL, {"name": "Salt"})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        again = self.client.post(INGREDIENTS_URL, {"name": "SALT"})
+
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.data, res.data)
+
     def test_retreve_ingredients_assinged_to_recipes(self):
         """Test filtering ingredients by those assigned to recipes"""
 
@@ -145,3 +165,22 @@ class PrivateIngredientApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL, {"assigned_only": 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_autocomplete_ingredients(self):
+        """Test ?q= only matches the user's names and is limited"""
+
+        other = get_user_model().objects.create_user(
+            "other@test.com", "testpass"
+        )
+        Ingredient.objects.create(user=other, name="Salt")
+        for number in range(15):
+            Ingredient.objects.create(user=self.user, name=f"Salt {number}")
+        Ingredient.objects.create(user=self.user, name="Pepper")
+
+        with self.settings(AUTOCOMPLETE_LIMIT=5):
+            res = self.client.get(INGREDIENTS_URL, {"q": "salt"})
+
+        self.assertEqual(len(res.data), 5)
+        self.assertTrue(
+            all(item["name"].startswith("Salt ") for item in res.data)
+        )
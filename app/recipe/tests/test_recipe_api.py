@@ -1,21 +1,31 @@
 import tempfile
 import os
+from unittest.mock import patch
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import Recipe, Tag, Ingredient, Task
 
+from core.tests.test_images import png_bomb
+
+from recipe import similarity
+from recipe.stats import recipe_stats
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 
 RECIPES_URL = reverse("recipe:recipe-list")
+BULK_DELETE_URL = reverse("recipe:recipe-bulk-delete")
+STATS_URL = reverse("recipe:recipe-stats")
+COOKABLE_URL = reverse("recipe:recipe-cookable")
 
 
 def detail_url(recipe_id):
@@ -24,6 +34,12 @@ def detail_url(recipe_id):
     return reverse("recipe:recipe-detail", args=[recipe_id])
 
 
+def similar_url(recipe_id):
+    """Return URL for similar recipes"""
+
+    return reverse("recipe:recipe-similar", args=[recipe_id])
+
+
 def image_upload_url(recipe_id):
     """Return URL for recipe image upload"""
 
@@ -241,6 +257,459 @@ class PrivateRecipeApiTest(TestCase):
 
         self.assertEqual(len(tags), 0)
 
+    def test_bulk_delete_recipes(self):
+        """Test deleting many recipes of the user at once"""
+
+        recipe1 = sample_recipe(user=self.user)
+        recipe1.tags.add(sample_tag(user=self.user))
+        recipe2 = sample_recipe(user=self.user)
+        kept = sample_recipe(user=self.user)
+        user2 = get_user_model().objects.create_user(
+            email="other@user.com",
+            password="otherpass"
+        )
+        other = sample_recipe(user=user2)
+
+        res = self.client.post(
+            BULK_DELETE_URL,
+            {"ids": [recipe1.id, recipe2.id, other.id]},
+            format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            set(Recipe.objects.all()), {kept, other}
+        )
+
+    @override_settings(DELETION_BATCH_SIZE=1)
+    def test_bulk_delete_large_selection_queued(self):
+        """Test large selections are deleted by a background task"""
+
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+
+        res = self.client.post(
+            BULK_DELETE_URL, {"ids": [recipe1.id, recipe2.id]}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertTrue(Task.objects.exists())
+
+    def test_bulk_delete_invalid(self):
+        """Test bulk delete requires a list of ids"""
+
+        res = self.client.post(BULK_DELETE_URL, {"ids": []}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def duplicate_url(recipe_id):
+    """Return URL for duplicating a recipe"""
+
+    return reverse("recipe:recipe-duplicate", args=[recipe_id])
+
+
+class RecipeDuplicateApiTests(TestCase):
+    """Test copying recipes server side"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test@londonappdev.com",
+            "testpass"
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = sample_tag(user=self.user)
+        self.ingredient = sample_ingredient(user=self.user)
+        self.recipe = sample_recipe(
+            user=self.user, title="Curry", image="uploads/recipe/curry.jpg"
+        )
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+        self.recipe.refresh_from_db()
+
+    def test_duplicate_recipe(self):
+        """Test a copy gets the fields, links and image of the original"""
+
+        res = self.client.post(duplicate_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        copy = Recipe.objects.get(pk=res.data["id"])
+        self.assertNotEqual(copy.pk, self.recipe.pk)
+        self.assertEqual(copy.title, "Curry")
+        self.assertEqual(copy.image.name, self.recipe.image.name)
+        self.assertEqual(copy.ingredient_count, 1)
+        self.assertGreater(copy.seq, self.recipe.seq)
+        self.assertEqual(list(copy.tags.all()), [self.tag])
+        self.assertEqual(list(copy.ingredients.all()), [self.ingredient])
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 2)
+
+    def test_duplicate_other_user_recipe(self):
+        """Test recipes of other users can't be copied"""
+
+        other = get_user_model().objects.create_user(
+            "other@londonappdev.com", "testpass"
+        )
+        recipe = sample_recipe(user=other)
+
+        res = self.client.post(duplicate_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Recipe.objects.filter(user=other).count(), 1)
+
+    def test_bulk_duplicate(self):
+        """Test copying many recipes, skipping those of other users"""
+
+        recipe = sample_recipe(user=self.user, title="Soup")
+        other = get_user_model().objects.create_user(
+            "other@londonappdev.com", "testpass"
+        )
+        foreign = sample_recipe(user=other)
+
+        res = self.client.post(
+            reverse("recipe:recipe-bulk-duplicate"),
+            {"ids": [self.recipe.id, recipe.id, foreign.id]},
+            format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        copies = {copy["source"]: copy["id"] for copy in res.data["copies"]}
+        self.assertEqual(set(copies), {self.recipe.id, recipe.id})
+        self.assertEqual(Recipe.objects.get(pk=copies[recipe.id]).title,
+                         "Soup")
+        self.assertEqual(
+            list(Recipe.objects.get(pk=copies[recipe.id]).tags.all()), []
+        )
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 4)
+
+
+def links_url(recipe_id):
+    """Return URL for changing some links of a recipe"""
+
+    return reverse("recipe:recipe-links", args=[recipe_id])
+
+
+class RecipeLinksApiTests(TestCase):
+    """Test adding and removing single tags and ingredients"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test@londonappdev.com",
+            "testpass"
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = sample_tag(user=self.user, name="Vegan")
+        self.quick = sample_tag(user=self.user, name="Quick")
+        self.salt = sample_ingredient(user=self.user, name="Salt")
+        self.recipe = sample_recipe(user=self.user)
+        self.recipe.tags.add(self.vegan)
+
+    def test_add_and_remove_links(self):
+        """Test only the given links change"""
+
+        self.recipe.refresh_from_db()
+        seq = self.recipe.seq
+
+        res = self.client.patch(links_url(self.recipe.id), {
+            "tags_add": [self.quick.id],
+            "ingredients_add": [self.salt.id],
+        }, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(res.data["tags"]), sorted([self.vegan.id, self.quick.id])
+        )
+        self.assertEqual(res.data["ingredients"], [self.salt.id])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 1)
+        self.assertGreater(self.recipe.seq, seq)
+        self.quick.refresh_from_db()
+        self.assertEqual(self.quick.recipe_count, 1)
+
+        res = self.client.patch(links_url(self.recipe.id), {
+            "tags_remove": [self.vegan.id],
+        }, format="json")
+
+        self.assertEqual(res.data["tags"], [self.quick.id])
+        self.vegan.refresh_from_db()
+        self.assertEqual(self.vegan.recipe_count, 0)
+
+    def test_add_existing_link_is_noop(self):
+        """Test adding a link already there leaves the recipe as is"""
+
+        self.recipe.refresh_from_db()
+        seq = self.recipe.seq
+
+        res = self.client.patch(links_url(self.recipe.id), {
+            "tags_add": [self.vegan.id],
+        }, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.seq, seq)
+
+    def test_invalid_links(self):
+        """Test other users' ids, empty and conflicting changes fail"""
+
+        other = get_user_model().objects.create_user(
+            "other@londonappdev.com", "testpass"
+        )
+        foreign = sample_tag(user=other, name="Foreign")
+
+        for payload in ({"tags_add": [foreign.id]}, {},
+                        {"tags_add": [self.quick.id],
+                         "tags_remove": [self.quick.id]}):
+            res = self.client.patch(
+                links_url(self.recipe.id), payload, format="json"
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(self.recipe.tags.all()), [self.vegan])
+
+    def test_bulk_links(self):
+        """Test tagging many recipes at once, skipping other users'"""
+
+        recipe = sample_recipe(user=self.user)
+        other = get_user_model().objects.create_user(
+            "other@londonappdev.com", "testpass"
+        )
+        foreign = sample_recipe(user=other)
+
+        res = self.client.patch(reverse("recipe:recipe-bulk-links"), {
+            "ids": [self.recipe.id, recipe.id, foreign.id],
+            "tags_add": [self.quick.id],
+        }, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {"recipes": 2, "changed": 2})
+        self.assertEqual(
+            set(self.quick.recipe_set.values_list("pk", flat=True)),
+            {self.recipe.id, recipe.id}
+        )
+        self.assertFalse(foreign.tags.exists())
+        self.quick.refresh_from_db()
+        self.assertEqual(self.quick.recipe_count, 2)
+
+
+class RecipeStatsApiTests(TestCase):
+    """Test the recipe statistics API"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="stats@test.com",
+            password="statspass"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_stats(self):
+        """Test statistics are computed over the user's recipes"""
+
+        vegan = sample_tag(user=self.user, name="Vegan")
+        recipe1 = sample_recipe(user=self.user, time_minutes=10, price=4)
+        recipe2 = sample_recipe(user=self.user, time_minutes=45, price=12)
+        recipe1.tags.add(vegan)
+        recipe2.tags.add(vegan)
+        other = get_user_model().objects.create_user(
+            "other@test.com", "testpass"
+        )
+        sample_recipe(user=other, time_minutes=500, price=500)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["count"], 2)
+        self.assertEqual(res.data["price"]["min"], 4)
+        self.assertEqual(res.data["price"]["avg"], 8)
+        self.assertEqual(res.data["time_minutes"]["max"], 45)
+        counts = [b["count"] for b in res.data["time_minutes"]["histogram"]]
+        self.assertEqual(counts, [1, 0, 1, 0, 0])
+        self.assertEqual(
+            res.data["tags"], [{"id": vegan.id, "name": "Vegan", "count": 2}]
+        )
+
+    @patch("recipe.stats.TOP", 2)
+    def test_stats_rankings(self):
+        """Test the most used tags and ingredients come from one query"""
+
+        tags = [sample_tag(self.user, name) for name in ("A", "B", "C")]
+        salt = sample_ingredient(self.user, "Salt")
+        for count in (1, 2, 3):
+            recipe = sample_recipe(user=self.user)
+            recipe.tags.add(*tags[:count])
+            recipe.ingredients.add(salt)
+
+        with self.assertNumQueries(2):
+            stats = recipe_stats(Recipe.objects.filter(user=self.user))
+
+        self.assertEqual(
+            [(t["name"], t["count"]) for t in stats["tags"]],
+            [("A", 3), ("B", 2)]
+        )
+        self.assertEqual(
+            stats["ingredients"], [{"id": salt.id, "name": "Salt", "count": 3}]
+        )
+
+    def test_stats_filtered(self):
+        """Test statistics honor the filters and count recipes once"""
+
+        tag1 = sample_tag(user=self.user, name="Vegan")
+        tag2 = sample_tag(user=self.user, name="Quick")
+        recipe1 = sample_recipe(user=self.user, price=4)
+        recipe1.tags.add(tag1, tag2)
+        sample_recipe(user=self.user, price=30)
+
+        res = self.client.get(STATS_URL, {"tags": f"{tag1.id},{tag2.id}"})
+
+        self.assertEqual(res.data["count"], 1)
+        self.assertEqual(res.data["price"]["max"], 4)
+
+    def test_stats_invalid_filter(self):
+        """Test filters that aren't ids are refused"""
+
+        res = self.client.get(STATS_URL, {"tags": "x"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("tags", res.data)
+
+    def test_stats_invalidated_on_change(self):
+        """Test cached statistics are dropped when a recipe changes"""
+
+        sample_recipe(user=self.user)
+        self.client.get(STATS_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(STATS_URL)
+        self.assertEqual(res.data["count"], 1)
+
+        sample_recipe(user=self.user)
+        self.user.refresh_from_db()
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data["count"], 2)
+
+
+class SimilarRecipesApiTests(TestCase):
+    """Test the similar recipes API"""
+
+    def setUp(self):
+        similarity._indexes.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="similar@test.com",
+            password="similarpass"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_similar_recipes(self):
+        """Test recipes sharing tags and ingredients are returned first"""
+
+        vegan = sample_tag(user=self.user, name="Vegan")
+        tofu = sample_ingredient(user=self.user, name="Tofu")
+        recipe = sample_recipe(user=self.user, title="Tofu Curry")
+        close = sample_recipe(user=self.user, title="Tofu Stir Fry")
+        far = sample_recipe(user=self.user, title="Salad")
+        sample_recipe(user=self.user, title="Steak")
+        recipe.tags.add(vegan)
+        recipe.ingredients.add(tofu)
+        close.tags.add(vegan)
+        close.ingredients.add(tofu)
+        far.tags.add(vegan)
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["id"] for r in res.data], [close.id, far.id])
+        self.assertEqual(res.data[0]["similarity"], 1.0)
+        self.assertEqual(res.data[1]["similarity"], 0.5)
+
+        res = self.client.get(similar_url(recipe.id), {"limit": 1})
+        self.assertEqual(len(res.data), 1)
+
+    def test_similar_other_user_recipe(self):
+        """Test other users' recipes can't be looked up"""
+
+        other = get_user_model().objects.create_user(
+            "other@test.com", "testpass"
+        )
+        recipe = sample_recipe(user=other)
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CookableRecipesApiTests(TestCase):
+    """Test the "what can I cook" API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="cook@test.com",
+            password="cookpass"
+        )
+        self.client.force_authenticate(self.user)
+        self.eggs = sample_ingredient(user=self.user, name="Eggs")
+        self.milk = sample_ingredient(user=self.user, name="Milk")
+        self.flour = sample_ingredient(user=self.user, name="Flour")
+        self.omelette = sample_recipe(user=self.user, title="Omelette")
+        self.omelette.ingredients.add(self.eggs, self.milk)
+        self.pancakes = sample_recipe(user=self.user, title="Pancakes")
+        self.pancakes.ingredients.add(self.eggs, self.milk, self.flour)
+
+    def test_fully_covered_recipes(self):
+        """Test only recipes with every ingredient at hand are returned"""
+
+        res = self.client.get(
+            COOKABLE_URL, {"have": f"{self.eggs.id},{self.milk.id}"}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["id"] for r in res.data], [self.omelette.id])
+        self.assertEqual(res.data[0]["missing"], [])
+
+    def test_near_matches_list_missing(self):
+        """Test near-matches are returned with what they lack"""
+
+        bread = sample_recipe(user=self.user, title="Bread")
+        bread.ingredients.add(self.flour)
+
+        res = self.client.get(
+            COOKABLE_URL,
+            {"have": f"{self.eggs.id},{self.milk.id}", "missing": 1}
+        )
+
+        self.assertEqual(
+            [r["id"] for r in res.data],
+            [self.omelette.id, self.pancakes.id, bread.id]
+        )
+        self.assertEqual(
+            res.data[1]["missing"], [{"id": self.flour.id, "name": "Flour"}]
+        )
+
+    def test_ingredient_count_maintained(self):
+        """Test the ingredient count follows link changes"""
+
+        self.pancakes.ingredients.remove(self.flour)
+        self.milk.recipe_set.clear()
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.ingredient_count, 1)
+
+        self.eggs.delete()
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.ingredient_count, 0)
+
+    def test_cookable_invalid(self):
+        """Test ingredient ids are required"""
+
+        res = self.client.get(COOKABLE_URL, {"have": "eggs"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class RecipeImageUploadTests(TestCase):
     """Test image upload API"""
@@ -280,6 +749,74 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn("image", res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_upload_image_retry_replayed(self):
+        """Test a retried upload with the same key is processed once"""
+
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
+            Image.new("RGB", (10, 10)).save(ntf, format="JPEG")
+            ntf.seek(0)
+            res = self.client.post(
+                url, {"image": ntf}, format="multipart",
+                HTTP_IDEMPOTENCY_KEY="upload-1"
+            )
+            self.recipe.refresh_from_db()
+            first = self.recipe.image.name
+
+            ntf.seek(0)
+            retry = self.client.post(
+                url, {"image": ntf}, format="multipart",
+                HTTP_IDEMPOTENCY_KEY="upload-1"
+            )
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(self.recipe.image.name, first)
+
+    def test_upload_image_metadata(self):
+        """Test the image size, color and placeholder are returned"""
+
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix=".png") as ntf:
+            Image.new("RGB", (40, 20), "red").save(ntf, format="PNG")
+            ntf.seek(0)
+            self.client.post(url, {"image": ntf}, format="multipart")
+
+        res = self.client.get(detail_url(self.recipe.id))
+
+        self.assertEqual(res.data["image_width"], 40)
+        self.assertEqual(res.data["image_height"], 20)
+        self.assertGreater(res.data["image_bytes"], 0)
+        self.assertEqual(res.data["image_color"], "#ff0000")
+        self.assertTrue(res.data["image_placeholder"].startswith("data:"))
+        self.assertTrue(res.data["image"].endswith(".png"))
+
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data[0]["image_color"], "#ff0000")
+
+    @override_settings(IMAGE_STORE_MAX_DIMENSION=200)
+    def test_upload_palette_and_1bit_png(self):
+        """Test palette and 1-bit images are stored and measured"""
+
+        url = image_upload_url(self.recipe.id)
+        for mode in ("P", "1"):
+            with self.subTest(mode=mode):
+                with tempfile.NamedTemporaryFile(suffix=".png") as ntf:
+                    Image.new(mode, (300, 300)).save(ntf, format="PNG")
+                    ntf.seek(0)
+                    res = self.client.post(
+                        url, {"image": ntf}, format="multipart"
+                    )
+
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.recipe.refresh_from_db()
+                self.assertEqual(self.recipe.image_width, 200)
+                self.assertEqual(self.recipe.image_color, "#000000")
+                with Image.open(self.recipe.image.path) as image:
+                    self.assertEqual(image.size, (200, 200))
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
 
@@ -290,6 +827,46 @@ class RecipeImageUploadTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_upload_decompression_bomb(self):
+        """Test an image claiming a huge size is refused"""
+
+        url = image_upload_url(self.recipe.id)
+        bomb = SimpleUploadedFile("bomb.png", png_bomb(20000, 20000))
+
+        res = self.client.post(url, {"image": bomb}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("image", res.data)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(IMAGE_UPLOAD_FORMATS=("PNG",))
+    def test_upload_format_not_allowed(self):
+        """Test only the configured image formats can be uploaded"""
+
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
+            Image.new("RGB", (10, 10)).save(ntf, format="JPEG")
+            ntf.seek(0)
+            res = self.client.post(url, {"image": ntf}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(IMAGE_STORE_MAX_DIMENSION=50)
+    def test_large_upload_downscaled(self):
+        """Test images over the stored size limit are shrunk"""
+
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
+            Image.new("RGB", (200, 100)).save(ntf, format="JPEG")
+            ntf.seek(0)
+            res = self.client.post(url, {"image": ntf}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        with Image.open(self.recipe.image.path) as image:
+            self.assertEqual(image.size, (50, 25))
+
     def test_filter_recipes_by_tags(self):
         """Test retieving recipes with specific tags"""
 
@@ -335,3 +912,94 @@ class RecipeImageUploadTests(TestCase):
         self.assertNotIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertIn(serializer3.data, res.data)
+
+
+class RecipeListFilterTests(TestCase):
+    """Test range filters, ordering and cursor pages of the recipe list"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test@londonappdev.com",
+            "testpass"
+        )
+        self.client.force_authenticate(self.user)
+        self.recipes = [
+            sample_recipe(
+                user=self.user, title=f"Recipe {i}",
+                time_minutes=10 * (i % 4 + 1), price=5 * (i % 3 + 1)
+            )
+            for i in range(7)
+        ]
+
+    def ids(self, data):
+        return [recipe["id"] for recipe in data]
+
+    def test_range_filters(self):
+        """Test filtering recipes by time and price"""
+
+        res = self.client.get(
+            RECIPES_URL,
+            {"max_time": 20, "min_price": "10", "max_price": "15.00"}
+        )
+
+        expected = [
+            recipe.id for recipe in self.recipes
+            if recipe.time_minutes <= 20 and 10 <= recipe.price <= 15
+        ]
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(res.data), expected)
+
+    def test_ordering(self):
+        """Test ordering recipes by price, ties broken by id"""
+
+        res = self.client.get(RECIPES_URL, {"ordering": "-price"})
+
+        expected = sorted(
+            self.recipes, key=lambda recipe: (-recipe.price, -recipe.id)
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.ids(res.data), [recipe.id for recipe in expected]
+        )
+
+    def test_invalid_params(self):
+        """Test unknown orderings and non numeric ranges are rejected"""
+
+        for params in ({"ordering": "title"}, {"max_time": "soon"},
+                       {"min_price": "cheap"}, {"max_price": "NaN"}):
+            res = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pages(self):
+        """Test walking a sorted, filtered list page by page"""
+
+        expected = sorted(
+            (recipe for recipe in self.recipes if recipe.time_minutes <= 30),
+            key=lambda recipe: (recipe.time_minutes, recipe.id)
+        )
+
+        seen = []
+        res = self.client.get(
+            RECIPES_URL,
+            {"ordering": "time_minutes", "max_time": 30, "page_size": 2}
+        )
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data["results"]), 2)
+            seen += self.ids(res.data["results"])
+            if res.data["next"] is None:
+                break
+            res = self.client.get(res.data["next"])
+
+        self.assertEqual(seen, [recipe.id for recipe in expected])
+        self.assertEqual(res.data["count"], len(expected))
+        self.assertFalse(res.data["count_approximate"])
+
+    def test_invalid_cursor(self):
+        """Test a tampered cursor is rejected"""
+
+        res = self.client.get(RECIPES_URL, {"cursor": "bm90LWpzb24="})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
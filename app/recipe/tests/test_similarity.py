@@ -0,0 +1,153 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from core.models import Tag, Ingredient, Recipe
+
+from recipe import similarity
+from recipe.similarity import SimilarityIndex, get_index
+
+
+def sample_recipe(user, title="Recipe"):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class SimilarityIndexTests(TestCase):
+    """Test the recipe similarity index"""
+
+    def test_similar_ranked_by_jaccard(self):
+        """Test recipes are ranked by the overlap of their features"""
+
+        index = SimilarityIndex.from_rows(
+            [1, 2, 3, 4],
+            [(1, 1), (2, 1), (3, 1), (3, 2)],
+            [(1, 1), (1, 2), (2, 1), (2, 2), (3, 1)],
+        )
+
+        self.assertEqual(
+            index.similar(1, 10), [(2, 1.0), (3, 0.5)]
+        )
+        self.assertEqual(index.similar(1, 1), [(2, 1.0)])
+        self.assertEqual(index.similar(4, 10), [])
+
+    def test_update_and_remove(self):
+        """Test recipes can be changed without rebuilding"""
+
+        index = SimilarityIndex.from_rows([1, 2], [(1, 1), (2, 1)], [])
+
+        index.set_features(2, {similarity.ingredient_feature(1)})
+        self.assertEqual(index.similar(1, 10), [])
+
+        index.remove(2)
+        self.assertEqual(len(index), 1)
+
+    def test_links_counted(self):
+        """Test the index knows how many links it holds"""
+
+        index = SimilarityIndex.from_rows([1, 2], [(1, 1), (2, 1)], [(1, 1)])
+        self.assertEqual(index.links, 3)
+
+        index.set_features(1, {similarity.tag_feature(2)})
+        self.assertEqual(index.links, 2)
+        index.remove(2)
+        self.assertEqual(index.links, 1)
+
+    def test_query_waits_for_updates(self):
+        """Test a query doesn't read the index while it is updated"""
+
+        index = SimilarityIndex.from_rows([1, 2], [(1, 1), (2, 1)], [])
+        postings = dict(index.postings)
+        results = []
+        query = threading.Thread(
+            target=lambda: results.append(index.similar(1, 10))
+        )
+
+        with index.lock:
+            query.start()
+            query.join(0.1)
+            self.assertTrue(query.is_alive())
+            index.set_features(2, {similarity.tag_feature(1)})
+        query.join()
+
+        self.assertEqual(results, [[(2, 1.0)]])
+        self.assertEqual(dict(index.postings), postings)
+
+
+class SimilarityIndexSyncTests(TestCase):
+    """Test the loaded indexes follow database changes"""
+
+    def setUp(self):
+        similarity._indexes.clear()
+        self.user = get_user_model().objects.create_user(
+            "similar@test.com", "testpass"
+        )
+        self.tag = Tag.objects.create(user=self.user, name="Vegan")
+        self.recipe1 = sample_recipe(self.user)
+        self.recipe2 = sample_recipe(self.user)
+        self.recipe1.tags.add(self.tag)
+
+    def test_incremental_update(self):
+        """Test changes made by this process are applied in place"""
+
+        index = get_index(self.user)
+        self.assertEqual(index.similar(self.recipe1.pk, 10), [])
+
+        self.recipe2.tags.add(self.tag)
+        salt = Ingredient.objects.create(user=self.user, name="Salt")
+        self.recipe2.ingredients.add(salt)
+
+        with self.assertNumQueries(4):
+            updated = get_index(self.user)
+
+        self.assertIs(updated, index)
+        self.assertEqual(
+            index.similar(self.recipe1.pk, 10), [(self.recipe2.pk, 0.5)]
+        )
+
+        self.tag.delete()
+        self.assertEqual(get_index(self.user).similar(self.recipe1.pk, 10), [])
+
+    def test_rebuild_on_outside_change(self):
+        """Test the index is rebuilt after changes it didn't see"""
+
+        index = get_index(self.user)
+        Recipe.tags.through.objects.create(
+            recipe=self.recipe2, tag=self.tag
+        )
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            data_version=999
+        )
+
+        rebuilt = get_index(self.user)
+
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(
+            rebuilt.similar(self.recipe1.pk, 10), [(self.recipe2.pk, 1.0)]
+        )
+
+    @override_settings(SIMILARITY_INDEX_MAX_LINKS=2)
+    def test_indexes_bounded_by_links(self):
+        """Test the least recently used indexes go once over the limit"""
+
+        other = get_user_model().objects.create_user(
+            "other@test.com", "testpass"
+        )
+        recipe = sample_recipe(other)
+        recipe.tags.add(Tag.objects.create(user=other, name="Quick"))
+
+        get_index(self.user)
+        get_index(other)
+        self.assertEqual(list(similarity._indexes), [self.user.pk, other.pk])
+
+        Recipe.tags.through.objects.create(
+            recipe=recipe, tag=Tag.objects.create(user=other, name="Hot")
+        )
+        get_user_model().objects.filter(pk=other.pk).update(
+            data_version=999
+        )
+        get_index(other)
+
+        self.assertEqual(list(similarity._indexes), [other.pk])
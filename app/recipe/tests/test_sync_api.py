@@ -0,0 +1,142 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe, Tombstone
+
+
+SYNC_URL = reverse("recipe:sync")
+
+
+def sample_recipe(user, title="Recipe"):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class PublicSyncApiTests(TestCase):
+    """Test the unauthenticated sync API"""
+
+    def test_login_required(self):
+        """Test authentication is required to sync"""
+
+        res = APIClient().get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Test the delta sync API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "sync@test.com", "testpass"
+        )
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since=0, **params):
+        self.user.refresh_from_db()
+        return self.client.get(SYNC_URL, {"since": since, **params})
+
+    def test_full_then_delta_sync(self):
+        """Test a sync only returns what changed after the cursor"""
+
+        tag = Tag.objects.create(user=self.user, name="Vegan")
+        recipe = sample_recipe(self.user)
+        other = get_user_model().objects.create_user(
+            "other@test.com", "testpass"
+        )
+        sample_recipe(other)
+
+        res = self.sync()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([t["id"] for t in res.data["tags"]], [tag.id])
+        self.assertEqual([r["id"] for r in res.data["recipes"]], [recipe.id])
+        self.assertFalse(res.data["more"])
+        cursor = res.data["cursor"]
+
+        recipe.tags.add(tag)
+        salt = Ingredient.objects.create(user=self.user, name="Salt")
+        salt_id = salt.id
+        salt.delete()
+
+        res = self.sync(cursor)
+
+        self.assertEqual(res.data["tags"], [])
+        self.assertEqual(res.data["recipes"][0]["tags"], [tag.id])
+        self.assertEqual(
+            res.data["deleted"], [{"type": "ingredient", "id": salt_id}]
+        )
+        self.assertEqual(self.sync(res.data["cursor"]).data["recipes"], [])
+
+    def test_deleting_tag_changes_recipes(self):
+        """Test recipes losing a deleted tag are synced again"""
+
+        tag = Tag.objects.create(user=self.user, name="Vegan")
+        recipe = sample_recipe(self.user)
+        recipe.tags.add(tag)
+        cursor = self.sync().data["cursor"]
+
+        tag_id = tag.id
+        tag.delete()
+        res = self.sync(cursor)
+
+        self.assertEqual(res.data["deleted"], [{"type": "tag", "id": tag_id}])
+        self.assertEqual(res.data["recipes"][0]["tags"], [])
+
+    def test_pages(self):
+        """Test changes are returned in pages in change order"""
+
+        recipes = [sample_recipe(self.user, f"Recipe {n}") for n in range(5)]
+
+        res = self.sync(limit=2)
+        self.assertTrue(res.data["more"])
+        seen = [r["id"] for r in res.data["recipes"]]
+        while res.data["more"]:
+            res = self.sync(res.data["cursor"], limit=2)
+            seen += [r["id"] for r in res.data["recipes"]]
+
+        self.assertEqual(seen, [recipe.id for recipe in recipes])
+
+    def test_bulk_deleted_recipes_leave_tombstones(self):
+        """Test recipes deleted without signals are synced as deleted"""
+
+        recipe = sample_recipe(self.user)
+        cursor = self.sync().data["cursor"]
+
+        self.client.post(
+            reverse("recipe:recipe-bulk-delete"), {"ids": [recipe.id]},
+            format="json"
+        )
+        res = self.sync(cursor)
+
+        self.assertEqual(
+            res.data["deleted"], [{"type": "recipe", "id": recipe.id}]
+        )
+
+    def test_pruned_cursor_expired(self):
+        """Test a cursor older than pruned tombstones has to start over"""
+
+        sample_recipe(self.user).delete()
+        cursor = self.sync().data["cursor"]
+        sample_recipe(self.user).delete()
+        Tombstone.objects.update(
+            deleted=timezone.now() - timedelta(days=60)
+        )
+
+        call_command("prune_tombstones", days=30, stdout=StringIO())
+
+        self.assertFalse(Tombstone.objects.exists())
+        res = self.sync(cursor - 1)
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.sync().status_code, status.HTTP_200_OK)
@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -138,3 +138,84 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL, {"assigned_only": 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_autocomplete_tags(self):
+        """Test ?q= returns matching names ranked by usage"""
+
+        bread = Tag.objects.create(user=self.user, name="Bread")
+        breakfast = Tag.objects.create(user=self.user, name="Breakfast")
+        Tag.objects.create(user=self.user, name="Dinner")
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title="Omelette",
+            time_minutes=5,
+            price=10.00
+        )
+        recipe.tags.add(breakfast)
+
+        res = self.client.get(TAGS_URL, {"q": "bre"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [tag["id"] for tag in res.data], [breakfast.id, bread.id]
+        )
+
+    def test_tag_recipe_count(self):
+        """Test the recipe count follows links and deletions"""
+
+        tag = Tag.objects.create(user=self.user, name="Vegan")
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title="Salad",
+            time_minutes=5,
+            price=10.00
+        )
+        recipe.tags.add(tag)
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 1)
+
+        recipe.delete()
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 0)
+
+    def test_create_tag_too_long_once_normalized(self):
+        """Test a name growing past 255 characters when folded fails"""
+
+        res = self.client.post(TAGS_URL, {"name": "\ufdfa" * 200})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_create_tag_reuses_same_name(self):
+        """Test a name written differently reuses the existing tag"""
+
+        tag = Tag.objects.create(user=self.user, name="Vegan")
+
+        res = self.client.post(TAGS_URL, {"name": " VEGAN "})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["id"], tag.id)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(LIST_EXACT_COUNT_LIMIT=2)
+    def test_tags_paginated_with_count(self):
+        """Test ?limit= pages tags and reports how exact the count is"""
+
+        for name in ("Vegan", "Dessert", "Breakfast"):
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {"limit": 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["count"], 3)
+        self.assertFalse(res.data["count_approximate"])
+        self.assertEqual(
+            [tag["name"] for tag in res.data["results"]],
+            ["Vegan", "Dessert"]
+        )
+        self.assertIsNotNone(res.data["next"])
+
+        res = self.client.get(TAGS_URL, {"limit": 2, "q": "de"})
+
+        self.assertEqual(res.data["count"], 1)
+        self.assertEqual(res.data["results"][0]["name"], "Dessert")
@@ -12,5 +12,6 @@ router.register("recipes", views.RecipeViewSet)
 app_name = "recipe"
 
 urlpatterns = [
+    path("sync/", views.SyncView.as_view(), name="sync"),
     path("", include(router.urls))
 ]
@@ -1,14 +1,39 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F
+
 from rest_framework import viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import status
 
-from core.models import Tag, Ingredient, Recipe
+from core.authentication import ExpiringTokenAuthentication
+from core.deletion import delete_recipes, delete_recipes_in_batches
+from core.duplication import duplicate_recipes
+from core.idempotency import idempotent
+from core.linking import change_links
+from core.models import Tag, Ingredient, Recipe, Tombstone
+from core.sharding import user_counter
+from core.search import search_names
+from core.throttling import ReadRateThrottle, WriteRateThrottle, \
+    UploadRateThrottle
+from core.vocabulary import normalize_name
 
 from recipe import serializers
+from recipe.pagination import BoundedCountPagination, KeysetPagination
+from recipe.similarity import get_index
+from recipe.stats import recipe_stats
+
 
+# Each has a (user, field, id) index, see the Recipe model
+RECIPE_ORDERINGS = (
+    "id", "-id", "price", "-price", "time_minutes", "-time_minutes"
+)
 
 # We are useing mixitn to specify which module we are gonna use
 # As we don't need all mixins which comes by default
@@ -64,8 +89,10 @@ class BaseRecipeAttrViewSets(viewsets.GenericViewSet,
                              mixins.CreateModelMixin):
     """Base Viewset for user woned recipe attributes"""
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
+    throttle_classes = (ReadRateThrottle, WriteRateThrottle)
+    pagination_class = BoundedCountPagination
 
     # Useing get_querey as we don't wanna use default which will not filter
     # Any object and will retrun all
@@ -78,15 +105,42 @@ class BaseRecipeAttrViewSets(viewsets.GenericViewSet,
         )
         queryset = self.queryset
         if assigned_only:
-            """By defalut we can access reverse manaytomany relationships
-            foreing element by its smaller case model name (Recipe>recipe)
-            and isnull function will filter out all elements who don't have
-            recipe element"""
-            queryset = queryset.filter(recipe__isnull=False)
-
-        return queryset.filter(
-            user=self.request.user
-        ).order_by("-name").distinct()
+            # recipe_count is kept by signals, so this needs neither a
+            # join on the recipe links nor a DISTINCT over them
+            queryset = queryset.filter(recipe_count__gt=0)
+
+        queryset = queryset.filter(user=self.request.user)
+
+        # ?q= autocompletes names, returning a few ranked matches
+        term = self.request.query_params.get("q", "").strip()
+        if term:
+            return search_names(queryset, term)[:settings.AUTOCOMPLETE_LIMIT]
+
+        return queryset.order_by("-name")
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a tag or ingredient, once per Idempotency-Key
+
+        A user has one row per normalized name. Posting a name the user
+        already has, however it is written, creates nothing: the response
+        is a 200 with the existing row instead of a 201.
+        """
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        name = normalize_name(serializer.validated_data["name"])
+        existing = self.queryset.filter(
+            user=self.request.user, canonical__name=name
+        ).first()
+        if existing is not None:
+            return Response(self.get_serializer(existing).data)
+
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
 
     def perform_create(self, serializer):
         """Create a new object to the database"""
@@ -116,13 +170,52 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication, )
+    authentication_classes = (ExpiringTokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    throttle_classes = (
+        ReadRateThrottle, WriteRateThrottle, UploadRateThrottle
+    )
+    pagination_class = KeysetPagination
 
-    def _params_to_ints(self, qs):
+    def _params_to_ints(self, qs, name):
         """Cnvert a list of string IDs to a list of integers"""
 
-        return [int(str_id) for str_id in qs.split(",")]
+        try:
+            return [int(str_id) for str_id in qs.split(",")]
+        except ValueError:
+            raise ValidationError({name: "Must be comma separated ids"})
+
+    def get_ordering(self):
+        """Return the list ordering asked for with ?ordering="""
+
+        ordering = self.request.query_params.get("ordering", "id")
+        if ordering not in RECIPE_ORDERINGS:
+            raise ValidationError({
+                "ordering": f"Must be one of {', '.join(RECIPE_ORDERINGS)}"
+            })
+
+        return ordering
+
+    def _range_filters(self):
+        """Return the lookups of the ?max_time= and price range filters"""
+
+        lookups = {}
+        for param, lookup, convert in (
+                ("max_time", "time_minutes__lte", int),
+                ("min_price", "price__gte", Decimal),
+                ("max_price", "price__lte", Decimal)):
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                value = convert(value)
+            except (ValueError, ArithmeticError):
+                value = None
+            if value is None or not Decimal(value).is_finite():
+                raise ValidationError({param: "Must be a number"})
+            lookups[lookup] = value
+
+        return lookups
 
     def get_queryset(self):
         """Retireve the recipe for the authenticated user"""
@@ -134,19 +227,27 @@ class RecipeViewSet(viewsets.ModelViewSet):
         queryset = self.queryset
 
         # tags and/or ingredients didn't recieve any query will return None
+        # Links are matched in a subquery, joining them would repeat a
+        # recipe once per matching tag or ingredient
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            """Here doube undercore __ is for filtering by the forign key id
-            as our recipe has tags foreing key and __ syntax to access this id
-            and again __ in for calling the function in that returns all
-            recipe that contains that certain ID"""
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            tag_ids = self._params_to_ints(tags, "tags")
+            queryset = queryset.filter(
+                pk__in=Recipe.tags.through.objects
+                .filter(tag_id__in=tag_ids).values("recipe_id")
+            )
 
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            ingredient_ids = self._params_to_ints(ingredients, "ingredients")
+            queryset = queryset.filter(
+                pk__in=Recipe.ingredients.through.objects
+                .filter(ingredient_id__in=ingredient_ids).values("recipe_id")
+            )
+
+        ordering = self.get_ordering()
+        tiebreak = "-id" if ordering.startswith("-") else "id"
 
-        return queryset.filter(user=self.request.user)
+        return queryset.filter(user=self.request.user) \
+            .filter(**self._range_filters()).order_by(ordering, tiebreak)
 
     def get_serializer_class(self):
         """Return appropriate serializer clss"""
@@ -155,9 +256,32 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeDetailSerializer
         elif self.action == "upload_image":
             return serializers.RecipeImageSerializer
+        elif self.action in ("bulk_delete", "bulk_duplicate"):
+            return serializers.RecipeIdsSerializer
+        elif self.action == "links":
+            return serializers.RecipeLinksSerializer
+        elif self.action == "bulk_links":
+            return serializers.RecipeLinksBulkSerializer
+        elif self.action == "similar":
+            return serializers.SimilarRecipeSerializer
+        elif self.action == "cookable":
+            return serializers.CookableRecipeSerializer
 
         return self.serializer_class
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a recipe, once per Idempotency-Key"""
+
+        return super().create(request, *args, **kwargs)
+
+    # PATCH goes through update too
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        """Update a recipe, once per Idempotency-Key"""
+
+        return super().update(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """Create a new recipe"""
         """Modelserializer know how to create new object to our model as we
@@ -168,6 +292,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     # here url path is the path that is visible in the url
     @action(methods=["POST"], detail=True, url_path="upload-image")
+    @idempotent
     def upload_image(self, request, pk=None):
         """Upload an imet to a recipe"""
 
@@ -189,3 +314,280 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(methods=["POST"], detail=False, url_path="bulk-delete")
+    def bulk_delete(self, request):
+        """Delete many recipes, in the background for large selections"""
+
+        serializer = self.get_serializer(data=request.data)
+
+        if serializer.is_valid():
+            ids = serializer.validated_data["ids"]
+
+            if len(ids) <= settings.DELETION_BATCH_SIZE:
+                delete_recipes_in_batches(
+                    self.get_queryset().filter(pk__in=ids)
+                )
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+            delete_recipes.delay(request.user.pk, ids)
+            return Response(
+                {"queued": len(ids)},
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(methods=["POST"], detail=True)
+    @idempotent
+    def duplicate(self, request, pk=None):
+        """Copy a recipe with its tags, ingredients and image"""
+
+        recipe = self.get_object()
+        copies = duplicate_recipes(request.user.pk, [recipe.pk])
+        copy = Recipe.objects.get(pk=copies[recipe.pk])
+        serializer = serializers.RecipeSerializer(copy)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(methods=["POST"], detail=False, url_path="bulk-duplicate")
+    @idempotent
+    def bulk_duplicate(self, request):
+        """Copy many recipes, returning the id of each copy"""
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        if len(ids) > settings.RECIPE_DUPLICATE_MAX:
+            return Response(
+                {"ids": f"At most {settings.RECIPE_DUPLICATE_MAX} recipes"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        copies = duplicate_recipes(request.user.pk, ids)
+
+        return Response(
+            {"copies": [
+                {"source": source, "id": copy}
+                for source, copy in copies.items()
+            ]},
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(methods=["PATCH"], detail=True)
+    def links(self, request, pk=None):
+        """Add or remove some tags and ingredients of a recipe
+
+        Takes tags_add, tags_remove, ingredients_add and
+        ingredients_remove lists of ids, other links are left alone.
+        """
+
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        change_links(request.user.pk, [recipe.pk], **serializer.validated_data)
+
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        serializer = serializers.RecipeSerializer(recipe)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=["PATCH"], detail=False, url_path="bulk-links")
+    def bulk_links(self, request):
+        """Add or remove tags and ingredients of many recipes at once"""
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.pop("ids")
+        recipe_ids = list(
+            Recipe.objects.filter(user=request.user, pk__in=ids)
+            .values_list("pk", flat=True)
+        )
+        changed = change_links(
+            request.user.pk, recipe_ids, **serializer.validated_data
+        )
+
+        return Response(
+            {"recipes": len(recipe_ids), "changed": changed},
+            status=status.HTTP_200_OK
+        )
+
+    @action(methods=["GET"], detail=False)
+    def stats(self, request):
+        """Return statistics of the recipes matching the filters"""
+
+        # Built first so bad filters are rejected before the cache
+        queryset = self.get_queryset()
+
+        # The key changes with the user's data version, so stale stats
+        # are never served after a recipe, tag or ingredient changes
+        filters = [
+            ",".join(sorted(set(request.query_params.get(name, "")
+                                .split(","))))
+            for name in ("tags", "ingredients")
+        ] + [
+            f"{lookup}={value}"
+            for lookup, value in sorted(self._range_filters().items())
+        ]
+        key = "recipe-stats:{}:{}:{}".format(
+            request.user.pk, user_counter(request.user, "data_version"),
+            ":".join(filters)
+        )
+
+        data = cache.get(key)
+        if data is None:
+            data = recipe_stats(queryset)
+            cache.set(key, data, settings.RECIPE_STATS_CACHE_SECONDS)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(methods=["GET"], detail=True)
+    def similar(self, request, pk=None):
+        """Return the user's recipes most similar to a recipe"""
+
+        recipe = self.get_object()
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        limit = max(1, min(limit, settings.SIMILAR_RECIPES_MAX))
+
+        scores = dict(get_index(request.user).similar(recipe.pk, limit))
+        recipes = Recipe.objects.filter(pk__in=scores) \
+            .prefetch_related("tags", "ingredients")
+        for similar in recipes:
+            similar.similarity = round(scores[similar.pk], 4)
+        recipes = sorted(recipes, key=lambda r: (-r.similarity, r.pk))
+
+        serializer = self.get_serializer(recipes, many=True)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=["GET"], detail=False)
+    def cookable(self, request):
+        """Return recipes that can be cooked with the given ingredients
+
+        ?have=1,2,3 lists the ingredients at hand, ?missing=N also
+        returns recipes lacking up to N ingredients, listed in "missing".
+        """
+
+        have = self._params_to_ints(
+            request.query_params.get("have", ""), "have"
+        )
+        try:
+            missing = int(request.query_params.get("missing", 0))
+        except ValueError:
+            return Response(
+                {"detail": "missing must be a number"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        missing = max(missing, 0)
+        limit = settings.COOKABLE_RECIPES_MAX
+
+        # Only recipes linked to an ingredient at hand are visited, and a
+        # recipe is covered when its matches reach its ingredient count
+        matched = dict(
+            self.get_queryset().filter(ingredients__in=have)
+            .annotate(matched=Count("ingredients"))
+            .filter(matched__gte=F("ingredient_count") - missing)
+            .annotate(lacking=F("ingredient_count") - F("matched"))
+            .order_by("lacking", "pk")
+            .values_list("pk", "lacking")[:limit]
+        )
+        # Recipes with no ingredient at hand but few enough to buy
+        matched.update(
+            self.get_queryset().filter(ingredient_count__lte=missing)
+            .exclude(pk__in=matched)
+            .exclude(ingredients__in=have)
+            .order_by("ingredient_count", "pk")
+            .values_list("pk", "ingredient_count")[:limit]
+        )
+
+        recipes = Recipe.objects.filter(pk__in=matched) \
+            .prefetch_related("tags", "ingredients")
+        recipes = sorted(recipes, key=lambda r: (matched[r.pk], r.pk))
+        recipes = recipes[:limit]
+
+        for recipe in recipes:
+            recipe.missing = [
+                ingredient for ingredient in recipe.ingredients.all()
+                if ingredient.pk not in have
+            ] if matched[recipe.pk] else []
+
+        serializer = self.get_serializer(recipes, many=True)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class SyncView(APIView):
+    """Return what changed in the user's recipes, tags and ingredients
+
+    ?since= is the cursor returned by the previous call, 0 for a full
+    sync. Changes come in change number order, in pages of at most
+    SYNC_PAGE_SIZE; "more" says another call is needed.
+    """
+
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    throttle_classes = (ReadRateThrottle, WriteRateThrottle)
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get("since", 0))
+            limit = int(
+                request.query_params.get("limit", settings.SYNC_PAGE_SIZE)
+            )
+        except ValueError:
+            return Response(
+                {"detail": "since and limit must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, settings.SYNC_PAGE_SIZE))
+
+        if 0 < since < user_counter(request.user, "sync_floor"):
+            # Deletions after the cursor may have been pruned
+            return Response(
+                {"detail": "Cursor expired, sync from 0", "reset": True},
+                status=status.HTTP_410_GONE
+            )
+
+        sources = (
+            ("recipes", Recipe.objects.filter(user=request.user)
+             .prefetch_related("tags", "ingredients")),
+            ("tags", Tag.objects.filter(user=request.user)),
+            ("ingredients", Ingredient.objects.filter(user=request.user)),
+            ("deleted", Tombstone.objects.filter(user_id=request.user.pk)),
+        )
+        # One more row than needed from each source tells if there are
+        # more changes after this page
+        changes = sorted(
+            (
+                (row.seq, key, row)
+                for key, queryset in sources
+                for row in queryset.filter(seq__gt=since)
+                .order_by("seq")[:limit + 1]
+            ),
+            key=lambda change: change[0]
+        )
+        page = changes[:limit]
+
+        rows = {key: [] for key, _ in sources}
+        for _, key, row in page:
+            rows[key].append(row)
+
+        return Response({
+            "cursor": page[-1][0] if page else since,
+            "more": len(changes) > limit,
+            "recipes": serializers.RecipeSerializer(
+                rows["recipes"], many=True).data,
+            "tags": serializers.TagSerializer(rows["tags"], many=True).data,
+            "ingredients": serializers.IngredientSerializer(
+                rows["ingredients"], many=True).data,
+            "deleted": [
+                {"type": row.kind, "id": row.object_id}
+                for row in rows["deleted"]
+            ],
+        }, status=status.HTTP_200_OK)
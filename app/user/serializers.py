@@ -21,6 +21,19 @@ class UserSerializser(serializers.ModelSerializer):
             }
         }
 
+    def validate_email(self, email):
+        """Reject emails already taken in another case"""
+
+        users = get_user_model().objects.with_email(email)
+        if self.instance is not None:
+            users = users.exclude(pk=self.instance.pk)
+        if users.exists():
+            raise serializers.ValidationError(
+                _("user with this email already exists.")
+            )
+
+        return email
+
     def create(self, validated_data):
         """we are overriding default create to use our
             encripted password method"""
@@ -54,6 +67,10 @@ class AuthTokenSerializer(serializers.Serializer):
         style={"input_type": "password"},
         trim_whitespace=False  # as Sometimes django can trim space by default
     )
+    # Names the token, defaults to the client's user agent
+    device = serializers.CharField(
+        max_length=255, required=False, allow_blank=True
+    )
 
     # this method validate inputs
     def validate(self, attrs):
@@ -1,14 +1,24 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.models import AuthToken, Task
+
 
 CREATE_USER_URL = reverse("user:create")
 TOKEN_URL = reverse("user:token")
 ME_URL = reverse("user:me")
+REVOKE_URL = reverse("user:token-revoke")
 
 # defining create here to access it from all classes bellow
 
@@ -19,6 +29,18 @@ def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
 
+def use_own_throttle_store(test):
+    """Give the test empty throttle buckets of its own"""
+
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    store = override_settings(
+        THROTTLE_STORE_PATH=os.path.join(tmp.name, "buckets")
+    )
+    store.enable()
+    test.addCleanup(store.disable)
+
+
 class PublicUserApiTests(TestCase):
     """Test the user API which don't require login"""
 
@@ -26,6 +48,7 @@ class PublicUserApiTests(TestCase):
         """Setup method for makigin its attribute available to every method"""
 
         self.client = APIClient()
+        use_own_throttle_store(self)
 
     def test_create_valid_user_success(self):
         """Test create api with valid payload is successful"""
@@ -88,6 +111,31 @@ class PublicUserApiTests(TestCase):
         self.assertIn("token", res.data)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
+    def test_create_token_email_any_case(self):
+        """Test logging in with the email in a different case"""
+
+        create_user(email="Test.User@Email.com", password="testPass123")
+        res = self.client.post(TOKEN_URL, {
+            "email": "test.user@EMAIL.com",
+            "password": "testPass123"
+        })
+
+        self.assertIn("token", res.data)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_create_user_email_taken_in_other_case(self):
+        """Test an email differing only by case can't be registered"""
+
+        create_user(email="test@email.com", password="testPass123")
+        res = self.client.post(CREATE_USER_URL, {
+            "email": "TEST@email.com",
+            "password": "testPass123",
+            "name": "Test"
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(get_user_model().objects.count(), 1)
+
     def test_create_token_invalid_credentials(self):
         """Thes with in valid user and password"""
 
@@ -183,3 +231,107 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.name, payload["name"])
         self.assertTrue(self.user.check_password(payload["password"]))
+
+    def test_delete_account(self):
+        """Test deleting the account deactivates it and queues the rest"""
+
+        res = self.client.delete(ME_URL)
+
+        self.user.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(Task.objects.exists())
+
+
+class AuthTokenTests(TestCase):
+    """Test per device tokens that expire"""
+
+    def setUp(self):
+        self.payload = {"email": "test@email.com", "password": "testPass123"}
+        self.user = create_user(**self.payload)
+        self.client = APIClient()
+        use_own_throttle_store(self)
+
+    def login(self, data=None, **extra):
+        res = self.client.post(TOKEN_URL, {**self.payload, **(data or {})},
+                               **extra)
+        return AuthToken.objects.get(key=res.data["token"])
+
+    def get_me(self, token):
+        return self.client.get(ME_URL, HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_token_per_device(self):
+        """Test each login gets its own token named after the device"""
+
+        phone = self.login({"device": "Phone"})
+        laptop = self.login(HTTP_USER_AGENT="Laptop")
+
+        self.assertNotEqual(phone.key, laptop.key)
+        self.assertEqual(phone.device, "Phone")
+        self.assertEqual(laptop.device, "Laptop")
+        self.assertEqual(self.get_me(phone.key).status_code, 200)
+        self.assertEqual(self.get_me(laptop.key).status_code, 200)
+
+    def test_expired_token_rejected(self):
+        """Test tokens stop working once expired"""
+
+        token = self.login()
+        AuthToken.objects.filter(pk=token.pk).update(
+            expires=timezone.now() - timedelta(seconds=1)
+        )
+
+        res = self.get_me(token.key)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_renewed_after_interval(self):
+        """Test use extends a token, writing at most once per interval"""
+
+        token = self.login()
+
+        self.get_me(token.key)
+        unchanged = AuthToken.objects.get(pk=token.pk)
+        self.assertEqual(unchanged.expires, token.expires)
+
+        old = timezone.now() - timedelta(days=2)
+        AuthToken.objects.filter(pk=token.pk).update(
+            last_used=old, expires=old + timedelta(days=30)
+        )
+        self.get_me(token.key)
+
+        renewed = AuthToken.objects.get(pk=token.pk)
+        self.assertGreater(renewed.last_used, old)
+        self.assertGreater(renewed.expires, token.expires)
+
+    def test_revoke_token(self):
+        """Test logging a device out leaves the other devices logged in"""
+
+        phone = self.login({"device": "Phone"})
+        laptop = self.login({"device": "Laptop"})
+
+        res = self.client.post(
+            REVOKE_URL, HTTP_AUTHORIZATION=f"Token {phone.key}"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(AuthToken.objects.filter(pk=phone.pk).exists())
+        self.assertEqual(self.get_me(phone.key).status_code, 401)
+        self.assertEqual(self.get_me(laptop.key).status_code, 200)
+
+    def test_purge_tokens(self):
+        """Test the purge command deletes expired tokens only"""
+
+        kept = self.login()
+        expired = self.login()
+        AuthToken.objects.filter(pk=expired.pk).update(
+            expires=timezone.now() - timedelta(days=1)
+        )
+
+        out = StringIO()
+        call_command("purge_tokens", batch_size=1, stdout=out)
+
+        self.assertIn("Purged 1 tokens", out.getvalue())
+        self.assertEqual(
+            list(AuthToken.objects.values_list("key", flat=True)),
+            [kept.key]
+        )
@@ -1,9 +1,15 @@
 from rest_framework import generics
-from rest_framework import authentication
 from rest_framework import permissions
+from rest_framework import status
+from rest_framework.response import Response
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
+from core.authentication import ExpiringTokenAuthentication, issue_token
+from core.deletion import deactivate_user
+from core.throttling import LoginRateThrottle, ReadRateThrottle, \
+    WriteRateThrottle
+
 from user.serializers import UserSerializser
 from user.serializers import AuthTokenSerializer
 
@@ -12,24 +18,60 @@ class CreateUserView(generics.CreateAPIView):
     """Create a new user in the system"""
 
     serializer_class = UserSerializser
+    throttle_classes = (LoginRateThrottle,)
 
 
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for the user"""
 
     serializer_class = AuthTokenSerializer
+    throttle_classes = (LoginRateThrottle,)
 
     # renderer_classes to render browseble view
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """Issue a token for a device, each login getting its own"""
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        device = serializer.validated_data.get("device") or \
+            request.META.get("HTTP_USER_AGENT", "")
+        token = issue_token(serializer.validated_data["user"], device)
+
+        return Response({"token": token.key, "expires": token.expires})
+
+
+class RevokeTokenView(generics.GenericAPIView):
+    """Log the device out by deleting the token it authenticated with"""
+
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (WriteRateThrottle,)
+
+    def post(self, request, *args, **kwargs):
+        """Delete the token of the request, other devices stay logged in"""
+
+        request.auth.delete()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Mange the authenticatited user"""
 
     serializer_class = UserSerializser
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (ReadRateThrottle, WriteRateThrottle)
 
     def get_object(self):
         """Related object (here user)"""
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the account and delete its data in the background"""
+
+        deactivate_user(self.get_object())
+
+        return Response(status=status.HTTP_202_ACCEPTED)